@@ -0,0 +1,66 @@
+# Рассылка событий подписчикам потока /api/telegram/stream (Server-Sent Events).
+# Подписчики и события живут в памяти процесса: событие получают браузеры,
+# подключенные к тому же процессу, в пуле которого находится клиент Telegram.
+# Поэтому поток работает только с одним воркером gunicorn (при нескольких воркерах
+# gunicorn.conf.py выключает его, и интерфейс опрашивает сервер).
+import os
+import queue
+import threading
+
+# Сколько событий может ждать отправки одному подписчику. Если подписчик не успевает
+# их читать, очередь очищается и ему отправляется событие resync (перезагрузить данные)
+EVENT_STREAM_QUEUE_SIZE = int(os.environ.get('EVENT_STREAM_QUEUE_SIZE', 1000))
+
+# Максимальное количество одновременно открытых потоков в процессе. Каждый поток занимает
+# поток обработчика gunicorn, поэтому по умолчанию - четверть GUNICORN_THREADS, чтобы
+# остальные запросы всегда обслуживались. Сверх лимита (и при 0) поток не открывается,
+# и браузер опрашивает сервер
+EVENT_STREAM_MAX_SUBSCRIBERS = int(os.environ.get(
+    'EVENT_STREAM_MAX_SUBSCRIBERS', int(os.environ.get('GUNICORN_THREADS', 100)) // 4
+))
+
+# user_id -> очереди подписчиков (по одной на открытое соединение)
+_subscribers = {}
+_subscriber_count = 0
+_lock = threading.Lock()
+
+
+def subscribe(user_id):
+    """
+    Подписаться на события пользователя. Возвращает очередь событий (имя события, данные)
+    или None, если открыто уже EVENT_STREAM_MAX_SUBSCRIBERS потоков
+    """
+    global _subscriber_count
+    subscription = queue.Queue(maxsize=EVENT_STREAM_QUEUE_SIZE)
+    with _lock:
+        if _subscriber_count >= EVENT_STREAM_MAX_SUBSCRIBERS:
+            return None
+        _subscribers.setdefault(user_id, set()).add(subscription)
+        _subscriber_count += 1
+    return subscription
+
+
+def unsubscribe(user_id, subscription):
+    """Отписаться от событий пользователя"""
+    global _subscriber_count
+    with _lock:
+        subscriptions = _subscribers.get(user_id)
+        if subscriptions is not None and subscription in subscriptions:
+            subscriptions.discard(subscription)
+            _subscriber_count -= 1
+            if not subscriptions:
+                del _subscribers[user_id]
+
+
+def publish(user_id, event, payload):
+    """Отправить событие всем подписчикам пользователя (вызывается из любого потока)"""
+    with _lock:
+        subscriptions = list(_subscribers.get(user_id, ()))
+    for subscription in subscriptions:
+        try:
+            subscription.put_nowait((event, payload))
+        except queue.Full:
+            # Подписчик отстал: пропущенные события заменяем просьбой перезагрузить данные
+            with subscription.mutex:
+                subscription.queue.clear()
+            subscription.put_nowait(('resync', {}))
@@ -0,0 +1,204 @@
+import os
+import logging
+import asyncio
+from datetime import datetime, timedelta
+
+from backend import telegram_pool
+from backend.models import (
+    batch, claim_mass_sending, datetime_to_str, get_chats, get_contacts, get_peer, get_telegram_account,
+    get_unfinished_mass_sendings, save_chat, save_message, save_peers_bulk, update_mass_sending,
+    update_statistics
+)
+from backend.telegram_api import peer_key, send_message_to_contact, submit
+
+# Фоновое выполнение массовых рассылок (POST /api/telegram/mass-sendings).
+# Рассылки выполняются задачами в общем цикле событий telegram_api и не занимают потоки запросов.
+# Ход рассылки (sent_count, failed_count, status) сохраняется после каждого сообщения, а процесс,
+# который ее выполняет, держит ее захваченной (locked_until). Если процесс остановился,
+# рассылку с того же места продолжит любой процесс, когда захват истечет
+
+logger = logging.getLogger(__name__)
+
+# Как часто искать новые рассылки и рассылки остановившихся процессов, в секундах
+MASS_SENDING_POLL_INTERVAL = int(os.environ.get('MASS_SENDING_POLL_INTERVAL', 30))
+
+# Запас времени захвата рассылки сверх паузы до следующего сообщения, в секундах
+MASS_SENDING_LEASE = int(os.environ.get('MASS_SENDING_LEASE', 120))
+
+# ID рассылки -> задача, которая выполняет ее в этом процессе
+_running = {}
+
+# Фоновая задача поиска рассылок
+_poll_task = None
+
+def start():
+    """
+    Запускает выполнение незавершенных рассылок (вызывается при запуске воркера и после создания рассылки).
+    Можно вызывать из любого потока
+    """
+    submit(_start())
+
+async def _start():
+    """Запускает периодический поиск рассылок или, если он уже работает, ищет их сразу"""
+    global _poll_task
+    if _poll_task is None or _poll_task.done():
+        _poll_task = asyncio.ensure_future(_poll())
+    else:
+        await _pick_up()
+
+async def _poll():
+    """Периодически ищет рассылки, которые никто не выполняет"""
+    while True:
+        try:
+            await _pick_up()
+        except Exception as e:
+            logger.error(f"Ошибка при поиске массовых рассылок: {str(e)}")
+        await asyncio.sleep(MASS_SENDING_POLL_INTERVAL)
+
+def _interval(mass_sending):
+    """Пауза между сообщениями: не меньше delay секунд и не больше frequency сообщений в минуту"""
+    frequency = mass_sending.get('frequency') or 0
+    return max(mass_sending.get('delay') or 0, 60 / frequency if frequency > 0 else 0)
+
+def _lease(seconds):
+    """Момент окончания захвата рассылки, если следующее сообщение будет отправлено через seconds секунд"""
+    return datetime_to_str(datetime.utcnow() + timedelta(seconds=seconds + MASS_SENDING_LEASE))
+
+async def _pick_up():
+    """Захватывает незавершенные рассылки, которые никто не выполняет, и запускает их"""
+    loop = asyncio.get_running_loop()
+    for mass_sending in await loop.run_in_executor(None, get_unfinished_mass_sendings):
+        mass_sending_id = mass_sending['id']
+        if mass_sending_id in _running:
+            continue
+        claimed = await loop.run_in_executor(
+            None, claim_mass_sending, mass_sending_id, _lease(_interval(mass_sending))
+        )
+        if claimed is None:
+            # Рассылку выполняет другой процесс
+            continue
+        task = _running[mass_sending_id] = asyncio.ensure_future(_run(claimed))
+        task.add_done_callback(lambda _, mass_sending_id=mass_sending_id: _running.pop(mass_sending_id, None))
+
+def _load_recipients(account_id):
+    """Контакты аккаунта по ID и чаты аккаунта по ID контакта"""
+    contacts = {contact['id']: contact for contact in get_contacts(account_id)}
+    chats = {chat['contact_id']: chat for chat in get_chats(account_id)}
+    return contacts, chats
+
+async def _run(mass_sending):
+    """Отправляет сообщение рассылки получателям, которым оно еще не отправлялось"""
+    loop = asyncio.get_running_loop()
+    mass_sending_id = mass_sending['id']
+    interval = _interval(mass_sending)
+    recipients = mass_sending.get('contacts') or []
+    sent_count = mass_sending.get('sent_count') or 0
+    failed_count = mass_sending.get('failed_count') or 0
+
+    try:
+        account = await loop.run_in_executor(None, get_telegram_account, mass_sending['account_id'])
+        if account is None:
+            raise ValueError('Аккаунт не найден')
+        contacts, chats = await loop.run_in_executor(None, _load_recipients, account['id'])
+
+        # Без сохраненной сессии сообщения сохраняются только локально, как в send_message
+        telegram = bool(account.get('api_id') and account.get('api_hash') and account.get('session_string'))
+        if telegram:
+            try:
+                connection = await telegram_pool.get_client(account)
+            except Exception as e:
+                connection = {'error': str(e)}
+            if connection.get('success') and not connection.get('authorized'):
+                raise ValueError('Аккаунт не авторизован в Telegram')
+            if not connection.get('success'):
+                # Подключиться не удалось (сбой сети, прогрев пула) - освобождаем рассылку,
+                # _poll повторит ее позже с того же получателя
+                logger.warning(f"Рассылка {mass_sending_id} отложена: {connection.get('error')}")
+                await loop.run_in_executor(None, lambda: update_mass_sending(mass_sending_id, locked_until=None))
+                return
+
+        logger.info(f"Рассылка {mass_sending_id} выполняется с получателя {sent_count + failed_count + 1} "
+                    f"из {len(recipients)}")
+        for position in range(sent_count + failed_count, len(recipients)):
+            if position > 0:
+                await asyncio.sleep(interval)
+            contact_id = recipients[position]
+            try:
+                if telegram:
+                    await _send_telegram(mass_sending_id, account, contacts, chats, contact_id,
+                                         mass_sending['message'], interval)
+                else:
+                    await loop.run_in_executor(None, _send_local, account, contacts, chats, contact_id,
+                                               mass_sending['message'])
+                sent_count += 1
+            except Exception as e:
+                failed_count += 1
+                logger.warning(f"Рассылка {mass_sending_id}: не удалось отправить сообщение контакту {contact_id}: {str(e)}")
+            await loop.run_in_executor(None, lambda: update_mass_sending(
+                mass_sending_id, sent_count=sent_count, failed_count=failed_count, locked_until=_lease(interval)
+            ))
+
+        status = 'completed' if sent_count or not recipients else 'failed'
+        await loop.run_in_executor(None, lambda: update_mass_sending(mass_sending_id, status=status, locked_until=None))
+        logger.info(f"Рассылка {mass_sending_id} завершена: отправлено {sent_count}, ошибок {failed_count}")
+    except Exception as e:
+        logger.error(f"Рассылка {mass_sending_id} остановлена: {str(e)}")
+        await loop.run_in_executor(None, lambda: update_mass_sending(
+            mass_sending_id, status='failed', error=str(e), locked_until=None
+        ))
+
+async def _send_telegram(mass_sending_id, account, contacts, chats, contact_id, text, interval):
+    """Отправляет сообщение рассылки контакту через клиент аккаунта из пула"""
+    loop = asyncio.get_running_loop()
+    contact = contacts.get(contact_id)
+    if contact is None:
+        raise ValueError('контакт не найден')
+    chat = chats.get(contact_id)
+    # Получатель: пользователь Telegram из списка контактов, собеседник диалога или номер телефона
+    entity = contact.get('telegram_id') or (chat or {}).get('telegram_entity_id') or contact.get('phone')
+    if not entity:
+        raise ValueError('у контакта нет ID Telegram и номера телефона')
+
+    peer = await loop.run_in_executor(None, get_peer, account['id'], peer_key(entity))
+    while True:
+        # Клиент мог быть отключен пулом за время паузы
+        await telegram_pool.get_client(account)
+        result = await send_message_to_contact(account['phone'], entity, text, peer=peer)
+        if result.get('peers'):
+            await loop.run_in_executor(None, save_peers_bulk, account['id'], result['peers'])
+        if not result.get('flood_wait'):
+            break
+        # Telegram ограничил частоту отправки - ждем и отправляем этому же контакту повторно
+        await loop.run_in_executor(None, lambda: update_mass_sending(
+            mass_sending_id, locked_until=_lease(result['flood_wait'] + interval)
+        ))
+        await asyncio.sleep(result['flood_wait'])
+    if 'error' in result:
+        raise ValueError(result['error'])
+
+    def store():
+        with batch():
+            if chat is not None:
+                save_message(chat['id'], account['user_id'], text, telegram_id=result.get('message_id'))
+            update_statistics(account['id'], sent=1)
+    await loop.run_in_executor(None, store)
+
+def _send_local(account, contacts, chats, contact_id, text):
+    """Сохраняет сообщение рассылки в чате контакта (аккаунт без подключения к Telegram)"""
+    if contact_id not in contacts:
+        raise ValueError('контакт не найден')
+    with batch():
+        chat = chats.get(contact_id)
+        if chat is None:
+            chat = chats[contact_id] = {'id': save_chat(account['id'], contact_id), 'contact_id': contact_id}
+        save_message(chat['id'], account['user_id'], text)
+        update_statistics(account['id'], sent=1)
+
+def _reset_after_fork():
+    """В дочернем процессе рассылки начинаются заново (задачи принадлежат циклу родителя)"""
+    global _poll_task
+    _running.clear()
+    _poll_task = None
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=_reset_after_fork)
@@ -0,0 +1,525 @@
+# Архив сообщений JSON-хранилища.
+# Сообщения каждого чата дописываются в отдельный файл-сегмент <chat_id>.log
+# (одна строка JSON на сообщение). Редактирование дописывает новую версию
+# сообщения в конец сегмента, действующей считается последняя.
+# В памяти держатся только открытые чаты (не больше ARCHIVE_OPEN_CHATS, вытесняются
+# давно не использованные): последние MESSAGE_HOT_SET_SIZE сообщений и разреженный
+# индекс смещений (каждое ARCHIVE_INDEX_INTERVAL-е сообщение), по которому более
+# старые страницы читаются из сегмента через mmap.
+# Индекс чата сохраняется рядом с сегментом: <chat_id>.idx (разреженный индекс и
+# обработанная часть сегмента), <chat_id>.tg (ID в Telegram -> ID сообщения) и
+# <chat_id>.edits (ID отредактированного сообщения -> смещение последней версии).
+# Пары в .tg и .edits отсортированы по ключу и ищутся двоичным поиском через mmap,
+# в памяти остаются только пары, появившиеся после последнего сохранения индекса.
+# Открытие чата читает индекс и только строки сегмента, дописанные после его сохранения.
+# Функции модуля вызываются из backend/models.py под блокировкой хранилища.
+from collections import OrderedDict, deque
+from bisect import bisect_left, bisect_right
+import json
+import mmap
+import os
+import shutil
+import struct
+
+# Количество последних сообщений чата, которые держатся в памяти
+MESSAGE_HOT_SET_SIZE = int(os.environ.get('MESSAGE_HOT_SET_SIZE', 200))
+
+# Максимальное количество чатов, состояние которых держится в памяти
+ARCHIVE_OPEN_CHATS = int(os.environ.get('ARCHIVE_OPEN_CHATS', 1000))
+
+# Шаг разреженного индекса: смещение запоминается для каждого N-го сообщения
+ARCHIVE_INDEX_INTERVAL = 64
+
+# Через сколько прочитанных или дописанных строк сегмента индекс чата сохраняется на диск
+ARCHIVE_INDEX_SAVE_LINES = int(os.environ.get('ARCHIVE_INDEX_SAVE_LINES', 1024))
+
+# Файлы индекса с парами ID: имя словаря в состоянии чата -> расширение файла
+_PAIR_FILES = {'telegram_ids': 'tg', 'edited': 'edits'}
+
+# Запись файла пар: ключ и значение
+_PAIR = struct.Struct('<qq')
+
+# Каталог архива, файл со следующим свободным ID сообщения и признак того,
+# что сегменты могут дописывать другие процессы
+_directory = None
+_next_id_file = None
+_shared = False
+
+# Следующий свободный ID сообщения (общий для всех чатов)
+_next_id = 1
+
+# chat_id -> состояние открытого чата, в порядке последнего использования
+_chats = OrderedDict()
+
+
+def _segment_path(chat_id):
+    """Путь к сегменту чата"""
+    return os.path.join(_directory, f'{chat_id}.log')
+
+
+def _index_path(chat_id, extension):
+    """Путь к файлу индекса чата"""
+    return os.path.join(_directory, f'{chat_id}.{extension}')
+
+
+def _encode(record):
+    """Строка сегмента для сообщения"""
+    return json.dumps(record, ensure_ascii=False, separators=(',', ':')).encode('utf-8') + b'\n'
+
+
+def open_archive(directory, shared=False):
+    """Открыть архив в каталоге (при повторном вызове с тем же каталогом ничего не делает)"""
+    global _directory, _next_id_file, _shared, _next_id
+    if _directory == directory:
+        return
+    close()
+    _directory = directory
+    _next_id_file = os.path.join(directory, 'next_id')
+    _shared = shared
+    os.makedirs(directory, exist_ok=True)
+
+    # Счетчик мог не успеть записаться при сбое, поэтому сверяем его
+    # с последними сообщениями сегментов
+    _next_id = _read_next_id()
+    for name in os.listdir(directory):
+        if name.endswith('.log'):
+            last_id = _last_segment_id(os.path.join(directory, name))
+            if last_id >= _next_id:
+                _next_id = last_id + 1
+
+
+def close():
+    """Закрыть все открытые чаты"""
+    while _chats:
+        _evict(next(iter(_chats)))
+
+
+def _read_next_id():
+    """Прочитать счетчик ID из файла"""
+    try:
+        with open(_next_id_file, 'r') as f:
+            return int(f.read().strip() or 1)
+    except (FileNotFoundError, ValueError):
+        return 1
+
+
+def _last_segment_id(path):
+    """ID последнего сообщения в сегменте (по последней полной строке)"""
+    with open(path, 'rb') as f:
+        f.seek(0, os.SEEK_END)
+        size = f.tell()
+        f.seek(max(size - 64 * 1024, 0))
+        tail = f.read()
+    lines = tail.split(b'\n')
+    for line in reversed(lines[:-1]):
+        try:
+            return json.loads(line)['id']
+        except (ValueError, KeyError):
+            continue
+    return 0
+
+
+def allocate_ids(count=1):
+    """Выделить count подряд идущих ID сообщений. Возвращает первый"""
+    global _next_id
+    if _shared:
+        # Другие процессы тоже выделяют ID, актуальное значение - в файле
+        _next_id = max(_next_id, _read_next_id())
+    first_id = _next_id
+    _next_id += count
+    with open(_next_id_file, 'w') as f:
+        f.write(str(_next_id))
+    return first_id
+
+
+def _new_state(chat_id):
+    """Пустое состояние чата"""
+    return {
+        'chat_id': chat_id,
+        'inode': None,
+        'size': 0,                  # обработанная часть сегмента в байтах
+        'count': 0,                 # количество сообщений
+        'last_id': 0,
+        'index_ids': [],            # разреженный индекс: ID сообщения ...
+        'index_offsets': [],        # ... и смещение его строки
+        'unsaved': 0,               # строк сегмента после последнего сохранения индекса
+        # Пары, еще не сохраненные в файлы индекса:
+        # edited: ID -> смещение последней версии отредактированного сообщения,
+        # telegram_ids: ID сообщения в Telegram -> ID сообщения
+        'tail': {name: {} for name in _PAIR_FILES},
+        'pairs': {name: None for name in _PAIR_FILES},  # mmap файлов пар
+        'hot': deque(maxlen=MESSAGE_HOT_SET_SIZE),
+        'mmap': None
+    }
+
+
+def _apply_line(state, record, offset):
+    """Учесть строку сегмента в состоянии чата"""
+    message_id = record['id']
+    if message_id > state['last_id']:
+        if state['count'] % ARCHIVE_INDEX_INTERVAL == 0:
+            state['index_ids'].append(message_id)
+            state['index_offsets'].append(offset)
+        state['count'] += 1
+        state['last_id'] = message_id
+        state['hot'].append(record)
+    else:
+        # Новая версия уже сохраненного сообщения
+        state['tail']['edited'][message_id] = offset
+        hot = state['hot']
+        if hot and hot[0]['id'] <= message_id:
+            for position, message in enumerate(hot):
+                if message['id'] == message_id:
+                    hot[position] = record
+                    break
+    if record.get('telegram_id') is not None:
+        state['tail']['telegram_ids'][record['telegram_id']] = message_id
+    state['unsaved'] += 1
+
+
+def _lookup(state, name, key):
+    """Значение пары из индекса чата (сначала несохраненные пары, затем файл) или None"""
+    value = state['tail'][name].get(key)
+    if value is not None:
+        return value
+    mm = state['pairs'][name]
+    if mm is None:
+        return None
+    low, high = 0, len(mm) // _PAIR.size
+    while low < high:
+        middle = (low + high) // 2
+        found, value = _PAIR.unpack_from(mm, middle * _PAIR.size)
+        if found < key:
+            low = middle + 1
+        elif found > key:
+            high = middle
+        else:
+            return value
+    return None
+
+
+def _has_edits(state):
+    """Есть ли в чате отредактированные сообщения"""
+    return state['pairs']['edited'] is not None or bool(state['tail']['edited'])
+
+
+def _merged_pairs(mm, tail):
+    """Пары файла и несохраненные пары в порядке ключей (при совпадении ключа действует несохраненная)"""
+    items = sorted(tail.items())
+    position = 0
+    for offset in range(0, len(mm) if mm is not None else 0, _PAIR.size):
+        key, value = _PAIR.unpack_from(mm, offset)
+        while position < len(items) and items[position][0] < key:
+            yield items[position]
+            position += 1
+        if position < len(items) and items[position][0] == key:
+            continue
+        yield key, value
+    yield from items[position:]
+
+
+def _open_pairs(path):
+    """mmap файла пар или None, если файла нет или он пуст"""
+    try:
+        with open(path, 'rb') as f:
+            if os.fstat(f.fileno()).st_size == 0:
+                return None
+            return mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    except FileNotFoundError:
+        return None
+
+
+def _read_meta(chat_id):
+    """Сохраненный индекс чата или None"""
+    try:
+        with open(_index_path(chat_id, 'idx'), 'r') as f:
+            return json.load(f)
+    except (FileNotFoundError, ValueError):
+        return None
+
+
+def _save_index(state):
+    """
+    Сохранить индекс чата на диск и освободить несохраненные пары.
+    Возвращает False, если другой процесс уже сохранил индекс по большей части сегмента
+    (тогда чат нужно открыть заново)
+    """
+    chat_id = state['chat_id']
+    if state['inode'] is None or not state['unsaved']:
+        return True
+    meta = _read_meta(chat_id)
+    if meta is not None and meta['inode'] == state['inode'] and meta['size'] > state['size']:
+        return False
+
+    for name, extension in _PAIR_FILES.items():
+        path = _index_path(chat_id, extension)
+        with open(path + '.tmp', 'wb') as f:
+            for key, value in _merged_pairs(state['pairs'][name], state['tail'][name]):
+                f.write(_PAIR.pack(key, value))
+        os.replace(path + '.tmp', path)
+        if state['pairs'][name] is not None:
+            state['pairs'][name].close()
+        state['pairs'][name] = _open_pairs(path)
+        state['tail'][name].clear()
+
+    # Файл .idx записывается последним: если запись прервется, при открытии строки после
+    # прежнего сохранения будут прочитаны повторно, а пары в файлах совпадут с ними
+    path = _index_path(chat_id, 'idx')
+    with open(path + '.tmp', 'w') as f:
+        json.dump({key: state[key] for key in ('inode', 'size', 'count', 'last_id', 'index_ids', 'index_offsets')}, f)
+    os.replace(path + '.tmp', path)
+    state['unsaved'] = 0
+    return True
+
+
+def _load(state, path):
+    """Открыть чат: прочитать сохраненный индекс, последние сообщения и строки, дописанные после сохранения"""
+    stat = os.stat(path)
+    state['inode'] = stat.st_ino
+    meta = _read_meta(state['chat_id'])
+    if meta is not None and meta['inode'] == stat.st_ino and meta['size'] <= stat.st_size:
+        for key in ('size', 'count', 'last_id', 'index_ids', 'index_offsets'):
+            state[key] = meta[key]
+        for name, extension in _PAIR_FILES.items():
+            state['pairs'][name] = _open_pairs(_index_path(state['chat_id'], extension))
+        if state['count']:
+            # Последние сообщения читаются с точки индекса перед первым из них
+            position = max(state['count'] - MESSAGE_HOT_SET_SIZE, 0) // ARCHIVE_INDEX_INTERVAL
+            state['hot'].extend(_read_range(state, state['index_offsets'][position], 0, state['last_id'] + 1))
+    _scan(state, path)
+
+
+def _scan(state, path):
+    """Прочитать из сегмента строки, появившиеся после последнего чтения"""
+    offset = state['size']
+    with open(path, 'rb') as f:
+        f.seek(offset)
+        for line in f:
+            if not line.endswith(b'\n'):
+                # Недописанная строка (сбой при записи)
+                break
+            _apply_line(state, json.loads(line), offset)
+            offset += len(line)
+            if state['unsaved'] % ARCHIVE_INDEX_SAVE_LINES == 0:
+                # Длинный сегмент без сохраненного индекса: не копим все пары в памяти
+                state['size'] = offset
+                _save_index(state)
+        torn = offset < os.fstat(f.fileno()).st_size
+    if torn:
+        # Отрезаем недописанную строку, чтобы следующая запись начиналась с новой строки
+        with open(path, 'r+b') as f:
+            f.truncate(offset)
+    state['size'] = offset
+
+
+def _chat(chat_id):
+    """Состояние чата (открывает чат, если он еще не в памяти)"""
+    state = _chats.get(chat_id)
+    path = _segment_path(chat_id)
+    if state is not None:
+        _chats.move_to_end(chat_id)
+        if _shared:
+            # Сегмент мог дописать другой процесс
+            try:
+                stat = os.stat(path)
+            except FileNotFoundError:
+                stat = None
+            if stat is None or stat.st_ino != state['inode']:
+                _evict(chat_id)
+                return _chat(chat_id)
+            if stat.st_size > state['size']:
+                _scan(state, path)
+        return _save_if_needed(state)
+
+    state = _new_state(chat_id)
+    if os.path.exists(path):
+        _load(state, path)
+    _chats[chat_id] = state
+    while len(_chats) > ARCHIVE_OPEN_CHATS:
+        _evict(next(iter(_chats)))
+    return _save_if_needed(state)
+
+
+def _save_if_needed(state):
+    """Сохранить индекс чата, если накопилось много несохраненных строк. Возвращает актуальное состояние"""
+    if state['unsaved'] < ARCHIVE_INDEX_SAVE_LINES or _save_index(state):
+        return state
+    # Индекс по большей части сегмента уже сохранил другой процесс - открываем чат заново
+    _evict(state['chat_id'])
+    return _chat(state['chat_id'])
+
+
+def _evict(chat_id):
+    """Выгрузить чат из памяти, сохранив его индекс"""
+    state = _chats.pop(chat_id)
+    _save_index(state)
+    if state['mmap'] is not None:
+        state['mmap'].close()
+    for mm in state['pairs'].values():
+        if mm is not None:
+            mm.close()
+
+
+def _mapped(state):
+    """mmap сегмента, покрывающий все обработанные строки"""
+    mm = state['mmap']
+    if mm is None or len(mm) < state['size']:
+        if mm is not None:
+            mm.close()
+        with open(_segment_path(state['chat_id']), 'rb') as f:
+            mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        state['mmap'] = mm
+    return mm
+
+
+def _read_at(state, offset):
+    """Прочитать сообщение по смещению строки"""
+    mm = _mapped(state)
+    return json.loads(mm[offset:mm.find(b'\n', offset)])
+
+
+def _read_range(state, start_offset, min_id, max_id, limit=None):
+    """
+    Прочитать сообщения с min_id <= ID < max_id, начиная со смещения start_offset
+    (не больше limit, если указан). Учитывает отредактированные версии
+    """
+    mm = _mapped(state)
+    edits = _has_edits(state)
+    messages = []
+    offset = start_offset
+    last_id = 0
+    while offset < state['size']:
+        end = mm.find(b'\n', offset)
+        record = json.loads(mm[offset:end])
+        offset = end + 1
+        message_id = record['id']
+        if message_id <= last_id:
+            # Версия отредактированного сообщения, учитывается через индекс edited
+            continue
+        last_id = message_id
+        if message_id >= max_id:
+            break
+        if message_id < min_id:
+            continue
+        if edits:
+            edited = _lookup(state, 'edited', message_id)
+            if edited is not None:
+                record = _read_at(state, edited)
+        messages.append(record)
+        if limit is not None and len(messages) >= limit:
+            break
+    return messages
+
+
+def _index_offset(state, position):
+    """Смещение точки разреженного индекса (0, если точка перед началом сегмента)"""
+    return state['index_offsets'][position] if position >= 0 else 0
+
+
+def find_by_telegram_id(chat_id, telegram_id):
+    """ID сохраненного сообщения чата с указанным ID в Telegram или None"""
+    return _lookup(_chat(chat_id), 'telegram_ids', telegram_id)
+
+
+def get_message(chat_id, message_id):
+    """Прочитать сообщение чата по ID"""
+    state = _chat(chat_id)
+    hot = state['hot']
+    if hot and hot[0]['id'] <= message_id:
+        return next((message for message in hot if message['id'] == message_id), None)
+    edited = _lookup(state, 'edited', message_id)
+    if edited is not None:
+        return _read_at(state, edited)
+    position = bisect_right(state['index_ids'], message_id) - 1
+    if position < 0:
+        return None
+    found = _read_range(state, _index_offset(state, position), message_id, message_id + 1, limit=1)
+    return found[0] if found else None
+
+
+def append(chat_id, records):
+    """Дописать сообщения (новые или новые версии существующих) в сегмент чата"""
+    state = _chat(chat_id)
+    path = _segment_path(chat_id)
+    lines = [_encode(record) for record in records]
+    with open(path, 'ab') as f:
+        f.write(b''.join(lines))
+    if state['inode'] is None:
+        state['inode'] = os.stat(path).st_ino
+    offset = state['size']
+    for record, line in zip(records, lines):
+        _apply_line(state, dict(record), offset)
+        offset += len(line)
+    state['size'] = offset
+    _save_if_needed(state)
+
+
+def get_all(chat_id):
+    """Все сообщения чата"""
+    state = _chat(chat_id)
+    if state['count'] == len(state['hot']):
+        return list(state['hot'])
+    return _read_range(state, 0, 0, state['last_id'] + 1)
+
+
+def get_page(chat_id, before_id=None, after_id=None, limit=50):
+    """Страница сообщений чата и курсор следующей страницы (см. models.get_messages_page)"""
+    state = _chat(chat_id)
+    hot = list(state['hot'])
+    hot_ids = [message['id'] for message in hot]
+    # В памяти все сообщения чата или все сообщения новее первого в hot
+    complete = state['count'] == len(hot)
+
+    if after_id is not None:
+        if complete or (hot and after_id >= hot_ids[0] - 1):
+            start = bisect_right(hot_ids, after_id)
+            page = hot[start:start + limit]
+            return page, (page[-1]['id'] if page and start + limit < len(hot) else None)
+        position = bisect_right(state['index_ids'], after_id) - 1
+        page = _read_range(state, _index_offset(state, position), after_id + 1, state['last_id'] + 1,
+                           limit=limit + 1)
+        return page[:limit], (page[limit - 1]['id'] if len(page) > limit else None)
+
+    end = bisect_left(hot_ids, before_id) if before_id is not None else len(hot)
+    if complete or end >= limit:
+        start = max(end - limit, 0)
+        page = hot[start:end]
+        return page, (page[0]['id'] if page and (start > 0 or not complete) else None)
+
+    # Страница начинается раньше сообщений в памяти: читаем с точки индекса,
+    # отстоящей от before_id не меньше чем на limit сообщений
+    if before_id is None:
+        before_id = state['last_id'] + 1
+    position = bisect_left(state['index_ids'], before_id) - 1 - (limit // ARCHIVE_INDEX_INTERVAL + 1)
+    messages = _read_range(state, _index_offset(state, position), 0, before_id)
+    page = messages[-limit:]
+    more = position > 0 or len(messages) > limit
+    return page, (page[0]['id'] if page and more else None)
+
+
+def is_imported():
+    """Перенесены ли в архив сообщения из прежнего формата хранения"""
+    return os.path.exists(os.path.join(_directory, 'imported'))
+
+
+def import_messages(records):
+    """
+    Заполнить архив заново сообщениями из прежнего формата хранения
+    (records - сообщения в любом порядке). Сегменты, оставшиеся от прерванного
+    переноса, удаляются. После переноса is_imported() возвращает True
+    """
+    global _next_id
+    close()
+    shutil.rmtree(_directory, ignore_errors=True)
+    os.makedirs(_directory, exist_ok=True)
+    by_chat = {}
+    for record in sorted(records, key=lambda record: int(record['id'])):
+        by_chat.setdefault(record['chat_id'], []).append(record)
+    for chat_id, chat_records in by_chat.items():
+        with open(_segment_path(chat_id), 'wb') as f:
+            f.write(b''.join(_encode(record) for record in chat_records))
+        _next_id = max(_next_id, int(chat_records[-1]['id']) + 1)
+    with open(_next_id_file, 'w') as f:
+        f.write(str(_next_id))
+    with open(os.path.join(_directory, 'imported'), 'w'):
+        pass
@@ -1,69 +1,742 @@
+from bisect import bisect_left, bisect_right
+from contextlib import contextmanager
 from datetime import datetime
+import atexit
+from functools import wraps
 import json
 import os
+import shutil
+import threading
 import time
 
-# Путь к файлу для хранения данных
+from backend import message_archive
+from backend import snapshot as snapshot_format
+
+try:
+    import fcntl
+except ImportError:  # Windows: межпроцессная блокировка недоступна
+    fcntl = None
+
+# Движок хранения данных: 'json' (по умолчанию) или 'sqlite' (backend/sqlite_storage.py)
+STORAGE_ENGINE = os.environ.get('STORAGE_ENGINE', 'json').lower()
+
+# Общее хранилище для нескольких процессов (например, gunicorn --workers N).
+# Запись идет под межпроцессной блокировкой, а каждый процесс перед обращением
+# к данным подхватывает из журнала изменения, сделанные другими процессами
+STORAGE_SHARED = os.environ.get('STORAGE_SHARED', '').lower() in ('1', 'true', 'yes')
+
+# Путь к файлу для хранения данных (снимок базы в одном файле - прежний формат).
+# Если рядом нет готового каталога DATA_DIR, данные читаются из него и при первом
+# сворачивании журнала переносятся в каталог
 DATABASE_FILE = 'telegram_manager_data.json'
 
+# Каталог снимка, разбитого на файлы (шарды): users.snap, telegram_accounts.snap и
+# <коллекция>/<account_id>.snap для данных аккаунтов.
+# При сворачивании журнала переписываются только шарды, в которых были изменения.
+# Формат файлов шардов и сжатие (SNAPSHOT_COMPRESSION) описаны в backend/snapshot.py
+DATA_DIR = os.environ.get('DATA_DIR', 'telegram_manager_data')
+DATA_MANIFEST_FILE = os.path.join(DATA_DIR, 'manifest.json')
+
+# Сообщения хранятся не в снимке и журнале, а в архиве с сегментом на каждый чат
+# (backend/message_archive.py); в памяти остаются только последние сообщения чатов
+MESSAGE_ARCHIVE_DIR = os.path.join(DATA_DIR, 'archive')
+
+# Версия формата каталога: 1 - шарды *.json с отступами, 2 - шарды *.snap,
+# 3 - сообщения в архиве. Данные в более старом формате переписываются
+# при первом сворачивании журнала
+DATA_FORMAT_VERSION = 3
+SHARD_EXTENSIONS = {1: '.json', 2: '.snap', 3: '.snap'}
+
+# Журнал изменений: каждая вставка/обновление дописывается в него одной строкой,
+# вместо того чтобы переписывать весь снимок
+JOURNAL_FILE = DATABASE_FILE + '.log'
+
+# Журнал, который в данный момент сворачивается в снимок
+JOURNAL_COMPACTING_FILE = JOURNAL_FILE + '.compacting'
+
+# Количество записей в журнале, после которого он сворачивается в снимок в фоне
+JOURNAL_COMPACT_THRESHOLD = int(os.environ.get('JOURNAL_COMPACT_THRESHOLD', 10000))
+
+# Групповая запись журнала: изменения копятся в памяти и записываются фоновым потоком
+# не чаще, чем раз в указанное число миллисекунд (0 - записывать сразу), или раньше,
+# если накопилось JOURNAL_FLUSH_MAX_OPS изменений или JOURNAL_FLUSH_MAX_BYTES байт
+JOURNAL_FLUSH_INTERVAL_MS = int(os.environ.get('JOURNAL_FLUSH_INTERVAL_MS', 0))
+JOURNAL_FLUSH_MAX_OPS = int(os.environ.get('JOURNAL_FLUSH_MAX_OPS', 1000))
+JOURNAL_FLUSH_MAX_BYTES = int(os.environ.get('JOURNAL_FLUSH_MAX_BYTES', 1024 * 1024))
+
+
+def _empty_data():
+    """Пустая структура данных"""
+    return {
+        'users': {},
+        'telegram_accounts': {},
+        'contacts': {},
+        'chats': {},
+        'auto_replies': {},
+        'mass_sendings': {},
+        'statistics': {},
+        'peers': {},
+        'sync_state': {}
+    }
+
+
 # Структура для хранения данных в памяти
-data = {
-    'users': {},
-    'telegram_accounts': {},
-    'contacts': {},
-    'chats': {},
-    'messages': {},
-    'auto_replies': {},
-    'mass_sendings': {},
-    'statistics': {}
-}
+data = _empty_data()
+
+# Блокировка доступа к данным, журналу и сворачиванию журнала в снимок
+_lock = threading.RLock()
+_lock_depth = 0
+
+# Межпроцессные блокировки (используются, если процессов несколько)
+LOCK_FILE = DATABASE_FILE + '.lock'
+COMPACTION_LOCK_FILE = DATABASE_FILE + '.compaction.lock'
+_lock_file = None
+
+# Открытый на дозапись файл журнала и количество записей в нем
+_journal = None
+_journal_records = 0
+
+# Изменения, ожидающие групповой записи в журнал
+_pending = []
+_pending_bytes = 0
+
+# Шарды (коллекция, account_id), измененные после последнего сворачивания журнала
+_dirty_shards = set()
+
+# Глубина вложенности блоков batch()
+_batch_depth = 0
+
+# Фоновый поток отложенной записи журнала и событие для его досрочного пробуждения
+_flusher_thread = None
+_flush_event = threading.Event()
+
+# Открытый на чтение текущий журнал и позиция, до которой изменения из него
+# уже применены в памяти (нужно, чтобы подхватывать записи других процессов)
+_journal_reader = None
+_journal_offset = 0
+
+# Фоновый поток, сворачивающий журнал в снимок, и блокировка,
+# не позволяющая двум сворачиваниям идти одновременно
+_compaction_thread = None
+_compaction_lock = threading.Lock()
+
+
+def _interprocess_locking():
+    """Нужна ли блокировка между процессами"""
+    return fcntl is not None and (STORAGE_SHARED or STORAGE_ENGINE == 'sqlite')
+
+
+@contextmanager
+def _store_lock(catch_up=True):
+    """
+    Монопольный доступ к хранилищу.
+    В режиме STORAGE_SHARED блокировка действует между процессами, а при входе
+    в нее применяются изменения, которые другие процессы дописали в журнал
+    """
+    global _lock_file, _lock_depth
+    with _lock:
+        outermost = _lock_depth == 0
+        interprocess = outermost and _interprocess_locking()
+        if interprocess:
+            if _lock_file is None:
+                _lock_file = open(LOCK_FILE, 'a')
+            fcntl.flock(_lock_file, fcntl.LOCK_EX)
+        _lock_depth += 1
+        try:
+            if outermost and catch_up and STORAGE_SHARED and STORAGE_ENGINE == 'json':
+                _catch_up()
+            yield
+        finally:
+            _lock_depth -= 1
+            if outermost and STORAGE_SHARED:
+                _flush_pending()
+            if interprocess:
+                fcntl.flock(_lock_file, fcntl.LOCK_UN)
+
+
+def _synchronized(fn):
+    """Декоратор: выполнить функцию под блокировкой хранилища"""
+    @wraps(fn)
+    def wrapper(*args, **kwargs):
+        with _store_lock():
+            return fn(*args, **kwargs)
+    return wrapper
+
+
+def _apply_journal_lines(chunk, path):
+    """Применить строки журнала к данным в памяти. Возвращает количество записей"""
+    count = 0
+    for line in chunk.splitlines():
+        if not line.strip():
+            continue
+        try:
+            entry = json.loads(line)
+        except json.JSONDecodeError:
+            # Недописанная строка (например, после сбоя) - пропускаем
+            print(f"Пропущена поврежденная запись журнала в {path}")
+            continue
+        entity_type = entry['entity']
+        str_id = str(entry['id'])
+        records = data.setdefault(entity_type, {})
+        if str_id in records and _indexes_ready:
+            _unindex_record(entity_type, records[str_id])
+        records[str_id] = entry['record']
+        if _indexes_ready:
+            _index_record(entity_type, entry['record'])
+        _dirty_shards.add(_shard_of(entity_type, entry['record']))
+        count += 1
+    return count
+
+
+def _replay_journal(path):
+    """Применить к данным весь журнал из файла. Возвращает количество записей"""
+    if not os.path.exists(path):
+        return 0
+    with open(path, 'rb') as f:
+        return _apply_journal_lines(f.read(), path)
+
+
+def _read_journal_tail():
+    """Применить записи, появившиеся в текущем журнале после последнего чтения"""
+    global _journal_offset
+    _journal_reader.seek(_journal_offset)
+    chunk = _journal_reader.read()
+    # Последняя строка может быть еще не дописана другим процессом
+    complete = chunk.rfind(b'\n') + 1
+    _journal_offset += complete
+    return _apply_journal_lines(chunk[:complete], JOURNAL_FILE)
+
+
+def _open_journal_reader():
+    """Открыть текущий журнал на чтение, если он существует"""
+    global _journal_reader, _journal_offset
+    if _journal_reader is not None:
+        _journal_reader.close()
+    _journal_offset = 0
+    try:
+        _journal_reader = open(JOURNAL_FILE, 'rb')
+    except FileNotFoundError:
+        _journal_reader = None
+
+
+def _catch_up():
+    """Применить изменения, сделанные другими процессами"""
+    global _journal_records
+    try:
+        current_inode = os.stat(JOURNAL_FILE).st_ino
+    except FileNotFoundError:
+        current_inode = None
+    known_inode = os.fstat(_journal_reader.fileno()).st_ino if _journal_reader is not None else None
+
+    if current_inode != known_inode:
+        # Другой процесс свернул журнал в снимок - перечитываем данные целиком
+        _load()
+    elif _journal_reader is not None:
+        _journal_records += _read_journal_tail()
+
+
+def _read_snapshot_file(path):
+    """Прочитать файл снимка (в любом из поддерживаемых форматов). При ошибке возвращает None"""
+    try:
+        with open(path, 'rb') as f:
+            return snapshot_format.decode(f.read())
+    except Exception as e:
+        print(f"Ошибка при загрузке данных из {path}: {e}")
+        return None
+
+
+def _read_manifest_version():
+    """Версия формата каталога шардов (0, если каталог еще не создан)"""
+    if not os.path.exists(DATA_MANIFEST_FILE):
+        return 0
+    with open(DATA_MANIFEST_FILE, 'r', encoding='utf-8') as f:
+        return json.load(f)['version']
+
+
+def _shard_files(extension):
+    """Файлы шардов с указанным расширением: [(коллекция, путь)]"""
+    files = []
+    for entity_type in data:
+        shard_dir = os.path.join(DATA_DIR, entity_type)
+        if os.path.isdir(shard_dir):
+            files.extend((entity_type, os.path.join(shard_dir, name))
+                         for name in sorted(os.listdir(shard_dir)) if name.endswith(extension))
+        else:
+            path = os.path.join(DATA_DIR, entity_type + extension)
+            if os.path.exists(path):
+                files.append((entity_type, path))
+    return files
+
+
+def _load_shards(version):
+    """Прочитать снимок из каталога шардов. Каждый шард читается независимо"""
+    if version < 3:
+        # До версии 3 сообщения тоже хранились в шардах
+        data['messages'] = {}
+    for entity_type, path in _shard_files(SHARD_EXTENSIONS[version]):
+        records = _read_snapshot_file(path)
+        if records:
+            data[entity_type].update(records)
+    print(f"Данные успешно загружены из {DATA_DIR}")
+
+
+def _mark_all_dirty():
+    """Пометить все шарды измененными, чтобы сворачивание переписало снимок целиком"""
+    for entity_type, records in data.items():
+        for record in records.values():
+            _dirty_shards.add(_shard_of(entity_type, record))
+
+
+def _load():
+    """
+    Прочитать снимок и журналы.
+    Возвращает True, если снимок нужно сразу переписать (прерванное сворачивание журнала
+    или перенос данных из прежнего формата)
+    """
+    global data, _journal_records, _indexes_ready
+    _flush_pending()
+    _close_journal()
+    _indexes_ready = False
+    data = _empty_data()
+    _dirty_shards.clear()
+    migrate = False
+    version = _read_manifest_version()
+    if version:
+        _load_shards(version)
+        # Шарды в прежнем формате переписываем при ближайшем сворачивании
+        migrate = version < DATA_FORMAT_VERSION
+    elif os.path.exists(DATABASE_FILE):
+        # Прежний единый файл: переносим данные в шарды при ближайшем сворачивании
+        loaded_data = _read_snapshot_file(DATABASE_FILE)
+        if loaded_data is not None:
+            data.update(loaded_data)
+            print(f"Данные успешно загружены из {DATABASE_FILE}")
+            migrate = True
+    else:
+        print(f"Каталог {DATA_DIR} не найден. Будет создан новый.")
+
+    message_archive.open_archive(MESSAGE_ARCHIVE_DIR, shared=STORAGE_SHARED)
+
+    # Применяем изменения, накопленные в журналах после последнего снимка.
+    # Журнал, который сворачивался в момент остановки, старше текущего
+    interrupted = _replay_journal(JOURNAL_COMPACTING_FILE)
+    _open_journal_reader()
+    _journal_records = interrupted
+    if _journal_reader is not None:
+        _journal_records += _read_journal_tail()
+    if _journal_records:
+        print(f"Из журнала применено {_journal_records} изменений")
+
+    # Сообщения из прежнего формата (шарды, единый файл, журнал) переносим в архив
+    legacy_messages = data.pop('messages', None)
+    _dirty_shards.discard(('messages', None))
+    if legacy_messages is not None and not message_archive.is_imported():
+        message_archive.import_messages(legacy_messages.values())
+        print(f"В архив перенесено сообщений: {len(legacy_messages)}")
+    if migrate:
+        _mark_all_dirty()
+
+    _rebuild_indexes()
+    return bool(interrupted) or migrate
+
 
 # Загружаем данные из файла, если он существует
 def load_data():
-    global data
-    if os.path.exists(DATABASE_FILE):
+    with _store_lock(catch_up=False):
+        needs_compaction = _load()
+        _retire_mock_mass_sendings()
+
+    # Если сворачивание журнала было прервано или данные нужно перенести в шарды,
+    # сворачиваем журнал сразу (если этого не делает в этот момент другой процесс)
+    if needs_compaction and _try_lock_compaction():
+        save_data()
+
+
+def _retire_mock_mass_sendings():
+    """
+    Рассылки со статусом pending созданы, когда отправка только имитировалась. Фоновый исполнитель
+    (backend/mass_sending.py) выполняет только рассылки queued, поэтому такие рассылки переводятся
+    в черновики (draft), а не уходят реальным контактам после обновления
+    """
+    for mass_sending in data['mass_sendings'].values():
+        if mass_sending['status'] == 'pending':
+            mass_sending['status'] = 'draft'
+            _journal_write('mass_sendings', mass_sending)
+
+
+def _close_journal():
+    """Закрыть файл журнала"""
+    global _journal
+    if _journal is not None:
+        _journal.close()
+        _journal = None
+
+
+def _journal_write(entity_type, record):
+    """Добавить изменение записи в журнал (сразу или в очередь на групповую запись)"""
+    global _pending_bytes, _journal_records
+    line = json.dumps({'entity': entity_type, 'id': record['id'], 'record': record},
+                      ensure_ascii=False).encode('utf-8') + b'\n'
+    with _lock:
+        _pending.append(line)
+        _pending_bytes += len(line)
+        _journal_records += 1
+        _dirty_shards.add(_shard_of(entity_type, record))
+
+        if _batch_depth:
+            # Внутри batch() очередь записывается в конце блока
+            pass
+        elif STORAGE_SHARED:
+            # В общем режиме очередь записывается при выходе из блокировки хранилища,
+            # чтобы другие процессы сразу увидели изменения
+            pass
+        else:
+            _schedule_flush()
+
+        if _journal_records >= JOURNAL_COMPACT_THRESHOLD:
+            _start_compaction()
+
+
+def _schedule_flush():
+    """Записать очередь сразу или поручить ее фоновому потоку (при JOURNAL_FLUSH_INTERVAL_MS > 0)"""
+    if JOURNAL_FLUSH_INTERVAL_MS <= 0:
+        _flush_pending()
+        return
+    _start_flusher()
+    if len(_pending) >= JOURNAL_FLUSH_MAX_OPS or _pending_bytes >= JOURNAL_FLUSH_MAX_BYTES:
+        # Будим фоновый поток, не дожидаясь окончания интервала
+        _flush_event.set()
+
+
+def _flush_pending():
+    """Записать накопленные изменения в журнал одной операцией"""
+    global _journal, _journal_offset, _pending_bytes
+    if not _pending:
+        return
+    chunk = b''.join(_pending)
+    try:
+        if _journal is None:
+            _journal = open(JOURNAL_FILE, 'a+b')
+            if _journal_reader is None:
+                _open_journal_reader()
+            size = _journal.tell()
+            if size:
+                _journal.seek(size - 1)
+                if _journal.read(1) != b'\n':
+                    # Строка, недописанная при сбое, не должна склеиться с новыми записями
+                    chunk = b'\n' + chunk
+                    _journal_offset = size
+        _journal.write(chunk)
+        _journal.flush()
+    except Exception as e:
+        # Изменения остаются в очереди и будут записаны при следующей попытке
+        print(f"Ошибка при записи в журнал: {e}")
+        return
+    _pending.clear()
+    _pending_bytes = 0
+    # Собственные записи уже есть в памяти, читать их из журнала не нужно
+    _journal_offset += len(chunk)
+
+
+def flush():
+    """Немедленно записать в журнал все отложенные изменения (при остановке, в тестах)"""
+    with _lock:
+        _flush_pending()
+
+
+@contextmanager
+def batch():
+    """
+    Выполнить несколько операций записи как одну:
+    внутри блока изменения не записываются в журнал, а в конце записываются одной операцией.
+    Блок выполняется под блокировкой хранилища, поэтому другие потоки и процессы
+    увидят его изменения только целиком. Отката нет: изменения, сделанные до
+    исключения, остаются в памяти и тоже записываются в журнал
+
+    with models.batch():
+        for contact in contacts:
+            models.save_contact(...)
+    """
+    global _batch_depth
+    with _store_lock():
+        _batch_depth += 1
         try:
-            with open(DATABASE_FILE, 'r', encoding='utf-8') as f:
-                loaded_data = json.load(f)
-                data = loaded_data
-                print(f"Данные успешно загружены из {DATABASE_FILE}")
-        except (json.JSONDecodeError, FileNotFoundError) as e:
-            print(f"Ошибка при загрузке данных: {e}")
-            # В случае ошибки инициализируем пустые данные
-            data = {
-                'users': {},
-                'telegram_accounts': {},
-                'contacts': {},
-                'chats': {},
-                'messages': {},
-                'auto_replies': {},
-                'mass_sendings': {},
-                'statistics': {}
-            }
+            yield
+        finally:
+            _batch_depth -= 1
+            if _batch_depth == 0 and not STORAGE_SHARED:
+                # В общем режиме очередь запишет выход из блокировки хранилища
+                _schedule_flush()
+
+
+def _flusher_loop():
+    """Фоновая запись отложенных изменений не чаще, чем раз в JOURNAL_FLUSH_INTERVAL_MS"""
+    while True:
+        _flush_event.wait(JOURNAL_FLUSH_INTERVAL_MS / 1000)
+        _flush_event.clear()
+        flush()
+
+
+def _start_flusher():
+    """Запустить фоновый поток записи журнала, если он еще не запущен"""
+    global _flusher_thread
+    if _flusher_thread is None:
+        _flusher_thread = threading.Thread(target=_flusher_loop, name='journal-flusher', daemon=True)
+        _flusher_thread.start()
+
+
+def _start_compaction():
+    """Запустить сворачивание журнала в снимок в фоновом потоке"""
+    global _compaction_thread
+    if _compaction_thread is not None and _compaction_thread.is_alive():
+        return
+    _compaction_thread = threading.Thread(target=save_data, name='journal-compaction', daemon=True)
+    _compaction_thread.start()
+
+
+@contextmanager
+def _compaction_file_lock():
+    """Не дать двум процессам сворачивать журнал одновременно"""
+    if not _interprocess_locking():
+        yield
+        return
+    with open(COMPACTION_LOCK_FILE, 'a') as f:
+        fcntl.flock(f, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(f, fcntl.LOCK_UN)
+
+
+def _try_lock_compaction():
+    """Проверить, что журнал сейчас не сворачивает другой процесс"""
+    if not _interprocess_locking():
+        return True
+    with open(COMPACTION_LOCK_FILE, 'a') as f:
+        try:
+            fcntl.flock(f, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            return False
+        fcntl.flock(f, fcntl.LOCK_UN)
+    return True
+
+
+def _rotate_journal():
+    """Отложить текущий журнал для сворачивания, новые изменения пойдут в новый"""
+    global _journal_reader, _journal_offset
+    _flush_pending()
+    _close_journal()
+    if _journal_reader is not None:
+        _journal_reader.close()
+        _journal_reader = None
+    _journal_offset = 0
+    if not os.path.exists(JOURNAL_FILE):
+        return
+    if os.path.exists(JOURNAL_COMPACTING_FILE):
+        # Предыдущее сворачивание было прервано - дописываем журнал к отложенному
+        with open(JOURNAL_FILE, 'rb') as src, open(JOURNAL_COMPACTING_FILE, 'ab') as dst:
+            dst.write(src.read())
+        os.remove(JOURNAL_FILE)
     else:
-        print(f"Файл {DATABASE_FILE} не найден. Будет создан новый файл.")
+        os.replace(JOURNAL_FILE, JOURNAL_COMPACTING_FILE)
+
+
+def _shard_of(entity_type, record):
+    """Шард, в котором хранится запись: (коллекция, account_id или None)"""
+    if entity_type in SHARDED_ENTITIES:
+        return entity_type, record.get('account_id')
+    return entity_type, None
+
+
+def _shard_path(shard):
+    """Путь к файлу шарда"""
+    entity_type, account_id = shard
+    extension = SHARD_EXTENSIONS[DATA_FORMAT_VERSION]
+    if entity_type not in SHARDED_ENTITIES:
+        return os.path.join(DATA_DIR, entity_type + extension)
+    # Записи без аккаунта хранятся отдельно
+    name = 'unassigned' if account_id is None else str(account_id)
+    return os.path.join(DATA_DIR, entity_type, name + extension)
 
 
-# Сохраняем данные в файл
+def _shard_records(shard):
+    """Записи шарда (по индексам, без просмотра всей коллекции)"""
+    entity_type, account_id = shard
+    if entity_type not in SHARDED_ENTITIES:
+        return data[entity_type].items()
+    if account_id is None:
+        return [(record_id, record) for record_id, record in data[entity_type].items()
+                if _shard_of(entity_type, record) == shard]
+    return _records_by_account[entity_type].get(account_id, {}).items()
+
+
+def _write_shard(shard, records):
+    """Записать шард во временный файл. Возвращает (временный файл, файл шарда)"""
+    path = _shard_path(shard)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_file = path + '.tmp'
+    with open(tmp_file, 'wb') as f:
+        f.write(snapshot_format.encode(records))
+        f.flush()
+        os.fsync(f.fileno())
+    return tmp_file, path
+
+
+# Сохраняем данные в файлы: сворачиваем журнал в снимок, переписывая только измененные шарды
 def save_data():
+    global _journal_records
+    dirty = set()
     try:
-        with open(DATABASE_FILE, 'w', encoding='utf-8') as f:
-            json.dump(data, f, ensure_ascii=False, indent=2)
-            print(f"Данные успешно сохранены в {DATABASE_FILE}")
+        with _compaction_lock, _compaction_file_lock():
+            with _store_lock():
+                _rotate_journal()
+                _journal_records = 0
+                dirty = set(_dirty_shards)
+                _dirty_shards.clear()
+                # Копируем записи, чтобы сериализовать их уже без блокировки
+                snapshot = {shard: {record_id: dict(record) for record_id, record in list(_shard_records(shard))}
+                            for shard in dirty}
+
+            written = [_write_shard(shard, records) for shard, records in snapshot.items()]
+            # Подмена шардов и удаление отложенного журнала должны быть видны
+            # другим процессам одновременно. Если процесс остановится раньше,
+            # отложенный журнал будет применен заново при запуске
+            with _store_lock(catch_up=False):
+                for tmp_file, path in written:
+                    os.replace(tmp_file, path)
+                version = _read_manifest_version()
+                if version < DATA_FORMAT_VERSION:
+                    # С этого момента данные читаются из шардов нового формата,
+                    # а не из DATABASE_FILE или шардов прежнего формата
+                    tmp_file, path = DATA_MANIFEST_FILE + '.tmp', DATA_MANIFEST_FILE
+                    os.makedirs(DATA_DIR, exist_ok=True)
+                    with open(tmp_file, 'w', encoding='utf-8') as f:
+                        json.dump({'version': DATA_FORMAT_VERSION}, f)
+                    os.replace(tmp_file, path)
+                    if version and SHARD_EXTENSIONS[version] != SHARD_EXTENSIONS[DATA_FORMAT_VERSION]:
+                        for _, legacy_path in _shard_files(SHARD_EXTENSIONS[version]):
+                            os.remove(legacy_path)
+                    # Сообщения перенесены в архив
+                    shutil.rmtree(os.path.join(DATA_DIR, 'messages'), ignore_errors=True)
+                if os.path.exists(JOURNAL_COMPACTING_FILE):
+                    os.remove(JOURNAL_COMPACTING_FILE)
+        print(f"Данные успешно сохранены в {DATA_DIR} (шардов: {len(written)})")
     except Exception as e:
+        # Шарды остаются помеченными и будут переписаны при следующем сворачивании
+        with _lock:
+            _dirty_shards.update(dirty)
         print(f"Ошибка при сохранении данных: {e}")
 
 
+# Коллекции, записи которых привязаны к аккаунту Telegram через account_id
+ACCOUNT_SCOPED_ENTITIES = ('contacts', 'chats', 'auto_replies', 'mass_sendings', 'statistics', 'peers', 'sync_state')
+
+# Коллекции, снимок которых разбит на шарды по аккаунтам
+SHARDED_ENTITIES = ACCOUNT_SCOPED_ENTITIES
+
+# Индексы в памяти. Не сохраняются в файл и перестраиваются при загрузке данных
+_next_ids = {}                # тип сущности -> следующий свободный ID
+_users_by_username = {}       # username -> пользователь
+_accounts_by_user = {}        # user_id -> {ID аккаунта: аккаунт}
+_records_by_account = {}      # тип сущности -> account_id -> {ID записи: запись}
+_statistic_dates = {}         # account_id -> даты статистики по возрастанию
+_statistics_by_date = {}      # (account_id, дата) -> запись статистики
+_peers_by_key = {}            # (account_id, ключ) -> запись кэша сущностей Telegram
+_contacts_by_telegram_id = {} # (account_id, ID пользователя в Telegram) -> контакт
+_chats_by_telegram_id = {}    # (account_id, ID диалога в Telegram) -> чат
+_sync_state_by_account = {}   # account_id -> состояние синхронизации с Telegram
+_indexes_ready = False
+
+
+def _index_record(entity_type, record):
+    """Добавить запись в индексы"""
+    record_id = int(record['id'])
+    if record_id >= _next_ids.get(entity_type, 1):
+        _next_ids[entity_type] = record_id + 1
+
+    str_id = str(record_id)
+    if entity_type == 'users':
+        _users_by_username[record['username']] = record
+    elif entity_type == 'telegram_accounts':
+        _accounts_by_user.setdefault(record['user_id'], {})[str_id] = record
+    elif entity_type in ACCOUNT_SCOPED_ENTITIES:
+        _records_by_account[entity_type].setdefault(record['account_id'], {})[str_id] = record
+        if entity_type == 'statistics':
+            key = (record['account_id'], record['date'])
+            if key not in _statistics_by_date:
+                # Записи создаются за текущий день, поэтому дата почти всегда добавляется в конец
+                dates = _statistic_dates.setdefault(record['account_id'], [])
+                dates.insert(bisect_left(dates, record['date']), record['date'])
+            _statistics_by_date[key] = record
+        elif entity_type == 'peers':
+            _peers_by_key[(record['account_id'], record['key'])] = record
+        elif entity_type == 'contacts' and record.get('telegram_id') is not None:
+            _contacts_by_telegram_id[(record['account_id'], record['telegram_id'])] = record
+        elif entity_type == 'chats' and record.get('telegram_id') is not None:
+            _chats_by_telegram_id[(record['account_id'], record['telegram_id'])] = record
+        elif entity_type == 'sync_state':
+            _sync_state_by_account[record['account_id']] = record
+
+
+def _unindex_record(entity_type, record):
+    """Удалить запись из индексов (перед изменением индексируемых полей)"""
+    str_id = str(record['id'])
+    if entity_type == 'users':
+        _users_by_username.pop(record['username'], None)
+    elif entity_type == 'telegram_accounts':
+        _accounts_by_user.get(record['user_id'], {}).pop(str_id, None)
+    elif entity_type in ACCOUNT_SCOPED_ENTITIES:
+        _records_by_account[entity_type].get(record['account_id'], {}).pop(str_id, None)
+        if entity_type == 'statistics' and _statistics_by_date.pop((record['account_id'], record['date']), None):
+            dates = _statistic_dates[record['account_id']]
+            del dates[bisect_left(dates, record['date'])]
+        elif entity_type == 'peers':
+            _peers_by_key.pop((record['account_id'], record['key']), None)
+        elif entity_type == 'contacts' and record.get('telegram_id') is not None:
+            _contacts_by_telegram_id.pop((record['account_id'], record['telegram_id']), None)
+        elif entity_type == 'chats' and record.get('telegram_id') is not None:
+            _chats_by_telegram_id.pop((record['account_id'], record['telegram_id']), None)
+        elif entity_type == 'sync_state':
+            _sync_state_by_account.pop(record['account_id'], None)
+
+
+def _rebuild_indexes():
+    """Перестроить все индексы по данным в памяти"""
+    global _indexes_ready
+    _next_ids.clear()
+    _users_by_username.clear()
+    _accounts_by_user.clear()
+    _records_by_account.clear()
+    _statistic_dates.clear()
+    _statistics_by_date.clear()
+    _peers_by_key.clear()
+    _contacts_by_telegram_id.clear()
+    _chats_by_telegram_id.clear()
+    _sync_state_by_account.clear()
+    for entity_type in ACCOUNT_SCOPED_ENTITIES:
+        _records_by_account[entity_type] = {}
+
+    for entity_type, records in data.items():
+        for record in records.values():
+            _index_record(entity_type, record)
+    _indexes_ready = True
+
+
 # Загружаем данные при запуске
-load_data()
+if STORAGE_ENGINE == 'json':
+    if STORAGE_SHARED and fcntl is None:
+        raise RuntimeError("STORAGE_SHARED требует поддержки fcntl (Linux/macOS)")
+    load_data()
+    # Отложенные изменения записываются в журнал и при остановке процесса
+    atexit.register(flush)
 
 # Вспомогательные функции для работы с данными
-def get_next_id(entity_type):
-    """Получить следующий ID для указанного типа сущности"""
-    if not data[entity_type]:
-        return 1
-    ids = [int(id) for id in data[entity_type].keys()]
-    return max(ids) + 1 if ids else 1
+def get_next_id(entity_type, count=1):
+    """Выделить следующий ID (или count подряд идущих ID) для указанного типа сущности"""
+    with _store_lock():
+        next_id = _next_ids.get(entity_type, 1)
+        _next_ids[entity_type] = next_id + count
+    return next_id
 
 
 def datetime_to_str(dt):
@@ -81,46 +754,53 @@ def str_to_datetime(dt_str):
         return dt_str
 
 
+def _insert_record(entity_type, record):
+    """Добавить новую запись в коллекцию, индексы и журнал"""
+    data[entity_type][str(record['id'])] = record
+    _index_record(entity_type, record)
+    _journal_write(entity_type, record)  # Сохраняем изменения в журнал
+    return record['id']
+
+
 # Функции для работы с данными
 
+@_synchronized
 def save_user(username, password_hash, email=None):
     """Сохранить нового пользователя"""
     # Проверяем, существует ли уже пользователь с таким именем
-    for user_id, user in data['users'].items():
-        if user['username'] == username:
-            return int(user_id)  # Возвращаем существующий ID
+    user = _users_by_username.get(username)
+    if user:
+        return int(user['id'])  # Возвращаем существующий ID
 
     user_id = get_next_id('users')
-    data['users'][str(user_id)] = {
+    return _insert_record('users', {
         'id': user_id,
         'username': username,
         'password_hash': password_hash,
         'email': email,
         'created_at': datetime_to_str(datetime.utcnow())
-    }
-    save_data()  # Сохраняем изменения в файл
-    return user_id
+    })
 
 
+@_synchronized
 def get_user_by_username(username):
     """Получить пользователя по имени"""
-    for user_id, user in data['users'].items():
-        if user['username'] == username:
-            return user
-    return None
+    return _users_by_username.get(username)
 
 
+@_synchronized
 def get_user_by_id(user_id):
     """Получить пользователя по ID"""
     return data['users'].get(str(user_id))
 
 
+@_synchronized
 def save_telegram_account(user_id, account_name, phone, api_id=None, api_hash=None, session_string=None):
     """Сохранить аккаунт Telegram"""
     account_id = get_next_id('telegram_accounts')
     status = 'authorized' if session_string else ('pending' if api_id and api_hash else 'waiting_for_api')
     
-    data['telegram_accounts'][str(account_id)] = {
+    return _insert_record('telegram_accounts', {
         'id': account_id,
         'user_id': user_id,
         'account_name': account_name,
@@ -130,198 +810,551 @@ def save_telegram_account(user_id, account_name, phone, api_id=None, api_hash=No
         'session_string': session_string,
         'created_at': datetime_to_str(datetime.utcnow()),
         'status': status
-    }
-    save_data()  # Сохраняем изменения в файл
-    return account_id
+    })
 
 
+@_synchronized
 def get_telegram_accounts(user_id):
     """Получить все аккаунты Telegram пользователя"""
-    return [account for account_id, account in data['telegram_accounts'].items() 
-            if account['user_id'] == user_id]
+    return list(_accounts_by_user.get(user_id, {}).values())
+
+
+@_synchronized
+def get_telegram_account(account_id):
+    """Получить аккаунт Telegram по ID"""
+    return data['telegram_accounts'].get(str(account_id))
+
 
+@_synchronized
+def get_authorized_telegram_accounts():
+    """Получить аккаунты Telegram всех пользователей с сохраненной сессией и API ID / API Hash"""
+    return [account for account in data['telegram_accounts'].values()
+            if account.get('session_string') and account.get('api_id') and account.get('api_hash')]
 
+
+@_synchronized
 def update_telegram_account(account_id, **kwargs):
     """Обновить данные аккаунта Telegram"""
     str_account_id = str(account_id)
     if str_account_id not in data['telegram_accounts']:
         return False
     
+    account = data['telegram_accounts'][str_account_id]
+    _unindex_record('telegram_accounts', account)
+    
     # Обновляем поля
     for key, value in kwargs.items():
-        if key in data['telegram_accounts'][str_account_id]:
-            data['telegram_accounts'][str_account_id][key] = value
+        if key in account:
+            account[key] = value
     
     # Если обновляем строку сессии, считаем аккаунт авторизованным
     if 'session_string' in kwargs and kwargs['session_string']:
-        data['telegram_accounts'][str_account_id]['status'] = 'authorized'
+        account['status'] = 'authorized'
     
-    save_data()  # Сохраняем изменения в файл
+    _index_record('telegram_accounts', account)
+    _journal_write('telegram_accounts', account)  # Сохраняем изменения в журнал
     return True
 
 
+@_synchronized
 def save_contact(account_id, name, phone):
     """Сохранить контакт"""
     contact_id = get_next_id('contacts')
-    data['contacts'][str(contact_id)] = {
+    return _insert_record('contacts', {
         'id': contact_id,
         'account_id': account_id,
         'name': name,
         'phone': phone,
         'created_at': datetime_to_str(datetime.utcnow())
-    }
-    save_data()  # Сохраняем изменения в файл
-    return contact_id
+    })
+
+
+@_synchronized
+def save_contacts_bulk(account_id, contacts):
+    """
+    Сохранить несколько контактов одной операцией
+
+    contacts: список словарей с ключами name и phone и необязательными username и telegram_id.
+    Контакт с уже сохраненным у аккаунта telegram_id не дублируется: у него обновляются
+    только изменившиеся поля, поэтому повторная синхронизация без изменений ничего не записывает.
+    Возвращает список ID сохраненных контактов в том же порядке
+    """
+    created_at = datetime_to_str(datetime.utcnow())
+    contact_ids = []
+    with batch():
+        for contact in contacts:
+            telegram_id = contact.get('telegram_id')
+            existing = _contacts_by_telegram_id.get((account_id, telegram_id)) if telegram_id is not None else None
+            if existing is None:
+                record = {
+                    'id': get_next_id('contacts'),
+                    'account_id': account_id,
+                    'name': contact['name'],
+                    'phone': contact['phone'],
+                    'created_at': created_at
+                }
+                if telegram_id is not None:
+                    record.update(username=contact.get('username'), telegram_id=telegram_id)
+                contact_ids.append(_insert_record('contacts', record))
+                continue
 
+            changes = {field: contact.get(field) for field in ('name', 'phone', 'username')
+                       if existing.get(field) != contact.get(field)}
+            if changes:
+                existing.update(changes)
+                _journal_write('contacts', existing)
+            contact_ids.append(existing['id'])
+    return contact_ids
 
+
+@_synchronized
 def get_contacts(account_id):
     """Получить контакты аккаунта"""
-    return [contact for contact_id, contact in data['contacts'].items() 
-            if contact['account_id'] == account_id]
+    return list(_records_by_account['contacts'].get(account_id, {}).values())
 
 
+@_synchronized
 def save_chat(account_id, contact_id, last_message='', unread_count=0):
     """Сохранить чат"""
     chat_id = get_next_id('chats')
-    data['chats'][str(chat_id)] = {
+    created_at = datetime_to_str(datetime.utcnow())
+    return _insert_record('chats', {
         'id': chat_id,
         'account_id': account_id,
         'contact_id': contact_id,
         'last_message': last_message,
         'unread_count': unread_count,
-        'created_at': datetime_to_str(datetime.utcnow())
-    }
-    save_data()  # Сохраняем изменения в файл
-    return chat_id
+        'created_at': created_at,
+        'updated_at': created_at
+    })
+
+
+@_synchronized
+def save_chats_bulk(account_id, chats):
+    """
+    Сохранить несколько чатов одной операцией
+
+    chats: список словарей с ключами contact_id, last_message и unread_count
+    Возвращает список ID сохраненных чатов
+    """
+    first_id = get_next_id('chats', len(chats))
+    created_at = datetime_to_str(datetime.utcnow())
+    with batch():
+        return [_insert_record('chats', {
+            'id': chat_id,
+            'account_id': account_id,
+            'contact_id': chat['contact_id'],
+            'last_message': chat.get('last_message', ''),
+            'unread_count': chat.get('unread_count', 0),
+            'created_at': created_at,
+            'updated_at': created_at
+        }) for chat_id, chat in enumerate(chats, start=first_id)]
+
+
+@_synchronized
+def save_dialogs(account_id, dialogs):
+    """
+    Сохранить диалоги Telegram как чаты аккаунта одной операцией
+
+    dialogs: список словарей с ключами telegram_id, telegram_entity_id, name, last_message и unread_count.
+    Для нового диалога создаются контакт и чат, у существующего чата обновляются только
+    изменившиеся поля, поэтому повторная синхронизация без изменений ничего не записывает.
+    Возвращает список ID чатов в том же порядке
+    """
+    updated_at = datetime_to_str(datetime.utcnow())
+    chat_ids = []
+    with batch():
+        for dialog in dialogs:
+            chat = _chats_by_telegram_id.get((account_id, dialog['telegram_id']))
+            if chat is None:
+                contact_id = save_contact(account_id, dialog.get('name') or 'Неизвестный контакт', '')
+                chat_ids.append(_insert_record('chats', {
+                    'id': get_next_id('chats'),
+                    'account_id': account_id,
+                    'contact_id': contact_id,
+                    'last_message': dialog.get('last_message', ''),
+                    'unread_count': dialog.get('unread_count', 0),
+                    'telegram_id': dialog['telegram_id'],
+                    'telegram_entity_id': dialog.get('telegram_entity_id'),
+                    'created_at': updated_at,
+                    'updated_at': updated_at
+                }))
+                continue
+
+            changes = {field: dialog[field] for field in ('last_message', 'unread_count')
+                       if field in dialog and chat.get(field) != dialog[field]}
+            if changes:
+                chat.update(changes, updated_at=updated_at)
+                _journal_write('chats', chat)
+            chat_ids.append(chat['id'])
+    return chat_ids
+
+
+@_synchronized
+def get_chats(account_id, updated_since=None):
+    """
+    Получить чаты аккаунта
 
+    updated_since: вернуть только чаты, измененные после этого момента (строка ISO, как updated_at)
+    """
+    chats = _records_by_account['chats'].get(account_id, {}).values()
+    if updated_since is None:
+        return list(chats)
+    return [chat for chat in chats if (chat.get('updated_at') or chat['created_at']) > updated_since]
 
-def get_chats(account_id):
-    """Получить чаты аккаунта"""
-    return [chat for chat_id, chat in data['chats'].items() 
-            if chat['account_id'] == account_id]
 
+@_synchronized
+def get_chat_by_telegram_id(account_id, telegram_id):
+    """Получить чат аккаунта по ID диалога в Telegram"""
+    return _chats_by_telegram_id.get((account_id, telegram_id))
 
-def save_message(chat_id, sender_id, text):
-    """Сохранить сообщение"""
-    message_id = get_next_id('messages')
-    timestamp = datetime.utcnow()
-    data['messages'][str(message_id)] = {
+
+@_synchronized
+def update_chat_synced_message(chat_id, telegram_id):
+    """
+    Запомнить ID последнего синхронизированного сообщения Telegram в чате (поле synced_telegram_id).
+    Следующая синхронизация загружает только более новые сообщения
+    """
+    chat = data['chats'].get(str(chat_id))
+    if chat and telegram_id is not None and telegram_id > (chat.get('synced_telegram_id') or 0):
+        chat['synced_telegram_id'] = telegram_id
+        _journal_write('chats', chat)
+
+
+@_synchronized
+def get_sync_state(account_id):
+    """Состояние синхронизации аккаунта с Telegram (словарь, пустой до первой синхронизации)"""
+    record = _sync_state_by_account.get(account_id)
+    if record is None:
+        return {}
+    return {key: value for key, value in record.items() if key not in ('id', 'account_id')}
+
+
+@_synchronized
+def update_sync_state(account_id, **fields):
+    """Обновить поля состояния синхронизации аккаунта с Telegram"""
+    record = _sync_state_by_account.get(account_id)
+    if record is None:
+        _insert_record('sync_state', dict(fields, id=get_next_id('sync_state'), account_id=account_id))
+    elif any(record.get(key) != value for key, value in fields.items()):
+        record.update(fields)
+        _journal_write('sync_state', record)
+
+
+def _update_chat_after_messages(chat_id, messages):
+    """Обновить последнее сообщение и счетчик непрочитанных в чате после новых сообщений"""
+    chat = data['chats'].get(str(chat_id))
+    if chat:
+        chat['last_message'] = messages[-1]['text']
+        # Не считаем сообщения пользователя непрочитанными
+        chat['unread_count'] += sum(1 for message in messages if message['sender_id'] != 0)
+        chat['updated_at'] = datetime_to_str(datetime.utcnow())
+        _journal_write('chats', chat)
+
+
+@_synchronized
+def save_message(chat_id, sender_id, text, telegram_id=None):
+    """
+    Сохранить сообщение
+
+    telegram_id: ID сообщения в Telegram (если известен). Сообщение с уже сохраненным
+    в этом чате telegram_id не дублируется - возвращается ID существующей записи
+    """
+    if telegram_id is not None:
+        existing_id = message_archive.find_by_telegram_id(chat_id, telegram_id)
+        if existing_id is not None:
+            return existing_id
+
+    message_id = message_archive.allocate_ids()
+    message = {
         'id': message_id,
         'chat_id': chat_id,
         'sender_id': sender_id,
         'text': text,
-        'timestamp': datetime_to_str(timestamp),
-        'is_read': False
+        'timestamp': datetime_to_str(datetime.utcnow()),
+        'is_read': False,
+        'telegram_id': telegram_id
     }
+    message_archive.append(chat_id, [message])
     
     # Обновляем последнее сообщение в чате
-    for chat_id_key, chat in data['chats'].items():
-        if int(chat_id_key) == chat_id:
-            chat['last_message'] = text
-            if sender_id != 0:  # Если отправитель не пользователь
-                chat['unread_count'] += 1
+    _update_chat_after_messages(chat_id, [message])
     
-    save_data()  # Сохраняем изменения в файл
     return message_id
 
 
+@_synchronized
+def save_messages_bulk(chat_id, messages):
+    """
+    Сохранить несколько сообщений чата одной операцией
+
+    messages: список словарей с ключами sender_id, text и необязательным telegram_id
+    (в порядке от старых к новым). Сообщения, чей telegram_id уже сохранен в этом чате,
+    не дублируются: у них обновляется только измененный текст, поэтому повторная
+    синхронизация без изменений ничего не записывает.
+    Возвращает список ID сообщений в том же порядке
+    """
+    # Запись в архив и обновление чата - одной операцией: другие потоки и процессы
+    # не увидят новые сообщения без обновленных last_message и unread_count
+    with batch():
+        message_ids = []
+        new_positions = []
+        edited = []
+        for position, message in enumerate(messages):
+            telegram_id = message.get('telegram_id')
+            existing_id = message_archive.find_by_telegram_id(chat_id, telegram_id) if telegram_id is not None else None
+            if existing_id is not None:
+                existing = message_archive.get_message(chat_id, existing_id)
+                if existing['text'] != message['text']:
+                    # Сообщение было отредактировано
+                    edited.append(dict(existing, text=message['text']))
+                message_ids.append(existing_id)
+            else:
+                new_positions.append(position)
+                message_ids.append(None)
+
+        records = []
+        if new_positions:
+            first_id = message_archive.allocate_ids(len(new_positions))
+            timestamp = datetime_to_str(datetime.utcnow())
+            for message_id, position in enumerate(new_positions, start=first_id):
+                message = messages[position]
+                records.append({
+                    'id': message_id,
+                    'chat_id': chat_id,
+                    'sender_id': message['sender_id'],
+                    'text': message['text'],
+                    'timestamp': timestamp,
+                    'is_read': False,
+                    'telegram_id': message.get('telegram_id')
+                })
+                message_ids[position] = message_id
+
+        if edited or records:
+            # Новые сообщения и новые версии отредактированных - одной записью в сегмент
+            message_archive.append(chat_id, edited + records)
+        if records:
+            # Обновляем последнее сообщение в чате один раз
+            _update_chat_after_messages(chat_id, records)
+
+    return message_ids
+
+
+@_synchronized
+def edit_message_by_telegram_id(chat_id, telegram_id, text):
+    """
+    Изменить текст сохраненного сообщения по его ID в Telegram
+    Возвращает ID сообщения или None, если такого сообщения в чате нет
+    """
+    message_id = message_archive.find_by_telegram_id(chat_id, telegram_id)
+    if message_id is None:
+        return None
+    existing = message_archive.get_message(chat_id, message_id)
+    if existing['text'] != text:
+        message_archive.append(chat_id, [dict(existing, text=text)])
+    return message_id
+
+
+@_synchronized
 def get_messages(chat_id):
-    """Получить сообщения чата"""
-    chat_messages = [message for message_id, message in data['messages'].items() 
-                    if message['chat_id'] == chat_id]
-    # Сортируем по времени
-    chat_messages.sort(key=lambda x: x['timestamp'])
-    return chat_messages
+    """Получить все сообщения чата"""
+    return message_archive.get_all(chat_id)
+
 
+@_synchronized
+def get_messages_page(chat_id, before_id=None, after_id=None, limit=50):
+    """
+    Получить страницу сообщений чата (от старых к новым)
 
+    before_id: вернуть последние limit сообщений с ID меньше before_id
+    after_id: вернуть первые limit сообщений с ID больше after_id
+    Без курсора возвращается последняя страница.
+    Возвращает (сообщения, next_cursor), где next_cursor - значение для следующего запроса
+    в том же направлении или None, если сообщений больше нет
+    """
+    return message_archive.get_page(chat_id, before_id=before_id, after_id=after_id, limit=limit)
+
+
+@_synchronized
 def save_auto_reply(account_id, trigger_phrase, reply_text, is_active=True):
     """Сохранить авто-ответ"""
     auto_reply_id = get_next_id('auto_replies')
-    data['auto_replies'][str(auto_reply_id)] = {
+    return _insert_record('auto_replies', {
         'id': auto_reply_id,
         'account_id': account_id,
         'trigger_phrase': trigger_phrase,
         'reply_text': reply_text,
         'is_active': is_active,
         'created_at': datetime_to_str(datetime.utcnow())
-    }
-    save_data()  # Сохраняем изменения в файл
-    return auto_reply_id
+    })
 
 
+@_synchronized
 def get_auto_replies(account_id):
     """Получить авто-ответы аккаунта"""
-    return [auto_reply for auto_reply_id, auto_reply in data['auto_replies'].items() 
-            if auto_reply['account_id'] == account_id]
+    return list(_records_by_account['auto_replies'].get(account_id, {}).values())
 
 
-def save_mass_sending(account_id, message, contacts_list, delay, frequency):
-    """Сохранить массовую рассылку"""
+@_synchronized
+def save_mass_sending(account_id, message, contacts_list, delay, frequency, status='draft'):
+    """
+    Сохранить массовую рассылку.
+    status: draft - черновик (не выполняется) или queued - поставить в очередь фонового исполнителя
+    """
     mass_sending_id = get_next_id('mass_sendings')
-    data['mass_sendings'][str(mass_sending_id)] = {
+    return _insert_record('mass_sendings', {
         'id': mass_sending_id,
         'account_id': account_id,
         'message': message,
         'contacts': contacts_list,
         'delay': delay,
         'frequency': frequency,
-        'status': 'pending',
+        'status': status,
         'sent_count': 0,
+        'failed_count': 0,
         'created_at': datetime_to_str(datetime.utcnow())
-    }
-    save_data()  # Сохраняем изменения в файл
-    return mass_sending_id
+    })
 
 
+@_synchronized
 def get_mass_sendings(account_id):
     """Получить массовые рассылки аккаунта"""
-    return [sending for sending_id, sending in data['mass_sendings'].items() 
-            if sending['account_id'] == account_id]
+    return list(_records_by_account['mass_sendings'].get(account_id, {}).values())
+
+
+@_synchronized
+def get_unfinished_mass_sendings():
+    """Получить незавершенные (queued и in_progress) массовые рассылки всех аккаунтов"""
+    return [dict(mass_sending) for mass_sending in data['mass_sendings'].values()
+            if mass_sending['status'] in ('queued', 'in_progress')]
+
+
+@_synchronized
+def claim_mass_sending(mass_sending_id, locked_until):
+    """
+    Захватить незавершенную массовую рассылку для выполнения до момента locked_until (строка ISO).
+    Рассылку, которую выполняет другой поток или процесс (ее locked_until еще не наступил), захватить нельзя.
+    Возвращает рассылку или None
+    """
+    mass_sending = data['mass_sendings'].get(str(mass_sending_id))
+    if mass_sending is None or mass_sending['status'] not in ('queued', 'in_progress') \
+            or (mass_sending.get('locked_until') or '') > datetime_to_str(datetime.utcnow()):
+        return None
+    mass_sending.update(status='in_progress', locked_until=locked_until)
+    _journal_write('mass_sendings', mass_sending)
+    return dict(mass_sending)
+
+
+@_synchronized
+def update_mass_sending(mass_sending_id, **fields):
+    """Обновить поля массовой рассылки (sent_count, failed_count, status, locked_until, error)"""
+    mass_sending = data['mass_sendings'].get(str(mass_sending_id))
+    if mass_sending is None:
+        return False
+    mass_sending.update(fields)
+    _journal_write('mass_sendings', mass_sending)
+    return True
 
 
+@_synchronized
 def update_statistics(account_id, sent=0, received=0):
     """Обновить статистику"""
     today = datetime.now().date().isoformat()
     
-    # Ищем запись за сегодня
-    for stat_id, stat in data['statistics'].items():
-        if stat['account_id'] == account_id and stat['date'] == today:
-            stat['sent_messages'] += sent
-            stat['received_messages'] += received
-            save_data()  # Сохраняем изменения в файл
-            return int(stat_id)
+    # Ищем запись аккаунта за сегодня
+    stat = _statistics_by_date.get((account_id, today))
+    if stat:
+        stat['sent_messages'] += sent
+        stat['received_messages'] += received
+        _journal_write('statistics', stat)  # Сохраняем изменения в журнал
+        return int(stat['id'])
     
     # Если запись за сегодня не найдена, создаем новую
     stat_id = get_next_id('statistics')
-    data['statistics'][str(stat_id)] = {
+    return _insert_record('statistics', {
         'id': stat_id,
         'account_id': account_id,
         'date': today,
         'sent_messages': sent,
         'received_messages': received
-    }
-    save_data()  # Сохраняем изменения в файл
-    return stat_id
+    })
+
+
+@_synchronized
+def get_statistics(account_id, days=7, date_from=None, date_to=None):
+    """
+    Получить статистику аккаунта (от новых дат к старым)
 
+    Если указан date_from и/или date_to (ISO-даты, включительно), возвращаются записи
+    за этот период, иначе - последние days записей
+    """
+    dates = _statistic_dates.get(account_id, [])
+    if date_from is None and date_to is None:
+        selected = dates[max(len(dates) - days, 0):]
+    else:
+        start = bisect_left(dates, date_from) if date_from is not None else 0
+        end = bisect_right(dates, date_to) if date_to is not None else len(dates)
+        selected = dates[start:end]
+    return [_statistics_by_date[(account_id, date)] for date in reversed(selected)]
+
+
+@_synchronized
+def get_peer(account_id, key):
+    """
+    Получить запись кэша сущностей Telegram аккаунта
+
+    key: ключ сущности - id:<ID>, username:<имя пользователя> или phone:<номер>
+    """
+    return _peers_by_key.get((account_id, key))
+
+
+@_synchronized
+def save_peers_bulk(account_id, peers):
+    """
+    Сохранить записи кэша сущностей Telegram одной операцией (записи с тем же ключом обновляются)
 
-def get_statistics(account_id, days=7):
-    """Получить статистику аккаунта за указанное количество дней"""
-    account_stats = [stat for stat_id, stat in data['statistics'].items() 
-                    if stat['account_id'] == account_id]
-    # Сортируем по дате
-    account_stats.sort(key=lambda x: x['date'], reverse=True)
-    # Возвращаем статистику за указанное количество дней
-    return account_stats[:days]
+    peers: список словарей с ключами key, peer_id, peer_type, access_hash и resolved
+    (resolved=False - сущность по ключу не найдена в Telegram)
+    """
+    updated_at = datetime_to_str(datetime.utcnow())
+    with batch():
+        for peer in peers:
+            fields = {
+                'peer_id': peer.get('peer_id'),
+                'peer_type': peer.get('peer_type'),
+                'access_hash': peer.get('access_hash'),
+                'resolved': peer.get('resolved', True)
+            }
+            record = _peers_by_key.get((account_id, peer['key']))
+            if record is None:
+                _insert_record('peers', {
+                    'id': get_next_id('peers'),
+                    'account_id': account_id,
+                    'key': peer['key'],
+                    **fields,
+                    'updated_at': updated_at
+                })
+            elif fields['resolved'] and all(record[field] == value for field, value in fields.items()):
+                # Сущность не изменилась - запись не нужна
+                continue
+            else:
+                record.update(fields, updated_at=updated_at)
+                _journal_write('peers', record)
 
 
 # Инициализация данных для демонстрации
+@_synchronized
 def init_demo_data():
     """Инициализация демонстрационных данных"""
     from werkzeug.security import generate_password_hash
     
     # Проверяем наличие демо-пользователя
     demo_user = get_user_by_username('demo')
-    if not demo_user:
+    if demo_user:
+        return
+
+    # Все демо-данные сохраняем одной операцией
+    with batch():
         # Создаем тестового пользователя
         user_id = save_user('demo', generate_password_hash('demo123'), 'demo@example.com')
         
@@ -349,7 +1382,7 @@ def init_demo_data():
         save_auto_reply(account1_id, 'привет', 'Привет! Чем могу помочь?')
         save_auto_reply(account2_id, 'цена', 'Актуальные цены можно узнать на нашем сайте.')
         
-        # Создаем тестовую массовую рассылку
+        # Создаем тестовую массовую рассылку (черновик: фоновый исполнитель ее не отправляет)
         save_mass_sending(account1_id, 'Привет! Приглашаю на мероприятие!', [contact1_id, contact2_id], 60, 2)
         
         # Инициализируем статистику
@@ -357,5 +1390,43 @@ def init_demo_data():
         update_statistics(account2_id, 5, 3)
 
 
+def _json_store_for_import():
+    """
+    Данные JSON-хранилища для переноса в новую базу SQLite (см. sqlite_storage.init_db):
+    записи коллекций и генератор сообщений из архива. None, если JSON-хранилища нет
+    """
+    if not any(os.path.exists(path) for path in (DATA_MANIFEST_FILE, DATABASE_FILE, JOURNAL_FILE, JOURNAL_COMPACTING_FILE)):
+        return None
+    load_data()
+    records = {entity_type: list(entity_records.values()) for entity_type, entity_records in data.items()}
+    messages = (message for chat_id in data['chats'] for message in message_archive.get_all(int(chat_id)))
+    return records, messages
+
+
+# При выборе SQLite подменяем функции работы с данными реализацией на SQLite.
+# Модули, импортирующие функции из backend.models, получают выбранный движок
+if STORAGE_ENGINE == 'sqlite':
+    from backend.sqlite_storage import (
+        init_db, batch,
+        save_user, get_user_by_username, get_user_by_id,
+        save_telegram_account, get_telegram_accounts, get_telegram_account, get_authorized_telegram_accounts,
+        update_telegram_account,
+        save_contact, save_contacts_bulk, get_contacts, save_chat, save_chats_bulk, save_dialogs, get_chats,
+        get_chat_by_telegram_id, update_chat_synced_message, edit_message_by_telegram_id,
+        get_sync_state, update_sync_state,
+        get_unfinished_mass_sendings, claim_mass_sending, update_mass_sending,
+        save_message, save_messages_bulk, get_messages, get_messages_page, save_auto_reply, get_auto_replies,
+        save_mass_sending, get_mass_sendings, update_statistics, get_statistics,
+        get_peer, save_peers_bulk
+    )
+    # Новая база заполняется данными JSON-хранилища, если оно есть
+    init_db(legacy_store=_json_store_for_import)
+    # Прочитанные для переноса данные больше не нужны
+    message_archive.close()
+    data = _empty_data()
+elif STORAGE_ENGINE != 'json':
+    raise ValueError(f"Неизвестный движок хранения данных: {STORAGE_ENGINE}")
+
+
 # Инициализация демо-данных при запуске
 init_demo_data()
@@ -1,18 +1,21 @@
-from flask import request, jsonify
-from flask_jwt_extended import create_access_token, create_refresh_token, get_jwt_identity
+from datetime import date, datetime
+from flask import request, jsonify, Response
+from flask_jwt_extended import create_access_token, create_refresh_token, get_jwt_identity, verify_jwt_in_request
 from werkzeug.security import generate_password_hash, check_password_hash
+import json
+import queue
 import time
 
 from backend.app import app
 from backend.auth import jwt_required_custom, account_owner_required, jwt_refresh_token_required
 from backend.models import (
-    get_user_by_username, get_user_by_id, save_user,
+    batch, get_user_by_username, get_user_by_id, save_user,
     get_telegram_accounts, save_telegram_account,
-    get_contacts, save_contact, get_chats, save_chat,
-    get_messages, save_message, get_auto_replies, save_auto_reply,
-    get_mass_sendings, save_mass_sending, get_statistics, update_statistics
+    get_contacts, save_contact, save_contacts_bulk, get_chats, save_dialogs, update_chat_synced_message,
+    get_messages_page, save_message, save_messages_bulk, get_auto_replies, save_auto_reply,
+    get_mass_sendings, save_mass_sending, get_statistics, update_statistics,
+    get_peer, save_peers_bulk, get_sync_state, update_sync_state
 )
-from backend.telegram_mock import simulate_telegram_api_call
 
 
 @app.route('/api/register', methods=['POST'])
@@ -214,6 +217,7 @@ def send_telegram_code():
 def verify_telegram_code():
     """Верификация кода подтверждения для авторизации в Telegram"""
     from backend.telegram_api import run_async, sign_in_with_code
+    from backend import telegram_pool
     
     data = request.json
     phone = data.get('phone')
@@ -263,6 +267,8 @@ def verify_telegram_code():
                 session_string=session_string
             )
             app.logger.info(f"Аккаунт {phone} успешно авторизован и сохранена строка сессии")
+            # Авторизованный клиент остается подключенным в пуле для следующих запросов
+            run_async(telegram_pool.register(account_id, phone, result.get('user_info')))
             break
     
     if not account_id:
@@ -282,6 +288,7 @@ def verify_telegram_code():
 def add_telegram_account():
     """Добавление нового аккаунта Telegram с использованием Telethon"""
     from backend.telegram_api import run_async, create_telegram_client
+    from backend import telegram_pool
     
     current_user_id = get_jwt_identity()
     # Преобразуем ID из строки в int
@@ -336,6 +343,10 @@ def add_telegram_account():
     status = 'authorized' if result.get('authorized', False) else 'pending'
     user_info = result.get('user_info', {})
     
+    # Авторизованный клиент остается подключенным в пуле для следующих запросов
+    if status == 'authorized':
+        run_async(telegram_pool.register(account_id, phone, user_info))
+    
     message = 'Аккаунт Telegram успешно добавлен'
     if status == 'pending':
         message += '. Для завершения авторизации требуется код подтверждения'
@@ -362,11 +373,27 @@ def add_telegram_account():
     return jsonify(response), 201
 
 
+def _connect_telegram_account(account):
+    """
+    Подготавливает клиент аккаунта для запросов к Telegram: берет подключенный клиент из пула
+    и подключается с сохраненной сессией только при его отсутствии
+    """
+    from backend.telegram_api import run_async
+    from backend import telegram_pool
+    
+    if not account.get('session_string'):
+        return
+    
+    client_result = run_async(telegram_pool.get_client(account))
+    if not (client_result.get('success') and client_result.get('authorized')):
+        app.logger.warning(f"Не удалось использовать сохраненную сессию для {account['phone']}: {client_result.get('error', 'неизвестная ошибка')}")
+
+
 @app.route('/api/telegram/contacts', methods=['GET'])
 @jwt_required_custom
 def list_contacts():
     """Список контактов аккаунта Telegram"""
-    from backend.telegram_api import run_async, get_contacts as tg_get_contacts, create_telegram_client
+    from backend.telegram_api import run_async, get_contacts as tg_get_contacts
     
     account_id = request.args.get('account_id', type=int)
     
@@ -385,38 +412,32 @@ def list_contacts():
     
     # Если у аккаунта есть API ID и API Hash, получаем контакты через Telegram API
     if account.get('api_id') and account.get('api_hash'):
-        # Если у аккаунта сохранена строка сессии, пытаемся использовать ее сначала
-        session_string = account.get('session_string')
+        # Берем подключенный клиент из пула: подключение и get_me только при его отсутствии
+        _connect_telegram_account(account)
+        sync_state = get_sync_state(account_id)
+        # Хэш сохраненного списка: если список в Telegram не изменился, он не передается повторно
+        known_hash = sync_state.get('contacts_hash') if 'contact_ids' in sync_state else None
+        result = run_async(tg_get_contacts(account['phone'], known_hash=known_hash))
         
-        # Если сессия есть, пробуем подключиться с ее использованием
-        if session_string:
-            app.logger.info(f"Подключаемся к аккаунту {account['phone']} с использованием сохраненной сессии")
-            # Создаем клиент с использованием строки сессии
-            client_result = run_async(
-                create_telegram_client(
-                    account['phone'], 
-                    account['api_id'], 
-                    account['api_hash'], 
-                    session_string=session_string
-                )
-            )
-            
-            # Если успешно подключились и авторизованы, получаем контакты
-            if client_result.get('success') and client_result.get('authorized'):
-                app.logger.info(f"Успешно подключились к аккаунту {account['phone']} с использованием сессии")
-                # Получаем контакты
-                result = run_async(tg_get_contacts(account['phone']))
-            else:
-                app.logger.warning(f"Не удалось использовать сохраненную сессию для {account['phone']}: {client_result.get('error', 'неизвестная ошибка')}")
-                # Если не удалось подключиться с сессией, пытаемся получить контакты обычным способом
-                result = run_async(tg_get_contacts(account['phone']))
-        else:
-            # Если нет сохраненной сессии, просто пытаемся получить контакты
-            result = run_async(tg_get_contacts(account['phone']))
+        # Запоминаем сущности контактов, чтобы отправка и чтение сообщений не искали их заново
+        if result.get('peers'):
+            save_peers_bulk(account_id, result['peers'])
         
         if 'error' in result:
             return jsonify({'error': result['error']}), 400
         
+        if result.get('unchanged'):
+            # Отвечаем сохраненным списком контактов
+            contacts_by_id = {contact['id']: contact for contact in get_contacts(account_id)}
+            saved_contacts = [{
+                'id': contact['id'],
+                'name': contact['name'],
+                'phone': contact['phone'],
+                'username': contact.get('username'),
+                'telegram_id': contact.get('telegram_id')
+            } for contact in map(contacts_by_id.get, sync_state['contact_ids']) if contact is not None]
+            return jsonify({'contacts': saved_contacts}), 200
+        
         # Обновляем контакты в нашей базе данных
         contacts_from_tg = result.get('contacts', [])
         saved_contacts = []
@@ -426,20 +447,20 @@ def list_contacts():
             if contact.get('last_name'):
                 name += f" {contact.get('last_name')}"
             
-            saved_contact_id = save_contact(
-                account_id, 
-                name or "Контакт без имени", 
-                contact.get('phone', '') or ""
-            )
-            
             saved_contacts.append({
-                'id': saved_contact_id,
                 'name': name or "Контакт без имени",
                 'phone': contact.get('phone', '') or "",
                 'username': contact.get('username', ''),
                 'telegram_id': contact.get('id')
             })
         
+        # Сохраняем все контакты одной операцией
+        saved_contact_ids = save_contacts_bulk(account_id, saved_contacts)
+        for saved_contact, saved_contact_id in zip(saved_contacts, saved_contact_ids):
+            saved_contact['id'] = saved_contact_id
+        update_sync_state(account_id, contacts_hash=result.get('hash'), contacts_saved_count=result.get('saved_count'),
+                          contact_ids=saved_contact_ids)
+        
         return jsonify({'contacts': saved_contacts}), 200
     
     # Если API ID и API Hash не указаны, возвращаем ошибку
@@ -520,14 +541,16 @@ def import_contacts():
             phone = contact.get('phone')
             
             if name and phone:
-                # TODO: В будущем добавить метод для реального добавления контакта через Telegram API
-                contact_id = save_contact(account_id, name, phone)
                 imported_contacts.append({
-                    'id': contact_id,
                     'name': name,
                     'phone': phone
                 })
         
+        # TODO: В будущем добавить метод для реального добавления контакта через Telegram API
+        contact_ids = save_contacts_bulk(account_id, imported_contacts)
+        for imported_contact, contact_id in zip(imported_contacts, contact_ids):
+            imported_contact['id'] = contact_id
+        
         return jsonify({
             'message': f'Успешно импортировано {len(imported_contacts)} контактов',
             'contacts': imported_contacts
@@ -540,10 +563,14 @@ def import_contacts():
 @app.route('/api/telegram/chats', methods=['GET'])
 @jwt_required_custom
 def list_chats():
-    """Список чатов аккаунта Telegram"""
-    from backend.telegram_api import run_async, get_dialogs, create_telegram_client
+    """
+    Список чатов аккаунта Telegram.
+    Параметр since (sync_cursor из предыдущего ответа) - вернуть только чаты, измененные после него
+    """
+    from backend.telegram_api import run_async, get_dialogs
     
     account_id = request.args.get('account_id', type=int)
+    since = request.args.get('since')
     
     if not account_id:
         return jsonify({'error': 'Требуется указать ID аккаунта'}), 400
@@ -558,131 +585,80 @@ def list_chats():
     if not account:
         return jsonify({'error': 'Аккаунт не найден'}), 404
     
-    # Если у аккаунта есть API ID и API Hash, получаем чаты через Telegram API
+    # Если у аккаунта есть API ID и API Hash, синхронизируем чаты с Telegram.
+    # Синхронизация инкрементальная: если с прошлого раза в аккаунте ничего не изменилось (pts),
+    # диалоги не запрашиваются, иначе загружаются только диалоги новее сохраненной даты
     if account.get('api_id') and account.get('api_hash'):
-        # Если у аккаунта сохранена строка сессии, пытаемся использовать ее сначала
-        session_string = account.get('session_string')
+        # Берем подключенный клиент из пула: подключение и get_me только при его отсутствии
+        _connect_telegram_account(account)
+        sync_state = get_sync_state(account_id)
+        result = run_async(get_dialogs(
+            account['phone'],
+            pts=sync_state.get('dialogs_pts'),
+            since=sync_state.get('dialogs_date')
+        ))
         
-        # Если сессия есть, пробуем подключиться с ее использованием
-        if session_string:
-            app.logger.info(f"Подключаемся к аккаунту {account['phone']} с использованием сохраненной сессии")
-            # Создаем клиент с использованием строки сессии
-            client_result = run_async(
-                create_telegram_client(
-                    account['phone'], 
-                    account['api_id'], 
-                    account['api_hash'], 
-                    session_string=session_string
-                )
-            )
-            
-            # Если успешно подключились и авторизованы, получаем чаты
-            if client_result.get('success') and client_result.get('authorized'):
-                app.logger.info(f"Успешно подключились к аккаунту {account['phone']} с использованием сессии")
-                # Получаем чаты
-                result = run_async(get_dialogs(account['phone']))
-            else:
-                app.logger.warning(f"Не удалось использовать сохраненную сессию для {account['phone']}: {client_result.get('error', 'неизвестная ошибка')}")
-                # Если не удалось подключиться с сессией, пытаемся получить чаты обычным способом
-                result = run_async(get_dialogs(account['phone']))
-        else:
-            # Если нет сохраненной сессии, просто пытаемся получить чаты
-            result = run_async(get_dialogs(account['phone']))
+        # Запоминаем сущности собеседников, чтобы отправка и чтение сообщений не искали их заново
+        if result.get('peers'):
+            save_peers_bulk(account_id, result['peers'])
         
         if 'error' in result:
             return jsonify({'error': result['error']}), 400
         
-        # Преобразуем диалоги в формат чатов для нашего приложения
-        dialogs_from_tg = result.get('dialogs', [])
-        saved_chats = []
-        
-        for dialog in dialogs_from_tg:
-            # Сначала добавляем или находим контакт
-            name = dialog.get('name', '')
-            
-            contact_id = None
-            contacts = get_contacts(account_id)
-            
-            # Ищем контакт по entity_id (Telegram ID)
-            contact = next((c for c in contacts if c.get('telegram_id') == dialog.get('entity_id')), None)
-            
-            if contact:
-                contact_id = contact['id']
-            else:
-                # Создаем новый контакт
-                contact_id = save_contact(
-                    account_id, 
-                    name or "Неизвестный контакт", 
-                    ""  # Телефон неизвестен
-                )
-            
-            # Сохраняем чат
-            chat_id = None
-            chats = get_chats(account_id)
-            
-            # Ищем существующий чат по Telegram ID
-            chat = next((c for c in chats if c.get('telegram_id') == dialog.get('id')), None)
-            
-            if chat:
-                chat_id = chat['id']
-                # Обновляем информацию в чате
-                # В текущей модели на основе JSON это требует отдельной реализации
-            else:
-                # Создаем новый чат
-                last_message = ""
-                if dialog.get('last_message') and dialog.get('last_message').get('text'):
-                    last_message = dialog.get('last_message').get('text')
-                
-                chat_id = save_chat(
-                    account_id, 
-                    contact_id, 
-                    last_message,
-                    dialog.get('unread_count', 0)
-                )
-            
-            saved_chat = {
-                'id': chat_id,
-                'account_id': account_id,
-                'contact_id': contact_id,
-                'telegram_id': dialog.get('id'),
-                'telegram_entity_id': dialog.get('entity_id'),
-                'name': name,
-                'last_message': dialog.get('last_message', {}).get('text', ''),
-                'unread_count': dialog.get('unread_count', 0),
-                'contact': {
-                    'id': contact_id,
-                    'name': name
-                }
-            }
-            
-            saved_chats.append(saved_chat)
-        
-        return jsonify({'chats': saved_chats}), 200
-    
-    # Если API ID и API Hash не указаны, возвращаем существующие чаты из нашей базы данных
-    chats_list = get_chats(account_id)
-    
-    # Добавляем информацию о контакте в каждый чат
-    for chat in chats_list:
-        contact_id = chat['contact_id']
-        contact = next((c for c in get_contacts(account_id) if c['id'] == contact_id), None)
-        if contact:
-            chat['contact'] = contact
-    
-    return jsonify({'chats': chats_list}), 200
+        if not result.get('unchanged'):
+            # Все изменения по диалогам сохраняем одной операцией
+            with batch():
+                save_dialogs(account_id, [{
+                    'telegram_id': dialog.get('id'),
+                    'telegram_entity_id': dialog.get('entity_id'),
+                    'name': dialog.get('name', ''),
+                    'last_message': (dialog.get('last_message') or {}).get('text') or '',
+                    'unread_count': dialog.get('unread_count', 0)
+                } for dialog in result.get('dialogs', [])])
+                update_sync_state(account_id, dialogs_pts=result.get('pts'), dialogs_date=result.get('date'))
+    
+    # Возвращаем чаты из нашей базы данных (все или только измененные после since)
+    sync_cursor = datetime.utcnow().isoformat()
+    chats_list = get_chats(account_id, updated_since=since)
+    
+    # Добавляем информацию о контакте в каждый чат (в копии: записи хранилища не меняем)
+    contacts = {contact['id']: contact for contact in get_contacts(account_id)}
+    chats_list = [
+        dict(chat, contact=contacts[chat['contact_id']]) if chat['contact_id'] in contacts else chat
+        for chat in chats_list
+    ]
+    
+    return jsonify({'chats': chats_list, 'sync_cursor': sync_cursor}), 200
+
+
+# Размер страницы истории сообщений по умолчанию и максимальный
+MESSAGES_PAGE_SIZE = 50
+MESSAGES_PAGE_MAX_SIZE = 200
 
 
 @app.route('/api/telegram/messages', methods=['GET'])
 @jwt_required_custom
 def list_messages():
-    """Список сообщений чата"""
-    from backend.telegram_api import run_async, get_messages as tg_get_messages
+    """
+    Страница сообщений чата (от старых к новым).
+    Параметры: before_id - более старые сообщения, after_id - более новые,
+    limit - размер страницы. Без курсора возвращается последняя страница
+    """
+    from backend.telegram_api import run_async, get_messages as tg_get_messages, peer_key
     
     chat_id = request.args.get('chat_id', type=int)
+    before_id = request.args.get('before_id', type=int)
+    after_id = request.args.get('after_id', type=int)
+    limit = request.args.get('limit', MESSAGES_PAGE_SIZE, type=int)
     
     if not chat_id:
         return jsonify({'error': 'Требуется указать ID чата'}), 400
     
+    if before_id is not None and after_id is not None:
+        return jsonify({'error': 'Укажите только один из параметров before_id и after_id'}), 400
+    
+    limit = max(1, min(limit, MESSAGES_PAGE_MAX_SIZE))
+    
     # Находим чат по ID
     current_user_id = get_jwt_identity()
     user_id = int(current_user_id)
@@ -706,36 +682,21 @@ def list_messages():
     if not account:
         return jsonify({'error': 'Аккаунт не найден'}), 404
     
-    # Если у аккаунта есть API ID и API Hash и в чате есть Telegram ID сущности
-    if account.get('api_id') and account.get('api_hash') and chat.get('telegram_entity_id'):
-        # Если у аккаунта сохранена строка сессии, пытаемся использовать ее сначала
-        session_string = account.get('session_string')
+    # Если у аккаунта есть API ID и API Hash и в чате есть Telegram ID сущности,
+    # сначала синхронизируем последние сообщения с Telegram.
+    # Более старые страницы (before_id) читаются только из локальной базы
+    if account.get('api_id') and account.get('api_hash') and chat.get('telegram_entity_id') and before_id is None:
+        # Берем подключенный клиент из пула: подключение и get_me только при его отсутствии
+        _connect_telegram_account(account)
+        entity_id = chat['telegram_entity_id']
+        peer = get_peer(account_id, peer_key(entity_id))
+        # Загружаем только сообщения новее последнего синхронизированного
+        result = run_async(tg_get_messages(
+            account['phone'], entity_id, peer=peer, min_id=chat.get('synced_telegram_id') or 0
+        ))
         
-        # Если сессия есть, пробуем подключиться с ее использованием
-        if session_string:
-            app.logger.info(f"Подключаемся к аккаунту {account['phone']} с использованием сохраненной сессии для получения сообщений")
-            # Создаем клиент с использованием строки сессии
-            client_result = run_async(
-                create_telegram_client(
-                    account['phone'], 
-                    account['api_id'], 
-                    account['api_hash'], 
-                    session_string=session_string
-                )
-            )
-            
-            # Если успешно подключились и авторизованы, получаем сообщения
-            if client_result.get('success') and client_result.get('authorized'):
-                app.logger.info(f"Успешно подключились к аккаунту {account['phone']} с использованием сессии")
-                # Получаем сообщения
-                result = run_async(tg_get_messages(account['phone'], chat['telegram_entity_id']))
-            else:
-                app.logger.warning(f"Не удалось использовать сохраненную сессию для {account['phone']}: {client_result.get('error', 'неизвестная ошибка')}")
-                # Если не удалось подключиться с сессией, пытаемся получить сообщения обычным способом
-                result = run_async(tg_get_messages(account['phone'], chat['telegram_entity_id']))
-        else:
-            # Если нет сохраненной сессии, просто пытаемся получить сообщения
-            result = run_async(tg_get_messages(account['phone'], chat['telegram_entity_id']))
+        if result.get('peers'):
+            save_peers_bulk(account_id, result['peers'])
         
         if 'error' in result:
             return jsonify({'error': result['error']}), 400
@@ -750,16 +711,7 @@ def list_messages():
             if msg.get('out', False):
                 sender_id = user_id  # Если сообщение исходящее, отправитель - текущий пользователь
             
-            # Сохраняем сообщение в нашей базе данных
-            # В реальном приложении нужно избегать дублирования сообщений
-            message_id = save_message(
-                chat_id,
-                sender_id,
-                msg.get('text', '')
-            )
-            
             saved_messages.append({
-                'id': message_id,
                 'chat_id': chat_id,
                 'sender_id': sender_id,
                 'text': msg.get('text', ''),
@@ -767,19 +719,24 @@ def list_messages():
                 'telegram_id': msg.get('id')
             })
         
-        return jsonify({'messages': saved_messages}), 200
+        # Сохраняем сообщения в нашей базе данных одной операцией.
+        # Уже сохраненные сообщения (по telegram_id) не дублируются
+        if saved_messages:
+            with batch():
+                save_messages_bulk(chat_id, saved_messages)
+                update_chat_synced_message(chat_id, saved_messages[-1]['telegram_id'])
     
-    # Если API ID и API Hash не указаны или нет Telegram entity ID, возвращаем сообщения из локальной базы
-    messages_list = get_messages(chat_id)
+    # Возвращаем запрошенную страницу из локальной базы
+    messages_list, next_cursor = get_messages_page(chat_id, before_id=before_id, after_id=after_id, limit=limit)
     
-    return jsonify({'messages': messages_list}), 200
+    return jsonify({'messages': messages_list, 'next_cursor': next_cursor}), 200
 
 
 @app.route('/api/telegram/messages', methods=['POST'])
 @jwt_required_custom
 def send_message():
     """Отправка сообщения через Telegram API"""
-    from backend.telegram_api import run_async, send_message_to_contact
+    from backend.telegram_api import run_async, send_message_to_contact, peer_key
     
     data = request.json
     
@@ -814,13 +771,23 @@ def send_message():
     # Если у аккаунта есть API ID и API Hash и в чате есть Telegram ID сущности
     if account.get('api_id') and account.get('api_hash') and chat.get('telegram_entity_id'):
         entity_id = chat['telegram_entity_id']
-        result = run_async(send_message_to_contact(account['phone'], entity_id, message_text))
+        
+        # Берем подключенный клиент из пула: подключение только при его отсутствии
+        _connect_telegram_account(account)
+        
+        # Сущность получателя берем из кэша: отправка занимает один запрос к Telegram
+        peer = get_peer(account_id, peer_key(entity_id))
+        result = run_async(send_message_to_contact(account['phone'], entity_id, message_text, peer=peer))
+        
+        if result.get('peers'):
+            save_peers_bulk(account_id, result['peers'])
         
         if 'error' in result:
             return jsonify({'error': result['error']}), 400
         
-        # Сохраняем сообщение как отправленное пользователем
-        message_id = save_message(chat_id, user_id, message_text)
+        # Сохраняем сообщение как отправленное пользователем вместе с его ID в Telegram,
+        # чтобы следующая синхронизация не создала дубликат
+        message_id = save_message(chat_id, user_id, message_text, telegram_id=result.get('message_id'))
         
         # Обновляем статистику
         update_statistics(account_id, sent=1)
@@ -860,6 +827,68 @@ def send_message():
     }), 201
 
 
+# Интервал (в секундах) служебных сообщений в потоке событий: не дают прокси закрыть
+# простаивающее соединение и продлевают жизнь клиентов Telegram в пуле
+EVENT_STREAM_KEEPALIVE = 15
+
+
+@app.route('/api/telegram/stream', methods=['GET'])
+def telegram_stream():
+    """
+    Поток событий (Server-Sent Events) с новыми и измененными сообщениями и чатами пользователя.
+    События: message - новое или измененное сообщение, chat - изменившийся чат,
+    resync - часть событий пропущена, данные нужно перезагрузить.
+    EventSource в браузере не передает заголовки, поэтому токен можно указать в параметре jwt
+    """
+    from backend import event_stream, telegram_pool
+    
+    try:
+        verify_jwt_in_request(locations=['headers', 'query_string'])
+        user_id = int(get_jwt_identity())
+    except Exception as e:
+        return jsonify({'error': f'Ошибка авторизации: {str(e)}'}), 401
+    
+    if not get_user_by_id(user_id):
+        return jsonify({'error': 'Пользователь не найден'}), 404
+    
+    subscription = event_stream.subscribe(user_id)
+    if subscription is None:
+        # Потоки заняли бы все потоки обработчиков (или поток выключен) - браузер будет опрашивать сервер
+        return jsonify({'error': 'Поток событий недоступен, используйте опрос'}), 503
+    
+    # События приходят от клиентов из пула - подключаем аккаунты пользователя
+    accounts = [account for account in get_telegram_accounts(user_id)
+                if account.get('api_id') and account.get('api_hash')]
+    try:
+        for account in accounts:
+            _connect_telegram_account(account)
+    except Exception:
+        event_stream.unsubscribe(user_id, subscription)
+        raise
+    
+    def generate():
+        try:
+            yield 'retry: 3000\n\n'
+            last_touch = time.monotonic()
+            while True:
+                try:
+                    event, payload = subscription.get(timeout=EVENT_STREAM_KEEPALIVE)
+                    yield f'event: {event}\ndata: {json.dumps(payload, ensure_ascii=False)}\n\n'
+                except queue.Empty:
+                    yield ': keepalive\n\n'
+                if time.monotonic() - last_touch >= EVENT_STREAM_KEEPALIVE:
+                    last_touch = time.monotonic()
+                    for account in accounts:
+                        telegram_pool.touch(account['id'])
+        finally:
+            event_stream.unsubscribe(user_id, subscription)
+    
+    return Response(generate(), mimetype='text/event-stream', headers={
+        'Cache-Control': 'no-cache',
+        'X-Accel-Buffering': 'no'  # Отключаем буферизацию ответа в nginx
+    })
+
+
 @app.route('/api/telegram/auto-replies', methods=['GET'])
 @jwt_required_custom
 def list_auto_replies():
@@ -943,7 +972,9 @@ def list_mass_sendings():
 @app.route('/api/telegram/mass-sendings', methods=['POST'])
 @jwt_required_custom
 def add_mass_sending():
-    """Добавление новой массовой рассылки"""
+    """Добавление новой массовой рассылки. Сообщения отправляются в фоне (backend/mass_sending.py)"""
+    from backend import mass_sending
+    
     data = request.json
     
     account_id = data.get('account_id')
@@ -955,19 +986,25 @@ def add_mass_sending():
     if not account_id or not message or not contacts_list:
         return jsonify({'error': 'Требуется указать ID аккаунта, сообщение и список контактов'}), 400
     
-    # Мок запрос к API для проверки возможности рассылки
-    result = simulate_telegram_api_call('check_mass_sending', {
-        'account_id': account_id,
-        'contacts_count': len(contacts_list)
-    })
+    try:
+        delay = int(delay)
+        frequency = int(frequency)
+    except (TypeError, ValueError):
+        return jsonify({'error': 'Задержка и частота должны быть числами'}), 400
     
-    if 'error' in result:
-        return jsonify({'error': result['error']}), 400
+    if delay < 0 or frequency <= 0:
+        return jsonify({'error': 'Задержка не может быть отрицательной, а частота должна быть больше нуля'}), 400
+    
+    # Рассылка действительно отправляет сообщения - проверяем, что аккаунт принадлежит пользователю
+    user_id = int(get_jwt_identity())
+    if not any(account['id'] == account_id for account in get_telegram_accounts(user_id)):
+        return jsonify({'error': 'Аккаунт не найден'}), 404
     
-    mass_sending_id = save_mass_sending(account_id, message, contacts_list, delay, frequency)
+    mass_sending_id = save_mass_sending(account_id, message, contacts_list, delay, frequency, status='queued')
     
-    # В реальном приложении здесь бы запускался фоновый процесс для рассылки
-    # В MVP будем просто возвращать информацию о созданной рассылке
+    # Рассылку подхватит фоновый исполнитель: он соблюдает задержку и частоту
+    # и обновляет sent_count и status по мере отправки
+    mass_sending.start()
     
     return jsonify({
         'message': 'Массовая рассылка успешно создана',
@@ -975,10 +1012,12 @@ def add_mass_sending():
             'id': mass_sending_id,
             'account_id': account_id,
             'message': message,
+            'contacts': contacts_list,
             'contacts_count': len(contacts_list),
             'delay': delay,
             'frequency': frequency,
-            'status': 'pending'
+            'status': 'queued',
+            'sent_count': 0
         }
     }), 201
 
@@ -986,22 +1025,47 @@ def add_mass_sending():
 @app.route('/api/telegram/statistics', methods=['GET'])
 @jwt_required_custom
 def get_account_statistics():
-    """Получение статистики аккаунта Telegram"""
+    """
+    Получение статистики аккаунта Telegram.
+    Параметры: days - количество последних дней или период from/to (ISO-даты, включительно)
+    """
     account_id = request.args.get('account_id', type=int)
     days = request.args.get('days', 7, type=int)
+    date_from = request.args.get('from')
+    date_to = request.args.get('to')
     
     if not account_id:
         return jsonify({'error': 'Требуется указать ID аккаунта'}), 400
     
-    stats = get_statistics(account_id, days)
+    try:
+        # Приводим даты к виду YYYY-MM-DD, в котором они хранятся
+        if date_from:
+            date_from = date.fromisoformat(date_from).isoformat()
+        if date_to:
+            date_to = date.fromisoformat(date_to).isoformat()
+    except ValueError:
+        return jsonify({'error': 'Даты from и to должны быть в формате YYYY-MM-DD'}), 400
+    
+    stats = get_statistics(account_id, days, date_from=date_from or None, date_to=date_to or None)
     
     return jsonify({'statistics': stats}), 200
 
 
 @app.route('/api/health', methods=['GET'])
 def health_check():
-    """Проверка работоспособности API"""
-    return jsonify({'status': 'ok'}), 200
+    """
+    Проверка работоспособности API.
+    Пока идет прогрев пула клиентов Telegram (TELEGRAM_WARMUP=1), возвращает 503 и ход прогрева,
+    чтобы балансировщик не направлял запросы в процесс до его завершения
+    """
+    from backend import telegram_pool
+    
+    warm_up = telegram_pool.warm_up_status()
+    if warm_up['status'] == 'idle':
+        return jsonify({'status': 'ok'}), 200
+    if warm_up['status'] == 'running':
+        return jsonify({'status': 'warming_up', 'warm_up': warm_up}), 503
+    return jsonify({'status': 'ok', 'warm_up': warm_up}), 200
 
 # Добавим обработчик OPTIONS для CORS preflight-запросов
 @app.route('/api/<path:path>', methods=['OPTIONS'])
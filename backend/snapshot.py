@@ -0,0 +1,92 @@
+# Формат файлов снимка JSON-хранилища.
+# Файл начинается с заголовка (сигнатура, версия формата, способ сжатия), за которым
+# идет компактный JSON без отступов, при необходимости сжатый gzip или zstd.
+# Файлы без заголовка (прежний формат с отступами) читаются как обычный JSON.
+import gzip
+import json
+import os
+
+try:
+    import zstandard
+except ImportError:  # zstd необязателен, без него доступны только none и gzip
+    zstandard = None
+
+try:
+    import orjson
+except ImportError:  # orjson необязателен, без него используется стандартный json
+    orjson = None
+
+# Сигнатура и версия формата в заголовке файла
+SNAPSHOT_MAGIC = b'TGMSNAP'
+SNAPSHOT_VERSION = 1
+
+# Способы сжатия и их коды в заголовке
+CODECS = {'none': 0, 'gzip': 1, 'zstd': 2}
+
+# Уровни сжатия: быстрые, так как снимок переписывается часто
+GZIP_LEVEL = 1
+ZSTD_LEVEL = 3
+
+_HEADER_SIZE = len(SNAPSHOT_MAGIC) + 2
+
+
+def _dumps(obj):
+    """Сериализовать в компактный JSON (UTF-8)"""
+    if orjson is not None:
+        return orjson.dumps(obj)
+    return json.dumps(obj, ensure_ascii=False, separators=(',', ':')).encode('utf-8')
+
+
+def _loads(raw):
+    """Разобрать JSON"""
+    if orjson is not None:
+        return orjson.loads(raw)
+    return json.loads(raw)
+
+
+def resolve_compression(compression):
+    """Проверить способ сжатия. Если zstandard не установлен, zstd заменяется на gzip"""
+    compression = compression.lower()
+    if compression not in CODECS:
+        raise ValueError(f"Неизвестный способ сжатия снимка: {compression}")
+    if compression == 'zstd' and zstandard is None:
+        print("Пакет zstandard не установлен, снимок будет сжат gzip")
+        return 'gzip'
+    return compression
+
+
+# Сжатие новых снимков: gzip (по умолчанию), zstd (если установлен пакет zstandard) или none
+SNAPSHOT_COMPRESSION = resolve_compression(os.environ.get('SNAPSHOT_COMPRESSION', 'gzip'))
+
+
+def encode(obj, compression=None):
+    """Сериализовать объект в файл снимка (bytes)"""
+    compression = resolve_compression(compression) if compression else SNAPSHOT_COMPRESSION
+    payload = _dumps(obj)
+    if compression == 'gzip':
+        payload = gzip.compress(payload, compresslevel=GZIP_LEVEL, mtime=0)
+    elif compression == 'zstd':
+        payload = zstandard.ZstdCompressor(level=ZSTD_LEVEL).compress(payload)
+    header = SNAPSHOT_MAGIC + bytes((SNAPSHOT_VERSION, CODECS[compression]))
+    return header + payload
+
+
+def decode(raw):
+    """Прочитать файл снимка любого поддерживаемого формата (bytes)"""
+    if not raw.startswith(SNAPSHOT_MAGIC):
+        # Прежний формат: JSON с отступами без заголовка
+        return json.loads(raw)
+
+    version, codec = raw[len(SNAPSHOT_MAGIC)], raw[len(SNAPSHOT_MAGIC) + 1]
+    if version > SNAPSHOT_VERSION:
+        raise ValueError(f"Снимок создан более новой версией приложения (формат {version})")
+    payload = raw[_HEADER_SIZE:]
+    if codec == CODECS['gzip']:
+        payload = gzip.decompress(payload)
+    elif codec == CODECS['zstd']:
+        if zstandard is None:
+            raise ValueError("Для чтения снимка нужен пакет zstandard")
+        payload = zstandard.ZstdDecompressor().decompress(payload)
+    elif codec != CODECS['none']:
+        raise ValueError(f"Неизвестный способ сжатия снимка: {codec}")
+    return _loads(payload)
@@ -0,0 +1,809 @@
+# Хранилище данных на SQLite.
+# Реализует те же функции, что и JSON-хранилище в backend/models.py, и подключается
+# вместо него при STORAGE_ENGINE=sqlite. База работает в режиме WAL,
+# соединения переиспользуются через пул.
+from contextlib import contextmanager
+from datetime import datetime
+import json
+import os
+import queue
+import sqlite3
+import threading
+
+# Путь к файлу базы данных SQLite
+SQLITE_DATABASE_FILE = os.environ.get('SQLITE_DATABASE_FILE', 'telegram_manager_data.db')
+
+# Максимальное количество простаивающих соединений в пуле
+SQLITE_POOL_SIZE = int(os.environ.get('SQLITE_POOL_SIZE', 8))
+
+# Сколько секунд воркер ждет, пока другой процесс применяет миграции и переносит данные
+SQLITE_MIGRATION_TIMEOUT = int(os.environ.get('SQLITE_MIGRATION_TIMEOUT', 600))
+
+# Миграции схемы. Номер последней примененной хранится в PRAGMA user_version,
+# новые изменения схемы добавляются в конец списка
+_MIGRATIONS = [
+    '''
+    CREATE TABLE IF NOT EXISTS users (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        username TEXT NOT NULL UNIQUE,
+        password_hash TEXT NOT NULL,
+        email TEXT,
+        created_at TEXT
+    );
+    CREATE TABLE IF NOT EXISTS telegram_accounts (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        user_id INTEGER NOT NULL,
+        account_name TEXT,
+        phone TEXT,
+        api_id INTEGER,
+        api_hash TEXT,
+        session_string TEXT,
+        created_at TEXT,
+        status TEXT
+    );
+    CREATE INDEX IF NOT EXISTS idx_telegram_accounts_user_id ON telegram_accounts (user_id);
+    CREATE TABLE IF NOT EXISTS contacts (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        account_id INTEGER NOT NULL,
+        name TEXT,
+        phone TEXT,
+        created_at TEXT
+    );
+    CREATE INDEX IF NOT EXISTS idx_contacts_account_id ON contacts (account_id);
+    CREATE TABLE IF NOT EXISTS chats (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        account_id INTEGER NOT NULL,
+        contact_id INTEGER,
+        last_message TEXT,
+        unread_count INTEGER NOT NULL DEFAULT 0,
+        created_at TEXT
+    );
+    CREATE INDEX IF NOT EXISTS idx_chats_account_id ON chats (account_id);
+    CREATE TABLE IF NOT EXISTS messages (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        chat_id INTEGER NOT NULL,
+        sender_id INTEGER,
+        text TEXT,
+        timestamp TEXT,
+        is_read INTEGER NOT NULL DEFAULT 0
+    );
+    CREATE INDEX IF NOT EXISTS idx_messages_chat_id_timestamp ON messages (chat_id, timestamp);
+    CREATE TABLE IF NOT EXISTS auto_replies (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        account_id INTEGER NOT NULL,
+        trigger_phrase TEXT,
+        reply_text TEXT,
+        is_active INTEGER NOT NULL DEFAULT 1,
+        created_at TEXT
+    );
+    CREATE INDEX IF NOT EXISTS idx_auto_replies_account_id ON auto_replies (account_id);
+    CREATE TABLE IF NOT EXISTS mass_sendings (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        account_id INTEGER NOT NULL,
+        message TEXT,
+        contacts TEXT,
+        delay INTEGER,
+        frequency INTEGER,
+        status TEXT,
+        sent_count INTEGER NOT NULL DEFAULT 0,
+        created_at TEXT
+    );
+    CREATE INDEX IF NOT EXISTS idx_mass_sendings_account_id ON mass_sendings (account_id);
+    CREATE TABLE IF NOT EXISTS statistics (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        account_id INTEGER NOT NULL,
+        date TEXT NOT NULL,
+        sent_messages INTEGER NOT NULL DEFAULT 0,
+        received_messages INTEGER NOT NULL DEFAULT 0,
+        UNIQUE (account_id, date)
+    );
+    ''',
+    # ID сообщения в Telegram: повторная синхронизация не создает дубликатов
+    '''
+    ALTER TABLE messages ADD COLUMN telegram_id INTEGER;
+    CREATE UNIQUE INDEX IF NOT EXISTS idx_messages_chat_id_telegram_id ON messages (chat_id, telegram_id);
+    ''',
+    # Постраничное чтение истории чата по курсору (ID сообщения)
+    '''
+    CREATE INDEX IF NOT EXISTS idx_messages_chat_id_id ON messages (chat_id, id);
+    ''',
+    # Кэш сущностей Telegram (ID, имя пользователя или телефон -> access_hash)
+    '''
+    CREATE TABLE IF NOT EXISTS peers (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        account_id INTEGER NOT NULL,
+        key TEXT NOT NULL,
+        peer_id INTEGER,
+        peer_type TEXT,
+        access_hash INTEGER,
+        resolved INTEGER NOT NULL DEFAULT 1,
+        updated_at TEXT,
+        UNIQUE (account_id, key)
+    );
+    ''',
+    # Диалоги Telegram в чатах и состояние синхронизации аккаунтов
+    '''
+    ALTER TABLE chats ADD COLUMN telegram_id INTEGER;
+    ALTER TABLE chats ADD COLUMN telegram_entity_id INTEGER;
+    ALTER TABLE chats ADD COLUMN updated_at TEXT;
+    UPDATE chats SET updated_at = created_at;
+    CREATE UNIQUE INDEX IF NOT EXISTS idx_chats_account_id_telegram_id ON chats (account_id, telegram_id);
+    CREATE TABLE IF NOT EXISTS sync_state (
+        account_id INTEGER PRIMARY KEY,
+        state TEXT NOT NULL
+    );
+    ''',
+    # ID последнего синхронизированного сообщения Telegram в чате
+    '''
+    ALTER TABLE chats ADD COLUMN synced_telegram_id INTEGER;
+    ''',
+    # Контакты Telegram: повторная синхронизация обновляет их, а не создает дубликаты
+    '''
+    ALTER TABLE contacts ADD COLUMN telegram_id INTEGER;
+    ALTER TABLE contacts ADD COLUMN username TEXT;
+    CREATE UNIQUE INDEX IF NOT EXISTS idx_contacts_account_id_telegram_id ON contacts (account_id, telegram_id);
+    ''',
+    # Выполнение массовых рассылок: неудачные отправки, захват рассылки процессом и ошибка
+    '''
+    ALTER TABLE mass_sendings ADD COLUMN failed_count INTEGER NOT NULL DEFAULT 0;
+    ALTER TABLE mass_sendings ADD COLUMN locked_until TEXT;
+    ALTER TABLE mass_sendings ADD COLUMN error TEXT;
+    CREATE INDEX IF NOT EXISTS idx_mass_sendings_status ON mass_sendings (status);
+    ''',
+    # Рассылки pending созданы, когда отправка только имитировалась: исполнитель выполняет только
+    # queued, а такие рассылки становятся черновиками
+    '''
+    UPDATE mass_sendings SET status = 'draft' WHERE status = 'pending';
+    ''',
+]
+
+# Пул простаивающих соединений
+_pool = queue.LifoQueue(maxsize=SQLITE_POOL_SIZE)
+
+# Соединение открытого в текущем потоке блока batch()
+_local = threading.local()
+
+
+def _connect():
+    """Открыть новое соединение с базой"""
+    connection = sqlite3.connect(SQLITE_DATABASE_FILE, timeout=30, check_same_thread=False)
+    connection.row_factory = sqlite3.Row
+    connection.execute('PRAGMA journal_mode=WAL')
+    connection.execute('PRAGMA synchronous=NORMAL')
+    return connection
+
+
+@contextmanager
+def _connection():
+    """Взять соединение из пула и выполнить операции в одной транзакции"""
+    batch_connection = getattr(_local, 'connection', None)
+    if batch_connection is not None:
+        # Внутри batch() все операции идут в его транзакции
+        yield batch_connection
+        return
+
+    try:
+        connection = _pool.get_nowait()
+    except queue.Empty:
+        connection = _connect()
+
+    try:
+        with connection:
+            yield connection
+    finally:
+        try:
+            _pool.put_nowait(connection)
+        except queue.Full:
+            connection.close()
+
+
+@contextmanager
+def batch():
+    """Выполнить несколько операций записи в одной транзакции"""
+    if getattr(_local, 'connection', None) is not None:
+        # Вложенный блок выполняется в транзакции внешнего
+        yield
+        return
+
+    with _connection() as connection:
+        _local.connection = connection
+        try:
+            yield
+        finally:
+            _local.connection = None
+
+
+def _statements(script):
+    """Разбить скрипт миграции на отдельные SQL-команды"""
+    statement = ''
+    for line in script.splitlines(keepends=True):
+        statement += line
+        if sqlite3.complete_statement(statement):
+            yield statement.strip()
+            statement = ''
+    if statement.strip():
+        yield statement.strip()
+
+
+def init_db(legacy_store=None):
+    """
+    Создать или обновить схему базы данных.
+    Воркеры запускаются одновременно, поэтому миграции применяются вместе с изменением
+    user_version в одной транзакции BEGIN IMMEDIATE: пока один процесс мигрирует, остальные ждут,
+    а затем видят уже обновленную версию
+
+    legacy_store: функция, возвращающая данные JSON-хранилища для переноса (records, messages)
+    или None, если хранилища нет. Вызывается только при создании новой базы; данные переносятся
+    в той же транзакции, поэтому другие воркеры не увидят пустую базу
+    """
+    connection = _connect()
+    connection.isolation_level = None
+    # Перенос большого хранилища может занять больше стандартного ожидания блокировки
+    connection.execute(f'PRAGMA busy_timeout = {SQLITE_MIGRATION_TIMEOUT * 1000}')
+    try:
+        connection.execute('BEGIN IMMEDIATE')
+        try:
+            version = connection.execute('PRAGMA user_version').fetchone()[0]
+            for migration in _MIGRATIONS[version:]:
+                for statement in _statements(migration):
+                    connection.execute(statement)
+            if version < len(_MIGRATIONS):
+                connection.execute(f'PRAGMA user_version = {len(_MIGRATIONS)}')
+            if version == 0 and legacy_store is not None:
+                store = legacy_store()
+                if store is not None:
+                    _import_legacy_store(connection, *store)
+            connection.execute('COMMIT')
+        except BaseException:
+            connection.execute('ROLLBACK')
+            raise
+    finally:
+        connection.close()
+    print(f"База данных SQLite готова: {SQLITE_DATABASE_FILE}")
+
+
+def _import_legacy_store(connection, records, messages):
+    """
+    Перенести данные JSON-хранилища в новую базу с сохранением ID
+
+    records: словарь {коллекция: список записей} в формате backend/models.py
+    messages: сообщения из архива
+    """
+    counts = {}
+    for table, table_records in list(records.items()) + [('messages', messages)]:
+        columns = {row['name'] for row in connection.execute(f'PRAGMA table_info({table})')}
+        counts[table] = 0
+        for record in table_records:
+            if table == 'sync_state':
+                record = {
+                    'account_id': record['account_id'],
+                    'state': {key: value for key, value in record.items() if key not in ('id', 'account_id')}
+                }
+            row = {key: json.dumps(value) if isinstance(value, (dict, list)) else value
+                   for key, value in record.items() if key in columns}
+            connection.execute(
+                f'INSERT INTO {table} ({", ".join(row)}) VALUES ({", ".join("?" * len(row))})',
+                list(row.values())
+            )
+            counts[table] += 1
+    print("Из JSON-хранилища перенесено: " + ', '.join(f'{table} - {count}' for table, count in counts.items()))
+
+
+def _now():
+    """Текущее время в формате, который используется в JSON-хранилище"""
+    return datetime.utcnow().isoformat()
+
+
+def _row_to_dict(row, bool_fields=(), json_fields=()):
+    """Преобразовать строку результата в словарь того же вида, что и в JSON-хранилище"""
+    if row is None:
+        return None
+    record = dict(row)
+    for field in bool_fields:
+        record[field] = bool(record[field])
+    for field in json_fields:
+        record[field] = json.loads(record[field]) if record[field] is not None else None
+    return record
+
+
+def _fetch_all(query, params=(), **kwargs):
+    """Выполнить запрос и вернуть список словарей"""
+    with _connection() as connection:
+        rows = connection.execute(query, params).fetchall()
+    return [_row_to_dict(row, **kwargs) for row in rows]
+
+
+def _fetch_one(query, params=(), **kwargs):
+    """Выполнить запрос и вернуть одну запись или None"""
+    with _connection() as connection:
+        row = connection.execute(query, params).fetchone()
+    return _row_to_dict(row, **kwargs)
+
+
+# Функции для работы с данными
+
+def save_user(username, password_hash, email=None):
+    """Сохранить нового пользователя"""
+    with _connection() as connection:
+        # Проверяем, существует ли уже пользователь с таким именем
+        row = connection.execute('SELECT id FROM users WHERE username = ?', (username,)).fetchone()
+        if row:
+            return row['id']  # Возвращаем существующий ID
+
+        cursor = connection.execute(
+            'INSERT INTO users (username, password_hash, email, created_at) VALUES (?, ?, ?, ?)',
+            (username, password_hash, email, _now())
+        )
+        return cursor.lastrowid
+
+
+def get_user_by_username(username):
+    """Получить пользователя по имени"""
+    return _fetch_one('SELECT * FROM users WHERE username = ?', (username,))
+
+
+def get_user_by_id(user_id):
+    """Получить пользователя по ID"""
+    return _fetch_one('SELECT * FROM users WHERE id = ?', (user_id,))
+
+
+def save_telegram_account(user_id, account_name, phone, api_id=None, api_hash=None, session_string=None):
+    """Сохранить аккаунт Telegram"""
+    status = 'authorized' if session_string else ('pending' if api_id and api_hash else 'waiting_for_api')
+    with _connection() as connection:
+        cursor = connection.execute(
+            '''INSERT INTO telegram_accounts
+               (user_id, account_name, phone, api_id, api_hash, session_string, created_at, status)
+               VALUES (?, ?, ?, ?, ?, ?, ?, ?)''',
+            (user_id, account_name, phone, api_id, api_hash, session_string, _now(), status)
+        )
+        return cursor.lastrowid
+
+
+def get_telegram_accounts(user_id):
+    """Получить все аккаунты Telegram пользователя"""
+    return _fetch_all('SELECT * FROM telegram_accounts WHERE user_id = ? ORDER BY id', (user_id,))
+
+
+def get_authorized_telegram_accounts():
+    """Получить аккаунты Telegram всех пользователей с сохраненной сессией и API ID / API Hash"""
+    return _fetch_all(
+        '''SELECT * FROM telegram_accounts
+           WHERE session_string != '' AND api_id IS NOT NULL AND api_hash != '' ORDER BY id'''
+    )
+
+
+def get_telegram_account(account_id):
+    """Получить аккаунт Telegram по ID"""
+    return _fetch_one('SELECT * FROM telegram_accounts WHERE id = ?', (account_id,))
+
+
+def update_telegram_account(account_id, **kwargs):
+    """Обновить данные аккаунта Telegram"""
+    with _connection() as connection:
+        columns = {row['name'] for row in connection.execute('PRAGMA table_info(telegram_accounts)')}
+        # Обновляем только существующие поля
+        updates = {key: value for key, value in kwargs.items() if key in columns and key != 'id'}
+
+        # Если обновляем строку сессии, считаем аккаунт авторизованным
+        if kwargs.get('session_string'):
+            updates['status'] = 'authorized'
+
+        if not updates:
+            row = connection.execute('SELECT 1 FROM telegram_accounts WHERE id = ?', (account_id,)).fetchone()
+            return row is not None
+
+        assignments = ', '.join(f'{key} = ?' for key in updates)
+        cursor = connection.execute(
+            f'UPDATE telegram_accounts SET {assignments} WHERE id = ?',
+            (*updates.values(), account_id)
+        )
+        return cursor.rowcount > 0
+
+
+def save_contact(account_id, name, phone):
+    """Сохранить контакт"""
+    with _connection() as connection:
+        cursor = connection.execute(
+            'INSERT INTO contacts (account_id, name, phone, created_at) VALUES (?, ?, ?, ?)',
+            (account_id, name, phone, _now())
+        )
+        return cursor.lastrowid
+
+
+def save_contacts_bulk(account_id, contacts):
+    """Сохранить несколько контактов одной транзакцией (см. models.save_contacts_bulk)"""
+    created_at = _now()
+    contact_ids = []
+    with _connection() as connection:
+        for contact in contacts:
+            telegram_id = contact.get('telegram_id')
+            row = None
+            if telegram_id is not None:
+                row = connection.execute(
+                    'SELECT id, name, phone, username FROM contacts WHERE account_id = ? AND telegram_id = ?',
+                    (account_id, telegram_id)
+                ).fetchone()
+            if row is None:
+                contact_ids.append(connection.execute(
+                    '''INSERT INTO contacts (account_id, name, phone, username, telegram_id, created_at)
+                       VALUES (?, ?, ?, ?, ?, ?)''',
+                    (account_id, contact['name'], contact['phone'],
+                     contact.get('username') if telegram_id is not None else None, telegram_id, created_at)
+                ).lastrowid)
+                continue
+
+            changes = {field: contact.get(field) for field in ('name', 'phone', 'username')
+                       if row[field] != contact.get(field)}
+            if changes:
+                assignments = ', '.join(f'{field} = ?' for field in changes)
+                connection.execute(f'UPDATE contacts SET {assignments} WHERE id = ?', (*changes.values(), row['id']))
+            contact_ids.append(row['id'])
+    return contact_ids
+
+
+def get_contacts(account_id):
+    """Получить контакты аккаунта"""
+    return _fetch_all('SELECT * FROM contacts WHERE account_id = ? ORDER BY id', (account_id,))
+
+
+def save_chat(account_id, contact_id, last_message='', unread_count=0):
+    """Сохранить чат"""
+    created_at = _now()
+    with _connection() as connection:
+        cursor = connection.execute(
+            '''INSERT INTO chats (account_id, contact_id, last_message, unread_count, created_at, updated_at)
+               VALUES (?, ?, ?, ?, ?, ?)''',
+            (account_id, contact_id, last_message, unread_count, created_at, created_at)
+        )
+        return cursor.lastrowid
+
+
+def save_chats_bulk(account_id, chats):
+    """Сохранить несколько чатов одной транзакцией"""
+    created_at = _now()
+    with _connection() as connection:
+        return [connection.execute(
+            '''INSERT INTO chats (account_id, contact_id, last_message, unread_count, created_at, updated_at)
+               VALUES (?, ?, ?, ?, ?, ?)''',
+            (account_id, chat['contact_id'], chat.get('last_message', ''), chat.get('unread_count', 0),
+             created_at, created_at)
+        ).lastrowid for chat in chats]
+
+
+def save_dialogs(account_id, dialogs):
+    """Сохранить диалоги Telegram как чаты аккаунта одной транзакцией (см. models.save_dialogs)"""
+    updated_at = _now()
+    chat_ids = []
+    with _connection() as connection:
+        for dialog in dialogs:
+            row = connection.execute(
+                'SELECT id, last_message, unread_count FROM chats WHERE account_id = ? AND telegram_id = ?',
+                (account_id, dialog['telegram_id'])
+            ).fetchone()
+            if row is None:
+                contact_id = connection.execute(
+                    'INSERT INTO contacts (account_id, name, phone, created_at) VALUES (?, ?, ?, ?)',
+                    (account_id, dialog.get('name') or 'Неизвестный контакт', '', updated_at)
+                ).lastrowid
+                chat_ids.append(connection.execute(
+                    '''INSERT INTO chats (account_id, contact_id, last_message, unread_count,
+                                          telegram_id, telegram_entity_id, created_at, updated_at)
+                       VALUES (?, ?, ?, ?, ?, ?, ?, ?)''',
+                    (account_id, contact_id, dialog.get('last_message', ''), dialog.get('unread_count', 0),
+                     dialog['telegram_id'], dialog.get('telegram_entity_id'), updated_at, updated_at)
+                ).lastrowid)
+                continue
+
+            changes = {field: dialog[field] for field in ('last_message', 'unread_count')
+                       if field in dialog and row[field] != dialog[field]}
+            if changes:
+                assignments = ', '.join(f'{field} = ?' for field in changes)
+                connection.execute(
+                    f'UPDATE chats SET {assignments}, updated_at = ? WHERE id = ?',
+                    (*changes.values(), updated_at, row['id'])
+                )
+            chat_ids.append(row['id'])
+    return chat_ids
+
+
+def get_chats(account_id, updated_since=None):
+    """Получить чаты аккаунта (только измененные после updated_since, если указано)"""
+    if updated_since is None:
+        return _fetch_all('SELECT * FROM chats WHERE account_id = ? ORDER BY id', (account_id,))
+    return _fetch_all(
+        'SELECT * FROM chats WHERE account_id = ? AND COALESCE(updated_at, created_at) > ? ORDER BY id',
+        (account_id, updated_since)
+    )
+
+
+def get_chat_by_telegram_id(account_id, telegram_id):
+    """Получить чат аккаунта по ID диалога в Telegram"""
+    return _fetch_one('SELECT * FROM chats WHERE account_id = ? AND telegram_id = ?', (account_id, telegram_id))
+
+
+def update_chat_synced_message(chat_id, telegram_id):
+    """Запомнить ID последнего синхронизированного сообщения Telegram в чате"""
+    if telegram_id is None:
+        return
+    with _connection() as connection:
+        connection.execute(
+            '''UPDATE chats SET synced_telegram_id = ?
+               WHERE id = ? AND COALESCE(synced_telegram_id, 0) < ?''',
+            (telegram_id, chat_id, telegram_id)
+        )
+
+
+def get_sync_state(account_id):
+    """Состояние синхронизации аккаунта с Telegram (словарь, пустой до первой синхронизации)"""
+    row = _fetch_one('SELECT state FROM sync_state WHERE account_id = ?', (account_id,), json_fields=('state',))
+    return row['state'] if row else {}
+
+
+def update_sync_state(account_id, **fields):
+    """
+    Обновить поля состояния синхронизации аккаунта с Telegram.
+    Разные поля одного аккаунта пишут параллельно (догоняющая синхронизация, поддержание соединения,
+    список чатов), поэтому меняются только переданные ключи JSON и одной командой
+    """
+    if not fields:
+        return
+    # Имена полей - имена аргументов функции, подставлять их в путь JSON безопасно
+    paths = ', '.join(f"'$.{name}', json(?)" for name in fields)
+    values = [json.dumps(value) for value in fields.values()]
+    with _connection() as connection:
+        connection.execute(
+            f'''INSERT INTO sync_state (account_id, state) VALUES (?, ?)
+               ON CONFLICT (account_id) DO UPDATE SET state = json_set(state, {paths})''',
+            [account_id, json.dumps(fields)] + values
+        )
+
+
+def save_message(chat_id, sender_id, text, telegram_id=None):
+    """Сохранить сообщение (сообщение с уже сохраненным в чате telegram_id не дублируется)"""
+    with _connection() as connection:
+        # Это же сообщение может одновременно сохранять обработчик обновлений Telegram,
+        # поэтому проверка и вставка выполняются одной командой
+        cursor = connection.execute(
+            '''INSERT INTO messages (chat_id, sender_id, text, timestamp, is_read, telegram_id)
+               VALUES (?, ?, ?, ?, 0, ?)
+               ON CONFLICT (chat_id, telegram_id) DO NOTHING''',
+            (chat_id, sender_id, text, _now(), telegram_id)
+        )
+        if cursor.rowcount == 0:
+            return connection.execute(
+                'SELECT id FROM messages WHERE chat_id = ? AND telegram_id = ?', (chat_id, telegram_id)
+            ).fetchone()['id']
+
+        # Обновляем последнее сообщение в чате
+        connection.execute(
+            '''UPDATE chats SET last_message = ?, unread_count = unread_count + ?, updated_at = ?
+               WHERE id = ?''',
+            (text, 1 if sender_id != 0 else 0, _now(), chat_id)
+        )
+        return cursor.lastrowid
+
+
+def save_messages_bulk(chat_id, messages):
+    """
+    Сохранить несколько сообщений чата одной транзакцией.
+    Сообщения с уже сохраненным в чате telegram_id не дублируются, у них обновляется текст
+    """
+    message_ids = []
+    new_messages = []
+    timestamp = _now()
+    with _connection() as connection:
+        for message in messages:
+            telegram_id = message.get('telegram_id')
+            cursor = connection.execute(
+                '''INSERT INTO messages (chat_id, sender_id, text, timestamp, is_read, telegram_id)
+                   VALUES (?, ?, ?, ?, 0, ?)
+                   ON CONFLICT (chat_id, telegram_id) DO NOTHING''',
+                (chat_id, message['sender_id'], message['text'], timestamp, telegram_id)
+            )
+            if cursor.rowcount:
+                message_ids.append(cursor.lastrowid)
+                new_messages.append(message)
+                continue
+
+            row = connection.execute(
+                'SELECT id, text FROM messages WHERE chat_id = ? AND telegram_id = ?', (chat_id, telegram_id)
+            ).fetchone()
+            if row['text'] != message['text']:
+                # Сообщение было отредактировано
+                connection.execute('UPDATE messages SET text = ? WHERE id = ?', (message['text'], row['id']))
+            message_ids.append(row['id'])
+
+        if new_messages:
+            # Обновляем последнее сообщение в чате один раз
+            connection.execute(
+                '''UPDATE chats SET last_message = ?, unread_count = unread_count + ?, updated_at = ?
+                   WHERE id = ?''',
+                (new_messages[-1]['text'], sum(1 for message in new_messages if message['sender_id'] != 0),
+                 timestamp, chat_id)
+            )
+    return message_ids
+
+
+def edit_message_by_telegram_id(chat_id, telegram_id, text):
+    """
+    Изменить текст сохраненного сообщения по его ID в Telegram
+    Возвращает ID сообщения или None, если такого сообщения в чате нет
+    """
+    with _connection() as connection:
+        row = connection.execute(
+            'SELECT id, text FROM messages WHERE chat_id = ? AND telegram_id = ?', (chat_id, telegram_id)
+        ).fetchone()
+        if row is None:
+            return None
+        if row['text'] != text:
+            connection.execute('UPDATE messages SET text = ? WHERE id = ?', (text, row['id']))
+        return row['id']
+
+
+def get_messages(chat_id):
+    """Получить все сообщения чата"""
+    return _fetch_all(
+        'SELECT * FROM messages WHERE chat_id = ? ORDER BY id',
+        (chat_id,), bool_fields=('is_read',)
+    )
+
+
+def get_messages_page(chat_id, before_id=None, after_id=None, limit=50):
+    """
+    Получить страницу сообщений чата (от старых к новым)
+    и курсор следующей страницы в том же направлении (см. models.get_messages_page)
+    """
+    # Запрашиваем на одно сообщение больше, чтобы узнать, есть ли следующая страница
+    if after_id is not None:
+        rows = _fetch_all(
+            'SELECT * FROM messages WHERE chat_id = ? AND id > ? ORDER BY id LIMIT ?',
+            (chat_id, after_id, limit + 1), bool_fields=('is_read',)
+        )
+        page = rows[:limit]
+        return page, (page[-1]['id'] if len(rows) > limit else None)
+
+    if before_id is not None:
+        rows = _fetch_all(
+            'SELECT * FROM messages WHERE chat_id = ? AND id < ? ORDER BY id DESC LIMIT ?',
+            (chat_id, before_id, limit + 1), bool_fields=('is_read',)
+        )
+    else:
+        rows = _fetch_all(
+            'SELECT * FROM messages WHERE chat_id = ? ORDER BY id DESC LIMIT ?',
+            (chat_id, limit + 1), bool_fields=('is_read',)
+        )
+    page = rows[:limit][::-1]
+    return page, (page[0]['id'] if len(rows) > limit else None)
+
+
+def save_auto_reply(account_id, trigger_phrase, reply_text, is_active=True):
+    """Сохранить авто-ответ"""
+    with _connection() as connection:
+        cursor = connection.execute(
+            '''INSERT INTO auto_replies (account_id, trigger_phrase, reply_text, is_active, created_at)
+               VALUES (?, ?, ?, ?, ?)''',
+            (account_id, trigger_phrase, reply_text, int(bool(is_active)), _now())
+        )
+        return cursor.lastrowid
+
+
+def get_auto_replies(account_id):
+    """Получить авто-ответы аккаунта"""
+    return _fetch_all(
+        'SELECT * FROM auto_replies WHERE account_id = ? ORDER BY id',
+        (account_id,), bool_fields=('is_active',)
+    )
+
+
+def save_mass_sending(account_id, message, contacts_list, delay, frequency, status='draft'):
+    """Сохранить массовую рассылку (status: draft или queued, см. models.save_mass_sending)"""
+    with _connection() as connection:
+        cursor = connection.execute(
+            '''INSERT INTO mass_sendings
+               (account_id, message, contacts, delay, frequency, status, sent_count, created_at)
+               VALUES (?, ?, ?, ?, ?, ?, 0, ?)''',
+            (account_id, message, json.dumps(contacts_list, ensure_ascii=False), delay, frequency, status, _now())
+        )
+        return cursor.lastrowid
+
+
+def get_mass_sendings(account_id):
+    """Получить массовые рассылки аккаунта"""
+    return _fetch_all(
+        'SELECT * FROM mass_sendings WHERE account_id = ? ORDER BY id',
+        (account_id,), json_fields=('contacts',)
+    )
+
+
+def get_unfinished_mass_sendings():
+    """Получить незавершенные (queued и in_progress) массовые рассылки всех аккаунтов"""
+    return _fetch_all(
+        "SELECT * FROM mass_sendings WHERE status IN ('queued', 'in_progress') ORDER BY id",
+        json_fields=('contacts',)
+    )
+
+
+def claim_mass_sending(mass_sending_id, locked_until):
+    """Захватить незавершенную массовую рассылку для выполнения (см. models.claim_mass_sending)"""
+    with _connection() as connection:
+        cursor = connection.execute(
+            '''UPDATE mass_sendings SET status = 'in_progress', locked_until = ?
+               WHERE id = ? AND status IN ('queued', 'in_progress')
+                   AND (locked_until IS NULL OR locked_until <= ?)''',
+            (locked_until, mass_sending_id, _now())
+        )
+        if cursor.rowcount == 0:
+            return None
+        row = connection.execute('SELECT * FROM mass_sendings WHERE id = ?', (mass_sending_id,)).fetchone()
+    return _row_to_dict(row, json_fields=('contacts',))
+
+
+def update_mass_sending(mass_sending_id, **fields):
+    """Обновить поля массовой рассылки (sent_count, failed_count, status, locked_until, error)"""
+    assignments = ', '.join(f'{field} = ?' for field in fields)
+    with _connection() as connection:
+        cursor = connection.execute(
+            f'UPDATE mass_sendings SET {assignments} WHERE id = ?', (*fields.values(), mass_sending_id)
+        )
+        return cursor.rowcount > 0
+
+
+def update_statistics(account_id, sent=0, received=0):
+    """Обновить статистику"""
+    today = datetime.now().date().isoformat()
+    with _connection() as connection:
+        connection.execute(
+            '''INSERT INTO statistics (account_id, date, sent_messages, received_messages)
+               VALUES (?, ?, ?, ?)
+               ON CONFLICT (account_id, date) DO UPDATE SET
+                   sent_messages = sent_messages + excluded.sent_messages,
+                   received_messages = received_messages + excluded.received_messages''',
+            (account_id, today, sent, received)
+        )
+        row = connection.execute(
+            'SELECT id FROM statistics WHERE account_id = ? AND date = ?', (account_id, today)
+        ).fetchone()
+        return row['id']
+
+
+def get_statistics(account_id, days=7, date_from=None, date_to=None):
+    """Получить статистику аккаунта (см. models.get_statistics)"""
+    # Оба варианта читают уникальный индекс (account_id, date)
+    if date_from is None and date_to is None:
+        return _fetch_all(
+            'SELECT * FROM statistics WHERE account_id = ? ORDER BY date DESC LIMIT ?',
+            (account_id, days)
+        )
+    return _fetch_all(
+        'SELECT * FROM statistics WHERE account_id = ? AND date >= ? AND date <= ? ORDER BY date DESC',
+        (account_id, date_from or '', date_to or '9999-12-31')
+    )
+
+
+def get_peer(account_id, key):
+    """
+    Получить запись кэша сущностей Telegram аккаунта
+
+    key: ключ сущности - id:<ID>, username:<имя пользователя> или phone:<номер>
+    """
+    return _fetch_one('SELECT * FROM peers WHERE account_id = ? AND key = ?', (account_id, key),
+                      bool_fields=('resolved',))
+
+
+def save_peers_bulk(account_id, peers):
+    """Сохранить записи кэша сущностей Telegram одной транзакцией (записи с тем же ключом обновляются)"""
+    updated_at = _now()
+    with _connection() as connection:
+        connection.executemany(
+            '''INSERT INTO peers (account_id, key, peer_id, peer_type, access_hash, resolved, updated_at)
+               VALUES (?, ?, ?, ?, ?, ?, ?)
+               ON CONFLICT (account_id, key) DO UPDATE SET
+                   peer_id = excluded.peer_id, peer_type = excluded.peer_type,
+                   access_hash = excluded.access_hash, resolved = excluded.resolved,
+                   updated_at = excluded.updated_at
+               WHERE NOT excluded.resolved OR peers.resolved = 0 OR peers.peer_id IS NOT excluded.peer_id
+                   OR peers.peer_type IS NOT excluded.peer_type OR peers.access_hash IS NOT excluded.access_hash''',
+            [(account_id, peer['key'], peer.get('peer_id'), peer.get('peer_type'), peer.get('access_hash'),
+              int(peer.get('resolved', True)), updated_at) for peer in peers]
+        )
@@ -1,6 +1,9 @@
 import os
 import logging
 import asyncio
+import atexit
+import threading
+from datetime import datetime
 from pathlib import Path
 from telethon import TelegramClient
 from telethon.sessions import StringSession
@@ -9,8 +12,20 @@ from telethon.errors import (
     ApiIdInvalidError, 
     PhoneCodeInvalidError,
     SessionPasswordNeededError,
-    FloodWaitError
+    PasswordHashInvalidError,
+    FloodWaitError,
+    UsernameInvalidError,
+    UsernameNotOccupiedError
 )
+from telethon.tl.functions.contacts import GetContactsRequest
+from telethon.tl.functions.updates import GetStateRequest
+from telethon.tl.types import Channel, Chat, InputPeerChannel, InputPeerChat, InputPeerUser
+from telethon.tl.types.contacts import ContactsNotModified
+
+try:
+    import uvloop
+except ImportError:  # uvloop необязателен, без него используется стандартный цикл asyncio
+    uvloop = None
 
 # Настройка логирования
 logging.basicConfig(level=logging.INFO)
@@ -20,9 +35,126 @@ logger = logging.getLogger(__name__)
 SESSIONS_DIR = Path('telegram_sessions')
 SESSIONS_DIR.mkdir(exist_ok=True)
 
-# Кэш клиентов Telegram для разных аккаунтов
+# Кэш клиентов Telegram для разных аккаунтов.
+# Клиенты привязаны к постоянному циклу событий (см. get_loop), поэтому соединения
+# сохраняются между запросами Flask
 clients = {}
 
+# Использовать uvloop для цикла событий, если он установлен
+TELEGRAM_UVLOOP = os.environ.get('TELEGRAM_UVLOOP', '1').lower() in ('1', 'true', 'yes')
+
+# Постоянный цикл событий, в котором выполняются все операции с Telegram,
+# и поток, в котором он работает
+_loop = None
+_loop_thread = None
+_loop_lock = threading.Lock()
+
+# Сколько секунд помнить, что имя пользователя или телефон не найдены в Telegram
+# (повторные попытки в течение этого времени не отправляют запросов)
+TELEGRAM_PEER_NEGATIVE_TTL = int(os.environ.get('TELEGRAM_PEER_NEGATIVE_TTL', 3600))
+
+# Сколько секунд клиент, запросивший код подтверждения, ждет входа по этому коду
+TELEGRAM_PENDING_AUTH_TTL = int(os.environ.get('TELEGRAM_PENDING_AUTH_TTL', 600))
+
+# (номер телефона, phone_code_hash) -> {'client', 'password_needed'}: подключенные клиенты,
+# запросившие код подтверждения. Вход по коду и паролю 2FA выполняется тем же клиентом,
+# без нового подключения
+_pending_auth = {}
+
+def peer_key(entity):
+    """
+    Ключ кэша сущностей (models.get_peer) для ID, имени пользователя (@name) или телефона (+7...)
+    """
+    if isinstance(entity, int) or entity.lstrip('-').isdigit():
+        return f'id:{int(entity)}'
+    entity = entity.strip()
+    if entity.startswith('+'):
+        return 'phone:' + ''.join(filter(str.isdigit, entity))
+    return 'username:' + entity.lstrip('@').lower()
+
+def contacts_hash(user_ids, saved_count=0):
+    """
+    Хэш списка контактов для contacts.getContacts (алгоритм Telegram для 64-битных хэшей).
+    В алгоритм передается сначала saved_count из прошлого ответа contacts.contacts,
+    затем не больше 100000 ID пользователей в порядке возрастания. Если список на сервере
+    не изменился, запрос с этим хэшем возвращает contacts.contactsNotModified
+    """
+    mask = (1 << 64) - 1
+    value = 0
+    for item in [saved_count] + sorted(user_ids)[:100000]:
+        value ^= value >> 21
+        value ^= (value << 35) & mask
+        value ^= value >> 4
+        value = (value + item) & mask
+    # В запросе хэш передается как знаковое 64-битное число
+    return value - (1 << 64) if value >= 1 << 63 else value
+
+def _peer_records(entity):
+    """Записи кэша сущностей для пользователя, группы или канала Telegram"""
+    if isinstance(entity, Channel):
+        peer_type = 'channel'
+    elif isinstance(entity, Chat):
+        peer_type = 'chat'
+    else:
+        peer_type = 'user'
+    peer = {
+        'peer_id': entity.id,
+        'peer_type': peer_type,
+        'access_hash': getattr(entity, 'access_hash', None)
+    }
+    records = [dict(peer, key=f'id:{entity.id}')]
+    if getattr(entity, 'username', None):
+        records.append(dict(peer, key=peer_key('@' + entity.username)))
+    if getattr(entity, 'phone', None):
+        records.append(dict(peer, key=peer_key('+' + entity.phone)))
+    return records
+
+def _input_peer(peer):
+    """InputPeer из записи кэша сущностей (без запросов к Telegram)"""
+    if peer['peer_type'] == 'channel':
+        return InputPeerChannel(peer['peer_id'], peer['access_hash'])
+    if peer['peer_type'] == 'chat':
+        return InputPeerChat(peer['peer_id'])
+    return InputPeerUser(peer['peer_id'], peer['access_hash'])
+
+async def _resolve_peer(client, entity, peer=None):
+    """
+    Находит сущность для отправки или чтения сообщений
+    
+    client: Клиент Telegram
+    entity: ID, имя пользователя или телефон
+    peer: Запись кэша сущностей аккаунта для peer_key(entity), если есть
+    Возвращает (InputPeer или None, если сущность не найдена; новые записи для кэша сущностей).
+    Запрос к Telegram отправляется, только если сущности нет ни в кэше, ни в сессии клиента
+    """
+    if peer is not None:
+        if peer['resolved']:
+            return _input_peer(peer), []
+        age = datetime.utcnow() - datetime.fromisoformat(peer['updated_at'])
+        if age.total_seconds() < TELEGRAM_PEER_NEGATIVE_TTL:
+            return None, []
+
+    key = peer_key(entity)
+    if key.startswith('id:'):
+        input_peer = await client.get_input_entity(int(entity))
+        if isinstance(input_peer, InputPeerChannel):
+            record = {'peer_id': input_peer.channel_id, 'peer_type': 'channel', 'access_hash': input_peer.access_hash}
+        elif isinstance(input_peer, InputPeerChat):
+            record = {'peer_id': input_peer.chat_id, 'peer_type': 'chat', 'access_hash': None}
+        elif isinstance(input_peer, InputPeerUser):
+            record = {'peer_id': input_peer.user_id, 'peer_type': 'user', 'access_hash': input_peer.access_hash}
+        else:
+            return input_peer, []
+        return input_peer, [dict(record, key=key)]
+
+    # Имя пользователя или телефон: неудачный поиск тоже запоминаем
+    try:
+        resolved = await client.get_entity(entity)
+    except (UsernameInvalidError, UsernameNotOccupiedError, ValueError):
+        logger.info(f"Сущность {entity} не найдена в Telegram")
+        return None, [{'key': key, 'resolved': False}]
+    return await client.get_input_entity(resolved), _peer_records(resolved)
+
 async def create_telegram_client(phone, api_id, api_hash, session_string=None, session_name=None):
     """
     Создает и возвращает клиент Telegram
@@ -89,6 +221,8 @@ async def create_telegram_client(phone, api_id, api_hash, session_string=None, s
         else:
             # Если не авторизован, возвращаем информацию для дальнейшей авторизации
             logger.info(f"Требуется авторизация для аккаунта {phone}")
+            # Код запросит отдельный клиент (send_code_request) - этот отключаем
+            await client.disconnect()
             
             # Не отправляем код здесь, это будет отдельный шаг
             return {
@@ -110,34 +244,97 @@ async def create_telegram_client(phone, api_id, api_hash, session_string=None, s
         await client.disconnect()
         return {'error': f'Ошибка соединения с Telegram: {str(e)}'}
 
+def _auth_client(phone, api_id, api_hash):
+    """Создает клиент с файловой сессией аккаунта для входа по коду подтверждения"""
+    session_name = ''.join(filter(str.isdigit, phone))
+    return TelegramClient(str(SESSIONS_DIR / session_name), api_id, api_hash)
+
+def _find_pending(phone, api_id, api_hash, phone_code_hash=None):
+    """
+    Ищет подключенный клиент, ожидающий входа по коду (для phone_code_hash или любого кода этого телефона)
+    Возвращает (ключ, запись) или (None, None)
+    """
+    for key, pending in _pending_auth.items():
+        client = pending['client']
+        if key[0] == phone and (phone_code_hash is None or key[1] == phone_code_hash) \
+                and client.api_id == api_id and client.api_hash == api_hash and client.is_connected():
+            return key, pending
+    return None, None
+
+def _park_pending(phone, phone_code_hash, client, password_needed=False):
+    """Оставляет клиент подключенным до входа по коду, но не дольше TELEGRAM_PENDING_AUTH_TTL секунд"""
+    key = (phone, phone_code_hash)
+    is_new = key not in _pending_auth
+    _pending_auth[key] = {'client': client, 'password_needed': password_needed}
+    if is_new:
+        asyncio.get_running_loop().call_later(
+            TELEGRAM_PENDING_AUTH_TTL, lambda: asyncio.ensure_future(_expire_pending(key, client))
+        )
+
+async def _expire_pending(key, client):
+    """Отключает клиент, так и не дождавшийся входа по коду"""
+    pending = _pending_auth.get(key)
+    if pending is not None and pending['client'] is client:
+        del _pending_auth[key]
+        logger.info(f"Истекло время ожидания кода подтверждения для {key[0]}")
+        await client.disconnect()
+
+async def _drop_pending(key, client):
+    """Удаляет клиент из ожидающих входа и отключает его"""
+    if key is not None:
+        _pending_auth.pop(key, None)
+    await client.disconnect()
+
+def _auth_result(client, phone, user):
+    """Результат успешного входа: клиент сохраняется в кэше, возвращаются строка сессии и данные пользователя"""
+    clients[phone] = client
+    return {
+        'success': True,
+        'authorized': True,
+        'session_string': StringSession.save(client.session),
+        'user_info': {
+            'id': user.id,
+            'first_name': user.first_name,
+            'last_name': user.last_name,
+            'username': user.username,
+            'phone': user.phone
+        }
+    }
+
 async def send_code_request(phone, api_id, api_hash):
     """
-    Отправляет запрос на получение кода подтверждения
+    Отправляет запрос на получение кода подтверждения.
+    Клиент остается подключенным до входа по коду (см. sign_in_with_code)
     
     phone: Номер телефона аккаунта
     api_id: API ID из my.telegram.org
     api_hash: API Hash из my.telegram.org
     """
-    session_name = ''.join(filter(str.isdigit, phone))
-    session_path = SESSIONS_DIR / session_name
-    
-    # Создаем клиент
-    client = TelegramClient(str(session_path), api_id, api_hash)
+    # Повторный запрос кода отправляется клиентом, который уже ждет входа
+    key, pending = _find_pending(phone, api_id, api_hash)
+    if pending is not None:
+        del _pending_auth[key]
+        client = pending['client']
+    else:
+        client = _auth_client(phone, api_id, api_hash)
     
     try:
-        # Подключаемся
-        await client.connect()
-        
-        # Если уже авторизован, возвращаем успех
-        if await client.is_user_authorized():
-            return {
-                'success': True,
-                'message': 'Аккаунт уже авторизован',
-                'authorized': True
-            }
+        if pending is None:
+            # Подключаемся
+            await client.connect()
+            
+            # Если уже авторизован, возвращаем успех
+            if await client.is_user_authorized():
+                await client.disconnect()
+                return {
+                    'success': True,
+                    'message': 'Аккаунт уже авторизован',
+                    'authorized': True
+                }
         
         # Отправляем запрос на код
         sent = await client.send_code_request(phone)
+        _park_pending(phone, sent.phone_code_hash, client)
         
         # Сохраняем информацию о типе отправки (SMS, звонок и т.д.)
         return {
@@ -160,9 +357,18 @@ async def send_code_request(phone, api_id, api_hash):
         await client.disconnect()
         return {'error': f'Ошибка при отправке кода: {str(e)}'}
 
+def _wrong_password():
+    """Ответ на неверный пароль 2FA: форма ввода пароля остается открытой"""
+    return {
+        'error': 'Неверный пароль двухфакторной аутентификации',
+        'two_factor_required': True
+    }
+
 async def sign_in_with_code(phone, code, phone_code_hash, api_id, api_hash, password=None):
     """
-    Выполняет вход в аккаунт с использованием кода подтверждения
+    Выполняет вход в аккаунт с использованием кода подтверждения.
+    Используется клиент, запросивший код (send_code_request), а если его нет
+    (истекло время ожидания, код запрошен в другом процессе) - новое подключение
     
     phone: Номер телефона аккаунта
     code: Код подтверждения, полученный по SMS или через Telegram
@@ -171,90 +377,54 @@ async def sign_in_with_code(phone, code, phone_code_hash, api_id, api_hash, pass
     api_hash: API Hash из my.telegram.org
     password: Пароль двухфакторной аутентификации (если требуется)
     """
-    session_name = ''.join(filter(str.isdigit, phone))
-    session_path = SESSIONS_DIR / session_name
-    
-    # Создаем клиент
-    client = TelegramClient(str(session_path), api_id, api_hash)
+    key, pending = _find_pending(phone, api_id, api_hash, phone_code_hash)
+    client = pending['client'] if pending is not None else _auth_client(phone, api_id, api_hash)
     
     try:
-        # Подключаемся
-        await client.connect()
-        
-        # Если уже авторизован, возвращаем успех
-        if await client.is_user_authorized():
-            clients[phone] = client
+        if pending is None:
+            # Подключаемся
+            await client.connect()
             
-            # Получаем информацию о пользователе
-            me = await client.get_me()
-            
-            # Создаем строку сессии для сохранения
-            session_string = StringSession.save(client.session)
-            
-            return {
-                'success': True, 
-                'authorized': True,
-                'session_string': session_string,
-                'user_info': {
-                    'id': me.id,
-                    'first_name': me.first_name,
-                    'last_name': me.last_name,
-                    'username': me.username,
-                    'phone': me.phone
-                }
-            }
+            # Если уже авторизован, возвращаем успех
+            if await client.is_user_authorized():
+                return _auth_result(client, phone, await client.get_me())
         
         try:
-            # Пытаемся войти с кодом
-            user = await client.sign_in(phone, code, phone_code_hash=phone_code_hash)
-            
-            # Сохраняем клиент в кэше
-            clients[phone] = client
+            if pending is not None and pending['password_needed'] and password:
+                # Код уже принят этим клиентом - остается пароль 2FA
+                user = await client.sign_in(password=password)
+            else:
+                # Пытаемся войти с кодом
+                user = await client.sign_in(phone, code, phone_code_hash=phone_code_hash)
             
-            # Создаем строку сессии для сохранения
-            session_string = StringSession.save(client.session)
-            
-            return {
-                'success': True,
-                'authorized': True,
-                'session_string': session_string,
-                'user_info': {
-                    'id': user.id,
-                    'first_name': user.first_name,
-                    'last_name': user.last_name,
-                    'username': user.username,
-                    'phone': user.phone
-                }
-            }
+            # Клиент авторизован и больше не ждет входа
+            _pending_auth.pop(key, None)
+            return _auth_result(client, phone, user)
             
         except PhoneCodeInvalidError:
+            # Код можно ввести повторно тем же клиентом
+            _park_pending(phone, phone_code_hash, client)
             return {'error': 'Неверный код подтверждения'}
             
+        except PasswordHashInvalidError:
+            # Код принят, пароль можно ввести повторно тем же клиентом
+            _park_pending(phone, phone_code_hash, client, password_needed=True)
+            return _wrong_password()
+            
         except SessionPasswordNeededError:
             # Если требуется пароль 2FA
             if password:
                 # Пытаемся войти с паролем
-                user = await client.sign_in(password=password)
-                
-                # Сохраняем клиент в кэше
-                clients[phone] = client
-                
-                # Создаем строку сессии для сохранения
-                session_string = StringSession.save(client.session)
-                
-                return {
-                    'success': True,
-                    'authorized': True,
-                    'session_string': session_string,
-                    'user_info': {
-                        'id': user.id,
-                        'first_name': user.first_name,
-                        'last_name': user.last_name,
-                        'username': user.username,
-                        'phone': user.phone
-                    }
-                }
+                try:
+                    user = await client.sign_in(password=password)
+                except PasswordHashInvalidError:
+                    _park_pending(phone, phone_code_hash, client, password_needed=True)
+                    return _wrong_password()
+                _pending_auth.pop(key, None)
+                return _auth_result(client, phone, user)
             else:
+                # Пароль будет отправлен следующим запросом этому же клиенту
+                _park_pending(phone, phone_code_hash, client, password_needed=True)
                 return {
                     'error': 'Требуется пароль двухфакторной аутентификации',
                     'two_factor_required': True
@@ -262,14 +432,17 @@ async def sign_in_with_code(phone, code, phone_code_hash, api_id, api_hash, pass
     
     except Exception as e:
         logger.error(f"Ошибка при входе с кодом: {str(e)}")
-        await client.disconnect()
+        await _drop_pending(key, client)
         return {'error': f'Ошибка при входе: {str(e)}'}
 
-async def get_contacts(phone):
+async def get_contacts(phone, known_hash=None):
     """
     Получает список контактов из Telegram
     
     phone: Номер телефона аккаунта
+    known_hash: Хэш списка контактов на момент прошлой синхронизации.
+    Если список не изменился, Telegram не передает его повторно и возвращается unchanged=True
+    Возвращает также hash для следующей синхронизации
     """
     if phone not in clients:
         return {'error': 'Аккаунт не авторизован'}
@@ -277,8 +450,20 @@ async def get_contacts(phone):
     client = clients[phone]
     
     try:
+        result = await client(GetContactsRequest(hash=known_hash or 0))
+        if isinstance(result, ContactsNotModified):
+            return {
+                'success': True,
+                'unchanged': True,
+                'contacts': [],
+                'peers': [],
+                'hash': known_hash
+            }
+        
         contacts = []
-        async for contact in client.iter_contacts():
+        peers = []
+        for contact in result.users:
+            peers.extend(_peer_records(contact))
             contacts.append({
                 'id': contact.id,
                 'first_name': contact.first_name,
@@ -289,19 +474,27 @@ async def get_contacts(phone):
         
         return {
             'success': True,
-            'contacts': contacts
+            'contacts': contacts,
+            'peers': peers,
+            'saved_count': result.saved_count,
+            'hash': contacts_hash((contact.user_id for contact in result.contacts), result.saved_count)
         }
     
     except Exception as e:
         logger.error(f"Ошибка при получении контактов: {str(e)}")
         return {'error': f'Ошибка при получении контактов: {str(e)}'}
 
-async def get_dialogs(phone, limit=100):
+async def get_dialogs(phone, limit=100, pts=None, since=None):
     """
     Получает список диалогов (чатов) из Telegram
     
     phone: Номер телефона аккаунта
     limit: Максимальное количество диалогов для получения
+    pts: Состояние обновлений аккаунта (pts) на момент прошлой синхронизации.
+    Если оно не изменилось, диалоги не запрашиваются и возвращается unchanged=True
+    since: Дата самого нового диалога на момент прошлой синхронизации (ISO).
+    Если после нее изменилось больше limit диалогов, загрузка продолжается до этой даты
+    Возвращает также pts и date для следующей синхронизации
     """
     if phone not in clients:
         return {'error': 'Аккаунт не авторизован'}
@@ -309,11 +502,36 @@ async def get_dialogs(phone, limit=100):
     client = clients[phone]
     
     try:
+        # Любое новое, измененное или прочитанное сообщение в личных чатах меняет pts:
+        # если он прежний, диалоги не изменились
+        state = await client(GetStateRequest())
+        if pts is not None and state.pts == pts:
+            return {
+                'success': True,
+                'unchanged': True,
+                'dialogs': [],
+                'peers': [],
+                'pts': state.pts,
+                'date': since
+            }
+        
         dialogs = []
-        async for dialog in client.iter_dialogs(limit=limit):
+        peers = []
+        newest = since
+        count = 0
+        async for dialog in client.iter_dialogs(limit=None if since else limit):
+            count += 1
+            date = dialog.date.isoformat() if dialog.date else None
+            # Диалоги идут от новых к старым (закрепленные - первыми)
+            if since and count > limit and not dialog.pinned and (date is None or date <= since):
+                break
+            if date and (newest is None or date > newest):
+                newest = date
+            
             # Проверяем, является ли диалог чатом с пользователем (не группой, не каналом)
             if dialog.is_user:
                 entity = dialog.entity
+                peers.extend(_peer_records(entity))
                 
                 # Формируем информацию о диалоге
                 dialog_info = {
@@ -323,7 +541,7 @@ async def get_dialogs(phone, limit=100):
                     'username': getattr(entity, 'username', None),
                     'unread_count': dialog.unread_count,
                     'last_message': None,
-                    'date': dialog.date.isoformat() if dialog.date else None
+                    'date': date
                 }
                 
                 # Добавляем имя в зависимости от доступных атрибутов
@@ -345,20 +563,27 @@ async def get_dialogs(phone, limit=100):
         
         return {
             'success': True,
-            'dialogs': dialogs
+            'dialogs': dialogs,
+            'peers': peers,
+            'pts': state.pts,
+            'date': newest
         }
     
     except Exception as e:
         logger.error(f"Ошибка при получении диалогов: {str(e)}")
         return {'error': f'Ошибка при получении диалогов: {str(e)}'}
 
-async def get_messages(phone, entity_id, limit=100):
+async def get_messages(phone, entity_id, limit=100, peer=None, min_id=0):
     """
     Получает сообщения из указанного диалога
     
     phone: Номер телефона аккаунта
     entity_id: ID сущности (пользователя, группы, канала)
     limit: Максимальное количество сообщений для получения
+    min_id: ID последнего уже синхронизированного сообщения. Если указан, загружаются только
+    более новые сообщения, начиная с самых старых (остальные - при следующем вызове)
+    peer: Запись кэша сущностей для entity_id (models.get_peer), если есть.
+    Новые записи для кэша возвращаются в поле peers
     """
     if phone not in clients:
         return {'error': 'Аккаунт не авторизован'}
@@ -366,11 +591,14 @@ async def get_messages(phone, entity_id, limit=100):
     client = clients[phone]
     
     try:
-        # Получаем сущность по ID
-        entity = await client.get_entity(entity_id)
+        # Получаем сущность по ID (из кэша, без отдельного запроса)
+        entity, peers = await _resolve_peer(client, entity_id, peer)
+        if entity is None:
+            return {'error': f'Сущность {entity_id} не найдена в Telegram', 'peers': peers}
         
         messages = []
-        async for message in client.iter_messages(entity, limit=limit):
+        # Без min_id - последние limit сообщений, с min_id - следующие limit сообщений после него
+        async for message in client.iter_messages(entity, limit=limit, min_id=min_id, reverse=bool(min_id)):
             message_info = {
                 'id': message.id,
                 'text': message.text,
@@ -382,26 +610,29 @@ async def get_messages(phone, entity_id, limit=100):
             
             messages.append(message_info)
         
-        # Сортируем сообщения по дате (от самых старых к новым)
-        messages.sort(key=lambda x: x['date'])
+        # Сортируем сообщения от самых старых к новым
+        messages.sort(key=lambda x: x['id'])
         
         return {
             'success': True,
             'entity_id': entity_id,
-            'messages': messages
+            'messages': messages,
+            'peers': peers
         }
     
     except Exception as e:
         logger.error(f"Ошибка при получении сообщений: {str(e)}")
         return {'error': f'Ошибка при получении сообщений: {str(e)}'}
 
-async def send_message_to_contact(phone, contact_id, message):
+async def send_message_to_contact(phone, contact_id, message, peer=None):
     """
     Отправляет сообщение контакту
     
     phone: Номер телефона аккаунта
-    contact_id: ID контакта в Telegram
+    contact_id: ID, имя пользователя или телефон контакта в Telegram
     message: Текст сообщения
+    peer: Запись кэша сущностей для contact_id (models.get_peer), если есть.
+    Новые записи для кэша возвращаются в поле peers
     """
     if phone not in clients:
         return {'error': 'Аккаунт не авторизован'}
@@ -409,29 +640,115 @@ async def send_message_to_contact(phone, contact_id, message):
     client = clients[phone]
     
     try:
-        # Отправляем сообщение
-        entity = await client.get_entity(contact_id)
+        # Отправляем сообщение (сущность берется из кэша, без отдельного запроса)
+        entity, peers = await _resolve_peer(client, contact_id, peer)
+        if entity is None:
+            return {'error': f'Контакт {contact_id} не найден в Telegram', 'peers': peers}
         sent_message = await client.send_message(entity, message)
         
         return {
             'success': True,
             'message_id': sent_message.id,
-            'date': sent_message.date.isoformat()
+            'date': sent_message.date.isoformat(),
+            'peers': peers
         }
     
+    except FloodWaitError as e:
+        # Telegram ограничил частоту отправки: повторить можно через flood_wait секунд
+        logger.warning(f"Ограничение частоты отправки для {phone}: {e.seconds} сек.")
+        return {'error': f'Слишком частая отправка, повторите через {e.seconds} сек.', 'flood_wait': e.seconds}
+    
     except Exception as e:
         logger.error(f"Ошибка при отправке сообщения: {str(e)}")
         return {'error': f'Ошибка при отправке сообщения: {str(e)}'}
 
-def run_async(coroutine):
+def _run_loop(loop):
+    """Тело потока цикла событий"""
+    asyncio.set_event_loop(loop)
+    loop.run_forever()
+
+def get_loop():
+    """
+    Возвращает постоянный цикл событий для операций с Telegram.
+    Цикл создается при первом обращении и работает в отдельном фоновом потоке
+    """
+    global _loop, _loop_thread
+    with _loop_lock:
+        if _loop is None:
+            if uvloop is not None and TELEGRAM_UVLOOP:
+                _loop = uvloop.new_event_loop()
+            else:
+                _loop = asyncio.new_event_loop()
+            _loop_thread = threading.Thread(target=_run_loop, args=(_loop,), name='telegram-loop', daemon=True)
+            _loop_thread.start()
+            logger.info(f"Запущен цикл событий Telegram ({'uvloop' if uvloop is not None and TELEGRAM_UVLOOP else 'asyncio'})")
+        return _loop
+
+def _reset_loop_after_fork():
+    """В дочернем процессе (воркер gunicorn) поток цикла не существует - начинаем заново"""
+    global _loop, _loop_thread, _loop_lock
+    _loop = None
+    _loop_thread = None
+    _loop_lock = threading.Lock()
+    clients.clear()
+    _pending_auth.clear()
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=_reset_loop_after_fork)
+
+def submit(coroutine):
     """
-    Утилита для запуска асинхронных функций в синхронном контексте
+    Запускает корутину в постоянном цикле событий из любого потока
     
     coroutine: Асинхронная функция (корутина)
+    Возвращает concurrent.futures.Future с результатом
     """
-    loop = asyncio.new_event_loop()
-    asyncio.set_event_loop(loop)
+    return asyncio.run_coroutine_threadsafe(coroutine, get_loop())
+
+def run_async(coroutine, timeout=None):
+    """
+    Утилита для запуска асинхронных функций в синхронном контексте:
+    выполняет корутину в постоянном цикле событий и ждет результат
+    
+    coroutine: Асинхронная функция (корутина)
+    timeout: Максимальное время ожидания в секундах (по умолчанию без ограничения)
+    """
+    if threading.current_thread() is _loop_thread:
+        # Ожидание из потока цикла заблокировало бы его навсегда
+        coroutine.close()
+        raise RuntimeError("run_async нельзя вызывать из цикла событий Telegram, используйте await")
+    return submit(coroutine).result(timeout)
+
+async def _disconnect_all():
+    """Отключает все кэшированные клиенты и клиенты, ожидающие кода подтверждения"""
+    for phone, client in list(clients.items()):
+        try:
+            await client.disconnect()
+        except Exception as e:
+            logger.warning(f"Ошибка при отключении клиента {phone}: {str(e)}")
+    clients.clear()
+    for (phone, _), pending in list(_pending_auth.items()):
+        try:
+            await pending['client'].disconnect()
+        except Exception as e:
+            logger.warning(f"Ошибка при отключении клиента {phone}, ожидающего кода: {str(e)}")
+    _pending_auth.clear()
+
+def shutdown(timeout=5):
+    """Отключает клиентов и останавливает цикл событий (вызывается при остановке процесса)"""
+    global _loop, _loop_thread
+    with _loop_lock:
+        loop, thread = _loop, _loop_thread
+        _loop = _loop_thread = None
+    if loop is None:
+        return
     try:
-        return loop.run_until_complete(coroutine)
-    finally:
-        loop.close()
\ No newline at end of file
+        asyncio.run_coroutine_threadsafe(_disconnect_all(), loop).result(timeout)
+    except Exception as e:
+        logger.warning(f"Не удалось корректно отключить клиентов Telegram: {str(e)}")
+    loop.call_soon_threadsafe(loop.stop)
+    thread.join(timeout)
+    if not thread.is_alive():
+        loop.close()
+
+atexit.register(shutdown)
\ No newline at end of file
@@ -0,0 +1,266 @@
+import os
+import logging
+import asyncio
+import time
+from collections import OrderedDict
+
+from backend import telegram_updates
+from backend.models import get_authorized_telegram_accounts
+from backend.telegram_api import clients, create_telegram_client, get_loop, submit
+
+# Пул подключенных клиентов Telegram, ключ - ID аккаунта в нашей базе.
+# Все функции модуля выполняются в постоянном цикле событий telegram_api
+# (через run_async/submit или await из других корутин этого цикла).
+# Пул поддерживает словарь telegram_api.clients (по номеру телефона) в актуальном состоянии,
+# поэтому функции telegram_api, которые принимают номер телефона, работают с клиентами пула
+
+logger = logging.getLogger(__name__)
+
+# Максимальное количество одновременно подключенных клиентов.
+# При превышении отключается клиент, который дольше всех не использовался
+TELEGRAM_POOL_MAX_CLIENTS = int(os.environ.get('TELEGRAM_POOL_MAX_CLIENTS', 100))
+
+# Через сколько секунд без обращений клиент отключается
+TELEGRAM_POOL_IDLE_TIMEOUT = int(os.environ.get('TELEGRAM_POOL_IDLE_TIMEOUT', 1800))
+
+# Интервал проверки соединений (запрос состояния обновлений, переподключение, отключение простаивающих), в секундах
+TELEGRAM_KEEPALIVE_INTERVAL = int(os.environ.get('TELEGRAM_KEEPALIVE_INTERVAL', 60))
+
+# Подключать авторизованные аккаунты при запуске процесса (прогрев пула), а не при первом запросе
+TELEGRAM_WARMUP = os.environ.get('TELEGRAM_WARMUP', '0').lower() in ('1', 'true', 'yes')
+
+# Сколько аккаунтов подключается одновременно при прогреве
+TELEGRAM_WARMUP_CONCURRENCY = int(os.environ.get('TELEGRAM_WARMUP_CONCURRENCY', 10))
+
+# ID аккаунта -> {'client', 'phone', 'user_info', 'last_used', 'handlers', 'catch_up'} в порядке последнего использования
+_pool = OrderedDict()
+
+# ID аккаунта -> asyncio.Lock, чтобы один аккаунт не подключался двумя запросами одновременно
+_locks = {}
+
+# Фоновая задача проверки соединений
+_keepalive_task = None
+
+# Ход прогрева пула: status - idle (не запускался), running или done
+_warmup = {'status': 'idle', 'total': 0, 'connected': 0, 'failed': 0}
+
+def _lock_for(account_id):
+    """Возвращает блокировку аккаунта"""
+    lock = _locks.get(account_id)
+    if lock is None:
+        lock = _locks[account_id] = asyncio.Lock()
+    return lock
+
+def _touch(account_id):
+    """Отмечает использование клиента"""
+    _pool[account_id]['last_used'] = time.monotonic()
+    _pool.move_to_end(account_id)
+
+def touch(account_id):
+    """
+    Отмечает использование клиента из любого потока, чтобы он не был отключен как простаивающий
+    (например, пока открыт поток событий /api/telegram/stream)
+    """
+    get_loop().call_soon_threadsafe(_touch_if_pooled, account_id)
+
+def _touch_if_pooled(account_id):
+    """Отмечает использование клиента, если он еще в пуле"""
+    if account_id in _pool:
+        _touch(account_id)
+
+def _add(account_id, phone, client, user_info=None):
+    """
+    Добавляет подключенный клиент в пул, подписывает его на обновления
+    и в фоне загружает обновления, пропущенные, пока аккаунт был отключен
+    """
+    global _keepalive_task
+    entry = _pool.get(account_id)
+    if entry is not None and entry['client'] is client:
+        entry['user_info'] = user_info or entry['user_info']
+        _touch(account_id)
+        return
+    _pool[account_id] = {
+        'client': client,
+        'phone': phone,
+        'user_info': user_info,
+        'last_used': time.monotonic(),
+        'handlers': telegram_updates.attach(client, account_id),
+        'catch_up': asyncio.ensure_future(telegram_updates.catch_up(client, account_id))
+    }
+    _pool.move_to_end(account_id)
+    clients[phone] = client
+    if _keepalive_task is None or _keepalive_task.done():
+        _keepalive_task = asyncio.ensure_future(_keepalive())
+
+async def _remove(account_id):
+    """Удаляет клиент из пула и отключает его"""
+    entry = _pool.pop(account_id, None)
+    if entry is None:
+        return
+    if clients.get(entry['phone']) is entry['client']:
+        del clients[entry['phone']]
+    lock = _locks.get(account_id)
+    if lock is not None and not lock.locked():
+        del _locks[account_id]
+    telegram_updates.detach(entry['client'], entry['handlers'])
+    entry['catch_up'].cancel()
+    try:
+        await entry['client'].disconnect()
+    except Exception as e:
+        logger.warning(f"Ошибка при отключении клиента аккаунта {account_id}: {str(e)}")
+
+async def _enforce_limit():
+    """Отключает давно не использовавшиеся клиенты сверх TELEGRAM_POOL_MAX_CLIENTS"""
+    while len(_pool) > TELEGRAM_POOL_MAX_CLIENTS:
+        account_id = next(iter(_pool))
+        logger.info(f"Пул клиентов заполнен, отключаем аккаунт {account_id}")
+        await _remove(account_id)
+
+async def get_client(account):
+    """
+    Возвращает подключенный клиент аккаунта, подключаясь только при его отсутствии в пуле
+
+    account: Аккаунт из базы данных (id, phone, api_id, api_hash, session_string)
+    Возвращает словарь как create_telegram_client: success, authorized, user_info
+    (и client, если аккаунт авторизован) или error
+    """
+    account_id = account['id']
+    async with _lock_for(account_id):
+        entry = _pool.get(account_id)
+        if entry is not None:
+            if entry['client'].is_connected():
+                _touch(account_id)
+                return {
+                    'success': True,
+                    'authorized': True,
+                    'user_info': entry['user_info'],
+                    'client': entry['client']
+                }
+            # Соединение потеряно - подключаемся заново
+            await _remove(account_id)
+
+        result = await create_telegram_client(
+            account['phone'],
+            account['api_id'],
+            account['api_hash'],
+            session_string=account.get('session_string')
+        )
+        if result.get('success') and result.get('authorized'):
+            client = clients[account['phone']]
+            _add(account_id, account['phone'], client, result.get('user_info'))
+            result = dict(result, client=client)
+            await _enforce_limit()
+        return result
+
+async def register(account_id, phone, user_info=None):
+    """
+    Добавляет в пул клиент, уже авторизованный другим способом (например, входом по коду)
+
+    account_id: ID аккаунта в нашей базе
+    phone: Номер телефона аккаунта (клиент берется из telegram_api.clients)
+    user_info: Информация о пользователе Telegram
+    """
+    client = clients.get(phone)
+    if client is None:
+        return
+    async with _lock_for(account_id):
+        entry = _pool.get(account_id)
+        if entry is not None and entry['client'] is not client:
+            await _remove(account_id)
+            clients[phone] = client
+        _add(account_id, phone, client, user_info)
+    await _enforce_limit()
+
+async def evict(account_id):
+    """Отключает клиент аккаунта и удаляет его из пула"""
+    async with _lock_for(account_id):
+        await _remove(account_id)
+
+async def close_all():
+    """Отключает все клиенты пула"""
+    for account_id in list(_pool):
+        await _remove(account_id)
+
+def stats():
+    """Состояние пула (для мониторинга)"""
+    return {
+        'clients': len(_pool),
+        'max_clients': TELEGRAM_POOL_MAX_CLIENTS,
+        'connected': sum(1 for entry in _pool.values() if entry['client'].is_connected())
+    }
+
+def warm_up_status():
+    """Ход прогрева пула (для /api/health)"""
+    return dict(_warmup)
+
+def start_warm_up():
+    """
+    Запускает в фоне прогрев пула, если он включен (TELEGRAM_WARMUP=1): подключает аккаунты
+    с сохраненной сессией, чтобы первые запросы после запуска не ждали подключения
+    """
+    if not TELEGRAM_WARMUP or _warmup['status'] != 'idle':
+        return
+    # Больше TELEGRAM_POOL_MAX_CLIENTS подключать нет смысла - лишние будут сразу вытеснены
+    accounts = get_authorized_telegram_accounts()[:TELEGRAM_POOL_MAX_CLIENTS]
+    _warmup.update(status='running', total=len(accounts))
+    submit(_warm_up(accounts))
+
+async def _warm_up(accounts):
+    """Подключает аккаунты, не больше TELEGRAM_WARMUP_CONCURRENCY одновременно"""
+    semaphore = asyncio.Semaphore(TELEGRAM_WARMUP_CONCURRENCY)
+
+    async def connect(account):
+        async with semaphore:
+            try:
+                result = await get_client(account)
+            except Exception as e:
+                result = {'error': str(e)}
+        if result.get('success') and result.get('authorized'):
+            _warmup['connected'] += 1
+        else:
+            _warmup['failed'] += 1
+            logger.warning(f"Не удалось подключить аккаунт {account['id']} при прогреве пула: "
+                           f"{result.get('error', 'аккаунт не авторизован')}")
+
+    await asyncio.gather(*(connect(account) for account in accounts))
+    _warmup['status'] = 'done'
+    logger.info(f"Прогрев пула завершен: подключено {_warmup['connected']} из {_warmup['total']}")
+
+async def _check(account_id):
+    """Проверяет соединение клиента: отключает простаивающий, переподключает потерянный"""
+    async with _lock_for(account_id):
+        entry = _pool.get(account_id)
+        if entry is None:
+            return
+        if time.monotonic() - entry['last_used'] > TELEGRAM_POOL_IDLE_TIMEOUT:
+            logger.info(f"Отключаем простаивающий клиент аккаунта {account_id}")
+            await _remove(account_id)
+            return
+        client = entry['client']
+        try:
+            if not client.is_connected():
+                logger.info(f"Переподключаем клиент аккаунта {account_id}")
+                await client.connect()
+            # Запрос состояния обновлений проверяет соединение и сохраняет состояние для catch_up
+            await telegram_updates.save_state(client, account_id)
+        except Exception as e:
+            logger.warning(f"Соединение аккаунта {account_id} недоступно, клиент отключен: {str(e)}")
+            await _remove(account_id)
+
+async def _keepalive():
+    """Фоновая проверка соединений, пока в пуле есть клиенты"""
+    while _pool:
+        await asyncio.sleep(TELEGRAM_KEEPALIVE_INTERVAL)
+        for account_id in list(_pool):
+            await _check(account_id)
+
+def _reset_after_fork():
+    """В дочернем процессе пул начинается заново (клиенты принадлежат родителю)"""
+    global _keepalive_task
+    _pool.clear()
+    _locks.clear()
+    _keepalive_task = None
+    _warmup.update(status='idle', total=0, connected=0, failed=0)
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=_reset_after_fork)
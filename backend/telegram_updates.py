@@ -0,0 +1,212 @@
+import os
+import asyncio
+import logging
+from telethon import events
+from telethon.tl.functions.updates import GetStateRequest, GetDifferenceRequest
+from telethon.tl.types import Message, PeerUser, UpdateEditMessage
+from telethon.tl.types.updates import Difference, DifferenceSlice, DifferenceTooLong
+
+from backend import event_stream
+from backend.models import (
+    batch, get_telegram_account, get_chat_by_telegram_id, save_dialogs,
+    save_messages_bulk, edit_message_by_telegram_id, get_sync_state, update_sync_state
+)
+
+# Обработчики обновлений Telegram для клиентов из пула (backend/telegram_pool.py).
+# Новые и измененные сообщения личных чатов сразу записываются в хранилище
+# и отправляются браузерам пользователя через backend/event_stream.py.
+# Состояние обновлений аккаунта (pts, qts, date, seq) хранится в sync_state['updates'],
+# и после перезапуска пропущенные обновления загружаются через updates.getDifference
+
+logger = logging.getLogger(__name__)
+
+# ID аккаунта -> asyncio.Lock: обработчики Telethon выполняются параллельно,
+# а сообщения аккаунта сохраняются по порядку
+_locks = {}
+
+def _lock_for(account_id):
+    """Возвращает блокировку аккаунта"""
+    lock = _locks.get(account_id)
+    if lock is None:
+        lock = _locks[account_id] = asyncio.Lock()
+    return lock
+
+def attach(client, account_id):
+    """
+    Подписывает клиент аккаунта на новые и измененные сообщения
+
+    client: Клиент Telegram из пула
+    account_id: ID аккаунта в нашей базе
+    Возвращает список обработчиков для detach
+    """
+    async def on_new_message(event):
+        async with _lock_for(account_id):
+            await _on_message(account_id, event, edited=False)
+
+    async def on_message_edited(event):
+        async with _lock_for(account_id):
+            await _on_message(account_id, event, edited=True)
+
+    handlers = [(on_new_message, events.NewMessage()), (on_message_edited, events.MessageEdited())]
+    for callback, event_builder in handlers:
+        client.add_event_handler(callback, event_builder)
+    return handlers
+
+def detach(client, handlers):
+    """Отписывает клиент от обновлений, на которые он был подписан через attach"""
+    for callback, event_builder in handlers:
+        client.remove_event_handler(callback, event_builder)
+
+async def _on_message(account_id, event, edited):
+    """Сохраняет сообщение из обновления и уведомляет подписчиков"""
+    # Как и при синхронизации диалогов, работаем только с личными чатами
+    if not event.is_private:
+        return
+
+    # Сущность собеседника приходит вместе с обновлением, обычно без отдельного запроса
+    entity = None if edited else await event.get_chat()
+    dialog, message = _parse(event.message, entity)
+    await _store_async(account_id, dialog, message, edited)
+
+def _parse(message, entity=None):
+    """
+    Словари диалога и сообщения для _store
+
+    message: Сообщение Telethon из личного чата
+    entity: Пользователь-собеседник (для имени нового контакта), если известен
+    """
+    dialog = {'telegram_id': message.peer_id.user_id, 'telegram_entity_id': message.peer_id.user_id}
+    if entity is not None:
+        dialog['name'] = ' '.join(filter(None, [getattr(entity, 'first_name', None),
+                                                getattr(entity, 'last_name', None)]))
+    return dialog, {
+        'telegram_id': message.id,
+        # У сообщений из updates.getDifference нет клиента для форматирования text - берем исходный текст
+        'text': message.text or message.message or '',
+        'out': message.out,
+        'date': message.date.isoformat() if message.date else None
+    }
+
+async def _store_async(account_id, dialog, message, edited):
+    """Вызывает _store вне цикла событий (запись в хранилище блокирует поток)"""
+    try:
+        await asyncio.get_running_loop().run_in_executor(None, _store, account_id, dialog, message, edited)
+    except Exception as e:
+        logger.error(f"Ошибка при сохранении сообщения из обновления аккаунта {account_id}: {str(e)}")
+
+def _store(account_id, dialog, message, edited):
+    """Записывает сообщение в хранилище и публикует изменения чата и сообщения"""
+    account = get_telegram_account(account_id)
+    if account is None:
+        return
+    user_id = account['user_id']
+    chat = get_chat_by_telegram_id(account_id, dialog['telegram_id'])
+
+    if edited:
+        # Изменения сообщений, которых еще нет в базе, придут при следующей синхронизации
+        if chat is None:
+            return
+        message_id = edit_message_by_telegram_id(chat['id'], message['telegram_id'], message['text'])
+        if message_id is not None:
+            event_stream.publish(user_id, 'message', {
+                'id': message_id,
+                'chat_id': chat['id'],
+                'text': message['text'],
+                'telegram_id': message['telegram_id'],
+                'edited': True
+            })
+        return
+
+    created = chat is None
+    with batch():
+        if created:
+            # Первое сообщение в новом диалоге - создаем контакт и чат
+            save_dialogs(account_id, [dict(dialog, last_message='', unread_count=0)])
+            chat = get_chat_by_telegram_id(account_id, dialog['telegram_id'])
+        sender_id = user_id if message['out'] else chat['contact_id']
+        message_id = save_messages_bulk(chat['id'], [{
+            'sender_id': sender_id,
+            'text': message['text'],
+            'telegram_id': message['telegram_id']
+        }])[0]
+
+    event_stream.publish(user_id, 'message', {
+        'id': message_id,
+        'chat_id': chat['id'],
+        'sender_id': sender_id,
+        'text': message['text'],
+        'timestamp': message['date'],
+        'telegram_id': message['telegram_id']
+    })
+    chat = dict(get_chat_by_telegram_id(account_id, dialog['telegram_id']))
+    if created:
+        chat['contact'] = {'id': chat['contact_id'], 'name': dialog.get('name') or 'Неизвестный контакт'}
+    event_stream.publish(user_id, 'chat', chat)
+
+def _state_dict(state):
+    """Состояние обновлений Telegram (updates.State) в виде словаря для sync_state"""
+    return {'pts': state.pts, 'qts': state.qts, 'date': int(state.date.timestamp()), 'seq': state.seq}
+
+async def save_state(client, account_id):
+    """
+    Запрашивает текущее состояние обновлений аккаунта и сохраняет его.
+    Запрос легкий, поэтому пул использует его и для проверки соединения
+    """
+    # Ждем, пока обрабатываемые сейчас обновления будут сохранены
+    async with _lock_for(account_id):
+        state = _state_dict(await client(GetStateRequest()))
+        # Запись выполняется, только если состояние изменилось
+        await asyncio.get_running_loop().run_in_executor(None, lambda: update_sync_state(account_id, updates=state))
+
+async def catch_up(client, account_id):
+    """
+    Загружает обновления, пропущенные, пока клиент аккаунта был отключен (например, при перезапуске),
+    и сохраняет их так же, как обновления, пришедшие в реальном времени.
+    Вызывается после подключения клиента, когда обработчики attach уже зарегистрированы
+    """
+    loop = asyncio.get_running_loop()
+    try:
+        state = (await loop.run_in_executor(None, get_sync_state, account_id)).get('updates')
+        if not state:
+            # Аккаунт подключается впервые - запоминаем состояние, с которого начнем в следующий раз
+            await save_state(client, account_id)
+            return
+
+        async with _lock_for(account_id):
+            while True:
+                difference = await client(GetDifferenceRequest(
+                    pts=state['pts'], date=state['date'], qts=state['qts']
+                ))
+                if isinstance(difference, DifferenceTooLong):
+                    # Пропущено слишком много - остальное загрузит обычная синхронизация диалогов и сообщений
+                    logger.info(f"Слишком много пропущенных обновлений аккаунта {account_id}, пропускаем их")
+                    break
+                if not isinstance(difference, (Difference, DifferenceSlice)):
+                    # updates.differenceEmpty - ничего не пропущено
+                    break
+                await _store_difference(account_id, difference)
+                if isinstance(difference, Difference):
+                    state = _state_dict(difference.state)
+                    break
+                # Часть пропущенных обновлений - продолжаем с промежуточного состояния
+                state = _state_dict(difference.intermediate_state)
+                await loop.run_in_executor(None, lambda: update_sync_state(account_id, updates=state))
+
+        await save_state(client, account_id)
+    except Exception as e:
+        logger.warning(f"Не удалось загрузить пропущенные обновления аккаунта {account_id}: {str(e)}")
+
+async def _store_difference(account_id, difference):
+    """Сохраняет новые и измененные сообщения личных чатов из ответа updates.getDifference"""
+    users = {user.id: user for user in difference.users}
+    messages = [(message, False) for message in difference.new_messages]
+    messages += [(update.message, True) for update in difference.other_updates
+                 if isinstance(update, UpdateEditMessage)]
+    for message, edited in messages:
+        if isinstance(message, Message) and isinstance(message.peer_id, PeerUser):
+            dialog, fields = _parse(message, users.get(message.peer_id.user_id))
+            await _store_async(account_id, dialog, fields, edited)
+
+if hasattr(os, 'register_at_fork'):
+    # Блокировки принадлежат циклу событий родительского процесса
+    os.register_at_fork(after_in_child=_locks.clear)
@@ -0,0 +1,93 @@
+# Сравнение форматов снимка JSON-хранилища: прежний JSON с отступами
+# и компактный формат backend/snapshot.py (без сжатия, gzip, zstd).
+# Для каждого количества сообщений выводит размер файла и время записи и чтения.
+#
+# Запуск из корня проекта:
+#     python benchmarks/snapshot_formats.py [количество сообщений ...]
+# По умолчанию: 10000 100000 1000000
+import json
+import os
+import random
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from backend import snapshot as snapshot_format
+
+WORDS = ['привет', 'как', 'дела', 'встреча', 'завтра', 'отправляю', 'документ', 'спасибо',
+         'hello', 'meeting', 'price', 'ok', 'да', 'нет', 'созвонимся', 'в', 'на', 'по']
+
+
+def make_messages(count):
+    """Сгенерировать коллекцию сообщений в том виде, в котором она хранится в снимке"""
+    rng = random.Random(count)
+    messages = {}
+    for message_id in range(1, count + 1):
+        messages[str(message_id)] = {
+            'id': message_id,
+            'chat_id': rng.randint(1, 200),
+            'sender_id': rng.randint(0, 500),
+            'text': ' '.join(rng.choice(WORDS) for _ in range(rng.randint(2, 20))),
+            'timestamp': f'2024-{rng.randint(1, 12):02d}-{rng.randint(1, 28):02d}T'
+                         f'{rng.randint(0, 23):02d}:{rng.randint(0, 59):02d}:{rng.randint(0, 59):02d}.000000',
+            'is_read': rng.random() < 0.5,
+            'telegram_id': rng.randint(1, 10 ** 6)
+        }
+    return messages
+
+
+def save_legacy(path, records):
+    with open(path, 'w', encoding='utf-8') as f:
+        json.dump(records, f, ensure_ascii=False, indent=2)
+
+
+def load_legacy(path):
+    with open(path, 'r', encoding='utf-8') as f:
+        return json.load(f)
+
+
+def save_compact(path, records, compression):
+    with open(path, 'wb') as f:
+        f.write(snapshot_format.encode(records, compression))
+
+
+def load_compact(path):
+    with open(path, 'rb') as f:
+        return snapshot_format.decode(f.read())
+
+
+def measure(fn, *args):
+    started = time.perf_counter()
+    result = fn(*args)
+    return time.perf_counter() - started, result
+
+
+def main():
+    counts = [int(arg) for arg in sys.argv[1:]] or [10000, 100000, 1000000]
+    formats = [('json indent=2 (прежний)', lambda path, records: save_legacy(path, records), load_legacy)]
+    compressions = ['none', 'gzip'] + (['zstd'] if snapshot_format.zstandard is not None else [])
+    for compression in compressions:
+        formats.append((f'snap {compression}',
+                        lambda path, records, compression=compression: save_compact(path, records, compression),
+                        load_compact))
+
+    print(f"JSON: {'orjson' if snapshot_format.orjson is not None else 'json'}; "
+          f"zstd: {'есть' if snapshot_format.zstandard is not None else 'нет (pip install zstandard)'}")
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        for count in counts:
+            records = make_messages(count)
+            print(f"\n{count} сообщений")
+            print(f"{'формат':<26}{'размер, МБ':>12}{'запись, с':>12}{'чтение, с':>12}")
+            for name, save, load in formats:
+                path = os.path.join(tmp_dir, 'snapshot')
+                save_time, _ = measure(save, path, records)
+                size = os.path.getsize(path) / 1024 / 1024
+                load_time, loaded = measure(load, path)
+                assert loaded == records
+                print(f"{name:<26}{size:>12.2f}{save_time:>12.3f}{load_time:>12.3f}")
+
+
+if __name__ == '__main__':
+    main()
@@ -1,5 +1,17 @@
 import React, { useState, useEffect, useRef } from 'react';
 import api from '../api';
+import config from '../config';
+
+// Добавляет новые сообщения и обновляет уже загруженные (сообщения упорядочены по ID)
+const mergeMessages = (prevMessages, incoming) => {
+  const incomingById = new Map(incoming.map(message => [message.id, message]));
+  const merged = prevMessages.map(message => (
+    incomingById.has(message.id) ? { ...message, ...incomingById.get(message.id) } : message
+  ));
+  const known = new Set(prevMessages.map(message => message.id));
+  const added = incoming.filter(message => !known.has(message.id));
+  return added.length ? merged.concat(added).sort((a, b) => a.id - b.id) : merged;
+};
 
 function ChatWindow({ account }) {
   const [chats, setChats] = useState([]);
@@ -9,22 +21,92 @@ function ChatWindow({ account }) {
   const [loading, setLoading] = useState(true);
   const [error, setError] = useState('');
   
+  const [resyncToken, setResyncToken] = useState(0);
+  // Курсор более старых сообщений (next_cursor последней загруженной страницы истории)
+  const [olderCursor, setOlderCursor] = useState(null);
+  const [loadingOlder, setLoadingOlder] = useState(false);
+  
   const messagesEndRef = useRef(null);
+  // ID последнего полученного сообщения выбранного чата: опрос запрашивает только более новые
+  const lastMessageIdRef = useRef(null);
+  // Открыт ли поток событий: пока он работает, периодический опрос не нужен
+  const streamOpenRef = useRef(false);
+  const selectedChatRef = useRef(null);
+  
+  useEffect(() => {
+    selectedChatRef.current = selectedChat;
+  }, [selectedChat]);
+
+  // Поток событий: новые сообщения и изменения чатов приходят сразу, без опроса сервера
+  useEffect(() => {
+    if (!account || typeof EventSource === 'undefined') return;
+    
+    const token = localStorage.getItem('access_token');
+    const source = new EventSource(`${config.API_URL}/api/telegram/stream?jwt=${encodeURIComponent(token)}`);
+    
+    source.onopen = () => { streamOpenRef.current = true; };
+    source.onerror = () => { streamOpenRef.current = false; };
+    
+    source.addEventListener('chat', (e) => {
+      const changedChat = JSON.parse(e.data);
+      if (changedChat.account_id !== account.id) return;
+      
+      setChats(prevChats => {
+        if (!prevChats.some(chat => chat.id === changedChat.id)) {
+          return [...prevChats, changedChat];
+        }
+        return prevChats.map(chat => chat.id === changedChat.id ? { ...chat, ...changedChat } : chat);
+      });
+    });
+    
+    source.addEventListener('message', (e) => {
+      const message = JSON.parse(e.data);
+      if (selectedChatRef.current?.id !== message.chat_id) return;
+      
+      lastMessageIdRef.current = Math.max(lastMessageIdRef.current || 0, message.id);
+      setMessages(prevMessages => mergeMessages(prevMessages, [message]));
+    });
+    
+    // Часть событий пропущена - перезагружаем чаты и сообщения целиком
+    source.addEventListener('resync', () => setResyncToken(n => n + 1));
+    
+    return () => {
+      source.close();
+      streamOpenRef.current = false;
+    };
+  }, [account]);
 
   // Получение списка чатов при изменении аккаунта
   useEffect(() => {
-    const fetchChats = async () => {
-      if (!account) return;
+    // Курсор синхронизации: после первой загрузки запрашиваем только измененные чаты
+    let syncCursor = null;
+    
+    const fetchChats = async (poll = false) => {
+      if (!account || (poll && streamOpenRef.current)) return;
       
       try {
-        setLoading(true);
-        const response = await api.get(`/api/telegram/chats?account_id=${account.id}`);
-        setChats(response.data.chats);
+        if (!syncCursor) setLoading(true);
+        const since = syncCursor ? `&since=${encodeURIComponent(syncCursor)}` : '';
+        const response = await api.get(`/api/telegram/chats?account_id=${account.id}${since}`);
+        const changedChats = response.data.chats;
         
-        // Выбираем первый чат по умолчанию
-        if (response.data.chats.length > 0 && !selectedChat) {
-          setSelectedChat(response.data.chats[0]);
+        if (syncCursor) {
+          // Обновляем измененные чаты и добавляем новые
+          setChats(prevChats => {
+            const changedById = new Map(changedChats.map(chat => [chat.id, chat]));
+            const merged = prevChats.map(chat => changedById.get(chat.id) || chat);
+            const known = new Set(prevChats.map(chat => chat.id));
+            return merged.concat(changedChats.filter(chat => !known.has(chat.id)));
+          });
+        } else {
+          setChats(changedChats);
+          
+          // Выбираем первый чат по умолчанию
+          if (changedChats.length > 0 && !selectedChat) {
+            setSelectedChat(changedChats[0]);
+          }
         }
+        syncCursor = response.data.sync_cursor;
       } catch (err) {
         setError('Не удалось загрузить чаты');
         console.error(err);
@@ -35,40 +117,85 @@ function ChatWindow({ account }) {
     
     fetchChats();
     
-    // Интервал для обновления списка чатов
-    const interval = setInterval(fetchChats, 10000);
+    // Интервал для обновления списка чатов (если поток событий недоступен)
+    const interval = setInterval(() => fetchChats(true), 10000);
     
     return () => clearInterval(interval);
-  }, [account]);
+  }, [account, resyncToken]);
+
+  // Загрузка сообщений новее последнего полученного (все страницы после after_id)
+  const fetchNewMessages = async (chatId) => {
+    let cursor = lastMessageIdRef.current;
+    while (cursor !== null) {
+      const response = await api.get(`/api/telegram/messages?chat_id=${chatId}&after_id=${cursor}`);
+      if (selectedChatRef.current?.id !== chatId) return;
+      const { messages: newMessages, next_cursor: nextCursor } = response.data;
+      if (newMessages.length) {
+        cursor = Math.max(cursor, newMessages[newMessages.length - 1].id);
+        lastMessageIdRef.current = Math.max(lastMessageIdRef.current || 0, cursor);
+        setMessages(prevMessages => mergeMessages(prevMessages, newMessages));
+      }
+      cursor = nextCursor;
+    }
+  };
 
   // Получение сообщений выбранного чата
   useEffect(() => {
-    const fetchMessages = async () => {
-      if (!selectedChat) return;
+    const fetchMessages = async (poll = false) => {
+      if (!selectedChat || (poll && streamOpenRef.current)) return;
       
       try {
-        const response = await api.get(`/api/telegram/messages?chat_id=${selectedChat.id}`);
-        setMessages(response.data.messages);
+        if (poll && lastMessageIdRef.current !== null) {
+          await fetchNewMessages(selectedChat.id);
+          return;
+        }
         
-        // Прокручиваем к последнему сообщению
-        messagesEndRef.current?.scrollIntoView({ behavior: 'smooth' });
+        // Последняя страница истории; более старые загружаются по кнопке
+        const response = await api.get(`/api/telegram/messages?chat_id=${selectedChat.id}`);
+        if (selectedChatRef.current?.id !== selectedChat.id) return;
+        const pageMessages = response.data.messages;
+        setMessages(pageMessages);
+        setOlderCursor(response.data.next_cursor);
+        lastMessageIdRef.current = pageMessages.length ? pageMessages[pageMessages.length - 1].id : 0;
       } catch (err) {
         console.error('Не удалось загрузить сообщения', err);
       }
     };
     
+    setMessages([]);
+    setOlderCursor(null);
+    lastMessageIdRef.current = null;
     fetchMessages();
     
-    // Интервал для обновления сообщений
-    const interval = setInterval(fetchMessages, 5000);
+    // Интервал для обновления сообщений (если поток событий недоступен)
+    const interval = setInterval(() => fetchMessages(true), 5000);
     
     return () => clearInterval(interval);
-  }, [selectedChat]);
+  }, [selectedChat, resyncToken]);
+
+  // Загрузка предыдущей страницы истории
+  const handleLoadOlder = async () => {
+    if (!selectedChat || !olderCursor || loadingOlder) return;
+    
+    const chatId = selectedChat.id;
+    setLoadingOlder(true);
+    try {
+      const response = await api.get(`/api/telegram/messages?chat_id=${chatId}&before_id=${olderCursor}`);
+      if (selectedChatRef.current?.id !== chatId) return;
+      setMessages(prevMessages => mergeMessages(prevMessages, response.data.messages));
+      setOlderCursor(response.data.next_cursor);
+    } catch (err) {
+      console.error('Не удалось загрузить более старые сообщения', err);
+    } finally {
+      setLoadingOlder(false);
+    }
+  };
 
-  // Прокрутка к последнему сообщению при его добавлении
+  // Прокрутка к последнему сообщению при его добавлении (но не при загрузке старых)
+  const lastMessageId = messages.length ? messages[messages.length - 1].id : null;
   useEffect(() => {
     messagesEndRef.current?.scrollIntoView({ behavior: 'smooth' });
-  }, [messages]);
+  }, [lastMessageId]);
 
   // Обработчик отправки сообщения
   const handleSendMessage = async (e) => {
@@ -85,9 +212,10 @@ function ChatWindow({ account }) {
       // Очищаем поле ввода
       setNewMessage('');
       
-      // Обновляем сообщения сразу после отправки
-      const response = await api.get(`/api/telegram/messages?chat_id=${selectedChat.id}`);
-      setMessages(response.data.messages);
+      // Получаем отправленное сообщение сразу после отправки
+      if (lastMessageIdRef.current !== null) {
+        await fetchNewMessages(selectedChat.id);
+      }
     } catch (err) {
       console.error('Не удалось отправить сообщение', err);
     }
@@ -179,6 +307,18 @@ function ChatWindow({ account }) {
         </div>
         
         <div className="messages-list">
+          {olderCursor && (
+            <div className="messages-load-older">
+              <button
+                type="button"
+                className="btn btn-link btn-sm"
+                onClick={handleLoadOlder}
+                disabled={loadingOlder}
+              >
+                {loadingOlder ? 'Загрузка...' : 'Загрузить более ранние сообщения'}
+              </button>
+            </div>
+          )}
           {messages.length === 0 ? (
             <div className="no-messages">
               <p>Нет сообщений</p>
@@ -42,6 +42,23 @@ function MassSending({ account }) {
     fetchData();
   }, [account]);
 
+  // Пока есть незавершенные рассылки, обновляем их ход (рассылки выполняются на сервере в фоне)
+  const hasUnfinished = massSendings.some(sending => ['queued', 'in_progress'].includes(sending.status));
+  useEffect(() => {
+    if (!account || !hasUnfinished) return;
+    
+    const interval = setInterval(async () => {
+      try {
+        const sendings = await api.get(`/api/telegram/mass-sendings?account_id=${account.id}`);
+        setMassSendings(sendings.data.mass_sendings);
+      } catch (err) {
+        console.error(err);
+      }
+    }, 10000);
+    
+    return () => clearInterval(interval);
+  }, [account, hasUnfinished]);
+
   // Обработчик добавления новой массовой рассылки
   const handleAddMassSending = async (e) => {
     e.preventDefault();
@@ -169,14 +186,19 @@ function MassSending({ account }) {
                 <td>{massSending.frequency} сообщ/мин</td>
                 <td>{massSending.delay} сек</td>
                 <td>
-                  <span className={`badge ${massSending.status === 'completed' ? 'bg-success' : massSending.status === 'pending' ? 'bg-warning' : 'bg-primary'}`}>
-                    {massSending.status === 'pending' ? 'В ожидании' : 
+                  <span className={`badge ${massSending.status === 'completed' ? 'bg-success' : massSending.status === 'queued' ? 'bg-warning' : massSending.status === 'draft' ? 'bg-secondary' : massSending.status === 'failed' ? 'bg-danger' : 'bg-primary'}`}>
+                    {massSending.status === 'queued' ? 'В очереди' : 
+                     massSending.status === 'draft' ? 'Черновик' : 
                      massSending.status === 'in_progress' ? 'Выполняется' : 
                      massSending.status === 'completed' ? 'Завершено' : 
+                     massSending.status === 'failed' ? 'Ошибка' : 
                      massSending.status}
                   </span>
                 </td>
-                <td>{massSending.sent_count || 0}</td>
+                <td>
+                  {massSending.sent_count || 0}
+                  {massSending.failed_count > 0 && ` (ошибок: ${massSending.failed_count})`}
+                </td>
               </tr>
             ))}
           </tbody>
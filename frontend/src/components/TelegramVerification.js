@@ -99,7 +99,7 @@ function TelegramVerification({ account, onSuccess, onCancel }) {
       if (responseData?.two_factor_required) {
         // Если требуется двухфакторная аутентификация
         setRequiresTwoFactor(true);
-        setError('Требуется пароль двухфакторной аутентификации');
+        setError(responseData.error || 'Требуется пароль двухфакторной аутентификации');
       } else {
         setError(responseData?.error || 'Произошла ошибка при проверке кода');
       }
@@ -0,0 +1,60 @@
+# Настройки gunicorn (файл подхватывается автоматически при запуске из корня проекта).
+#
+# Запросы к Telegram выполняются в общем цикле событий backend.telegram_api, а поток обработчика
+# только ждет результат. Поэтому воркер работает в режиме gthread: каждый запрос обслуживается
+# отдельным потоком, и один медленный вызов Telegram не задерживает остальных пользователей -
+# сотни одновременных запросов к Telegram обслуживаются одним процессом и одним циклом событий.
+import os
+import sys
+
+workers = int(os.environ.get('WEB_CONCURRENCY', 1))
+worker_class = 'gthread'
+
+# Количество одновременно обрабатываемых запросов в одном воркере
+threads = int(os.environ.get('GUNICORN_THREADS', 100))
+
+
+def on_starting(server):
+    # Клиенты Telegram, их прогрев и проверка здоровья принадлежат процессу: при нескольких воркерах
+    # прогретым был бы пул только одного из них, а /api/health остальных не отражал бы прогрев
+    warm_up = os.environ.get('TELEGRAM_WARMUP', '0').lower() in ('1', 'true', 'yes')
+    if warm_up and server.cfg.workers > 1:
+        raise RuntimeError(f"Прогрев пула (TELEGRAM_WARMUP=1) работает только с одним воркером "
+                           f"(сейчас {server.cfg.workers}): задайте WEB_CONCURRENCY=1 или TELEGRAM_WARMUP=0")
+
+    # Подписчики потока событий /api/telegram/stream живут в памяти процесса, а события приходят
+    # от клиентов Telegram в пуле того же процесса. При нескольких воркерах поток выключается
+    # (браузер опрашивает сервер), чтобы вкладки не теряли события и не подключали аккаунты повторно
+    if server.cfg.workers > 1:
+        os.environ['EVENT_STREAM_MAX_SUBSCRIBERS'] = '0'
+        if 'backend.event_stream' in sys.modules:
+            sys.modules['backend.event_stream'].EVENT_STREAM_MAX_SUBSCRIBERS = 0
+        server.log.info(f"Воркеров: {server.cfg.workers}, поток событий выключен, интерфейс опрашивает сервер")
+
+    # JSON-хранилище держит данные в памяти процесса: несколько воркеров без общего режима
+    # затирали бы изменения друг друга при сворачивании журнала и выполняли бы одни и те же рассылки.
+    # Поэтому при нескольких воркерах общий режим (STORAGE_SHARED) включается автоматически,
+    # а явно выключенный - запуск останавливается
+    if server.cfg.workers <= 1 or os.environ.get('STORAGE_ENGINE', 'json').lower() != 'json':
+        return
+    shared = os.environ.get('STORAGE_SHARED')
+    if shared is None:
+        if 'backend.models' in sys.modules:
+            # Приложение уже загружено (--preload) с хранилищем одного процесса
+            raise RuntimeError("При нескольких воркерах и --preload задайте STORAGE_SHARED=1 "
+                               "или STORAGE_ENGINE=sqlite")
+        os.environ['STORAGE_SHARED'] = '1'
+        server.log.info(f"Воркеров: {server.cfg.workers}, JSON-хранилище работает в общем режиме (STORAGE_SHARED=1)")
+    elif shared.lower() not in ('1', 'true', 'yes'):
+        raise RuntimeError(f"JSON-хранилище без STORAGE_SHARED не поддерживает несколько воркеров "
+                           f"({server.cfg.workers}): задайте STORAGE_SHARED=1, STORAGE_ENGINE=sqlite "
+                           f"или WEB_CONCURRENCY=1")
+
+
+def post_worker_init(worker):
+    # Прогреваем пул клиентов Telegram после загрузки приложения
+    # (только при TELEGRAM_WARMUP=1, ход прогрева виден в /api/health)
+    from backend import mass_sending, telegram_pool
+    telegram_pool.start_warm_up()
+    # Продолжаем незавершенные массовые рассылки (в том числе прерванные перезапуском)
+    mass_sending.start()
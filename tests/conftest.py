@@ -0,0 +1,8 @@
+# Хранилище (backend/models.py) читает и пишет файлы относительно текущего каталога
+# сразу при импорте, поэтому тесты работают во временном каталоге
+import os
+import sys
+import tempfile
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.chdir(tempfile.mkdtemp(prefix='tgm-tests-'))
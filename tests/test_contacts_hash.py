@@ -0,0 +1,42 @@
+from backend.telegram_api import contacts_hash
+
+
+def _telegram_hash(values):
+    """Алгоритм из документации Telegram в арифметике знаковых 64-битных чисел (long)"""
+    def to_long(value):
+        value &= (1 << 64) - 1
+        return value - (1 << 64) if value >= 1 << 63 else value
+
+    def unsigned_shift(value, bits):
+        return (value & ((1 << 64) - 1)) >> bits
+
+    result = 0
+    for value in values:
+        result = to_long(result ^ unsigned_shift(result, 21))
+        result = to_long(result ^ (result << 35))
+        result = to_long(result ^ unsigned_shift(result, 4))
+        result = to_long(result + value)
+    return result
+
+
+def test_known_vectors():
+    # saved_count = 0, ID 3 и 5: 0 -> 3 -> (3 ^ 3 << 35 ^ ...) + 5
+    assert contacts_hash([5, 3]) == 109521666056
+    # saved_count передается первым и не сортируется вместе с ID
+    assert contacts_hash([1], saved_count=2) == 73014444035
+    assert contacts_hash([], saved_count=0) == 0
+
+
+def test_saved_count_goes_first():
+    assert contacts_hash([1, 2], saved_count=3) != contacts_hash([1, 3], saved_count=2)
+    assert contacts_hash([10, 20], saved_count=30) == _telegram_hash([30, 10, 20])
+
+
+def test_matches_reference_and_is_signed():
+    user_ids = [777000, 93372553, 1000000000, 2000000000, 5000000000, 7123456789]
+    result = contacts_hash(reversed(user_ids), saved_count=4)
+    assert result == _telegram_hash([4] + user_ids)
+    assert -(1 << 63) <= result < 1 << 63
+    # Хэш со старшим битом передается в запросе отрицательным числом
+    assert contacts_hash([1, 2, 3], saved_count=1) == -3706983547860320121
+    assert contacts_hash([1, 2, 3], saved_count=1) == _telegram_hash([1, 1, 2, 3])
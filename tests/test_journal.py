@@ -0,0 +1,68 @@
+import os
+
+from backend import models
+
+
+def _contact_names(account_id):
+    return {contact['name'] for contact in models.get_contacts(account_id)}
+
+
+def _contact(contact_id):
+    return models.data['contacts'][str(contact_id)]
+
+
+def test_replay_after_crash():
+    contact_id = models.save_contact(1, 'До сбоя', '+70000000001')
+    models.update_statistics(1, sent=7)
+    models.flush()
+    # Процесс остановился посреди записи строки журнала
+    with open(models.JOURNAL_FILE, 'ab') as f:
+        f.write(b'{"entity": "contacts", "id": 999, "rec')
+
+    models.load_data()
+    assert 'До сбоя' in _contact_names(1)
+    assert _contact(contact_id)['phone'] == '+70000000001'
+    assert '999' not in models.data['contacts']
+
+    # Записи после перезапуска не склеиваются с недописанной строкой
+    models.save_contact(1, 'После сбоя', '+70000000002')
+    models.flush()
+    models.load_data()
+    assert {'До сбоя', 'После сбоя'} <= _contact_names(1)
+    assert models.get_next_id('contacts') > contact_id
+
+
+def test_compaction():
+    contact_id = models.save_contact(2, 'Сворачивание', '+70000000003')
+    models.save_data()
+    assert not os.path.exists(models.JOURNAL_FILE)
+    assert not os.path.exists(models.JOURNAL_COMPACTING_FILE)
+    assert os.path.exists(models.DATA_MANIFEST_FILE)
+
+    models.load_data()
+    assert _contact(contact_id)['phone'] == '+70000000003'
+
+    # Изменения после сворачивания применяются из журнала поверх снимка
+    mass_sending_id = models.save_mass_sending(2, 'Текст', [contact_id], 0, 1)
+    models.save_data()
+    models.update_mass_sending(mass_sending_id, status='completed', sent_count=1)
+    models.flush()
+    models.load_data()
+    mass_sending = models.data['mass_sendings'][str(mass_sending_id)]
+    assert (mass_sending['status'], mass_sending['sent_count']) == ('completed', 1)
+
+
+def test_interrupted_compaction():
+    models.save_contact(2, 'Отложенный журнал', '+70000000005')
+    models.flush()
+    # Сворачивание отложило журнал и было прервано, после чего появился новый журнал
+    models._rotate_journal()
+    models.save_contact(2, 'Новый журнал', '+70000000006')
+    models.flush()
+
+    models.load_data()
+    assert {'Отложенный журнал', 'Новый журнал'} <= _contact_names(2)
+    # Прерванное сворачивание завершается при запуске
+    assert not os.path.exists(models.JOURNAL_COMPACTING_FILE)
+    models.load_data()
+    assert {'Отложенный журнал', 'Новый журнал'} <= _contact_names(2)
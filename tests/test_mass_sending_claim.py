@@ -0,0 +1,73 @@
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+import queue
+
+import pytest
+
+from backend import models, sqlite_storage
+
+
+def _drain_pool():
+    while True:
+        try:
+            sqlite_storage._pool.get_nowait().close()
+        except queue.Empty:
+            return
+
+
+@pytest.fixture(params=['json', 'sqlite'])
+def storage(request, tmp_path, monkeypatch):
+    if request.param == 'json':
+        yield models
+        return
+    monkeypatch.setattr(sqlite_storage, 'SQLITE_DATABASE_FILE', str(tmp_path / 'claim.db'))
+    _drain_pool()
+    sqlite_storage.init_db()
+    yield sqlite_storage
+    _drain_pool()
+
+
+def _time(seconds):
+    return models.datetime_to_str(datetime.utcnow() + timedelta(seconds=seconds))
+
+
+def test_second_claim_waits_for_lease(storage):
+    mass_sending_id = storage.save_mass_sending(1, 'Текст', [1, 2], 0, 1, status='queued')
+
+    claimed = storage.claim_mass_sending(mass_sending_id, _time(300))
+    assert claimed['status'] == 'in_progress'
+    assert storage.claim_mass_sending(mass_sending_id, _time(300)) is None
+
+    # Процесс, захвативший рассылку, остановился: после окончания аренды ее можно захватить снова
+    storage.update_mass_sending(mass_sending_id, sent_count=1, locked_until=_time(-1))
+    reclaimed = storage.claim_mass_sending(mass_sending_id, _time(300))
+    assert reclaimed['sent_count'] == 1
+
+
+def test_only_queued_are_claimed(storage):
+    draft_id = storage.save_mass_sending(1, 'Черновик', [1], 0, 1)
+    assert storage.claim_mass_sending(draft_id, _time(300)) is None
+
+    completed_id = storage.save_mass_sending(1, 'Отправлена', [1], 0, 1, status='queued')
+    storage.update_mass_sending(completed_id, status='completed')
+    assert storage.claim_mass_sending(completed_id, _time(300)) is None
+    assert storage.claim_mass_sending(10 ** 9, _time(300)) is None
+
+    unfinished = {mass_sending['id'] for mass_sending in storage.get_unfinished_mass_sendings()}
+    assert draft_id not in unfinished and completed_id not in unfinished
+
+
+def test_concurrent_claims(storage):
+    mass_sending_id = storage.save_mass_sending(1, 'Текст', [1], 0, 1, status='queued')
+    with ThreadPoolExecutor(8) as executor:
+        results = list(executor.map(lambda _: storage.claim_mass_sending(mass_sending_id, _time(300)), range(32)))
+    assert sum(result is not None for result in results) == 1
+
+
+def test_pending_from_mock_sending_becomes_draft():
+    # Рассылки pending созданы до появления исполнителя и не должны уходить после обновления
+    mass_sending_id = models.save_mass_sending(1, 'Старая', [1], 0, 1, status='pending')
+    models.flush()
+    models.load_data()
+    assert models.data['mass_sendings'][str(mass_sending_id)]['status'] == 'draft'
+    assert models.claim_mass_sending(mass_sending_id, _time(300)) is None
@@ -0,0 +1,110 @@
+import random
+
+import pytest
+
+from backend import message_archive
+
+
+@pytest.fixture
+def archive(tmp_path, monkeypatch):
+    # Маленькие пороги, чтобы страницы читались из сегментов, а индексы сохранялись и вытеснялись
+    monkeypatch.setattr(message_archive, 'MESSAGE_HOT_SET_SIZE', 20)
+    monkeypatch.setattr(message_archive, 'ARCHIVE_OPEN_CHATS', 2)
+    monkeypatch.setattr(message_archive, 'ARCHIVE_INDEX_SAVE_LINES', 50)
+    previous = message_archive._directory, message_archive._shared
+    directory = str(tmp_path / 'archive')
+    message_archive.close()
+    message_archive._directory = None
+    message_archive.open_archive(directory)
+    yield directory
+    # Возвращаем архив, открытый хранилищем
+    message_archive.close()
+    message_archive._directory = None
+    if previous[0] is not None:
+        message_archive.open_archive(*previous)
+
+
+def _reopen(directory):
+    message_archive.close()
+    message_archive._directory = None
+    message_archive.open_archive(directory)
+
+
+def _fill(directory, steps=1500):
+    """Случайные новые и отредактированные сообщения в нескольких чатах. Возвращает ожидаемое содержимое"""
+    rng = random.Random(1)
+    expected = {}
+    telegram_ids = {}
+    for step in range(steps):
+        chat_id = rng.randint(1, 4)
+        messages = expected.setdefault(chat_id, {})
+        if messages and rng.random() < 0.15:
+            message_id = rng.choice(list(messages))
+            record = dict(messages[message_id], text=f'edit {step}')
+            message_archive.append(chat_id, [record])
+            messages[message_id] = record
+        else:
+            count = rng.randint(1, 3)
+            first_id = message_archive.allocate_ids(count)
+            records = []
+            for message_id in range(first_id, first_id + count):
+                telegram_id = step * 10 + message_id - first_id if rng.random() < 0.7 else None
+                record = {'id': message_id, 'chat_id': chat_id, 'text': f'message {step}', 'telegram_id': telegram_id}
+                records.append(record)
+                messages[message_id] = record
+                if telegram_id is not None:
+                    telegram_ids[chat_id, telegram_id] = message_id
+            message_archive.append(chat_id, records)
+        if step % 400 == 0:
+            _reopen(directory)
+    return expected, telegram_ids
+
+
+def _check(expected, telegram_ids):
+    for chat_id, messages in expected.items():
+        ordered = [messages[message_id] for message_id in sorted(messages)]
+        assert message_archive.get_all(chat_id) == ordered
+
+        # Страницы от новых к старым
+        pages = []
+        cursor = None
+        while True:
+            page, cursor = message_archive.get_page(chat_id, before_id=cursor, limit=30)
+            pages = page + pages
+            if cursor is None:
+                break
+        assert pages == ordered
+
+        # Страницы от старых к новым
+        pages = []
+        cursor = 0
+        while cursor is not None:
+            page, cursor = message_archive.get_page(chat_id, after_id=cursor, limit=30)
+            pages += page
+        assert pages == ordered
+
+        for message_id in list(messages)[::7]:
+            assert message_archive.get_message(chat_id, message_id) == messages[message_id]
+        assert message_archive.find_by_telegram_id(chat_id, -1) is None
+    for (chat_id, telegram_id), message_id in list(telegram_ids.items())[::5]:
+        assert message_archive.find_by_telegram_id(chat_id, telegram_id) == message_id
+
+
+def test_paging_and_edits(archive):
+    expected, telegram_ids = _fill(archive)
+    _check(expected, telegram_ids)
+
+
+def test_reopen(archive):
+    expected, telegram_ids = _fill(archive)
+    _reopen(archive)
+    _check(expected, telegram_ids)
+
+    # Остановка без сохранения индексов: дописанное после них читается из сегментов
+    message_archive._chats.clear()
+    _reopen(archive)
+    _check(expected, telegram_ids)
+
+    # ID продолжаются после последнего сообщения
+    last_id = max(message_id for messages in expected.values() for message_id in messages)
+    assert message_archive.allocate_ids() > last_id